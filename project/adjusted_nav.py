@@ -0,0 +1,213 @@
+import datetime
+import sqlite3
+import numpy as np
+from init_utils import calculate_split_ratio, get_all_fund_latest_date_from_db
+from nav_archive import iter_nav_rows
+
+
+def create_if_not_exists_adjusted_nav_tables(funds_db_file_path: str):
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+
+    # 创建复权净值表，分红再投资并折算拆分后的净值
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fund_adjusted_nav (
+            fund_id VARCHAR(20),                -- 基金代码
+            value_date DATE,                    -- 净值日期
+            adjusted_nav REAL,                  -- 复权净值 = 单位净值 * 复权因子
+            adjust_factor REAL,                 -- 复权因子，首个净值日为1
+            PRIMARY KEY (fund_id, value_date)
+        ) WITHOUT ROWID
+    ''')
+
+    # 创建已计入复权净值的分红和拆分记录表，用来发现新增的分红和拆分
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fund_adjustment_events (
+            fund_id VARCHAR(20),                -- 基金代码
+            event_date DATE,                    -- 除息日或拆分折算日
+            event_type TEXT,                    -- dividend: 分红, split: 拆分
+            PRIMARY KEY (fund_id, event_date, event_type)
+        ) WITHOUT ROWID
+    ''')
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def compute_adjust_factors(nav_dates, navs, event_dates, event_kinds, event_values, base_factor: float = 1.0):
+    """计算一段净值的复权因子
+
+    分红在除息日按除息后净值再投资：因子乘以 (净值 + 每份分红) / 净值；
+    拆分按折算比例增加份额：因子乘以折算比值。非净值日的事件计入其后第一个净值日。
+
+    Args:
+        nav_dates (np.ndarray): 升序净值日期，datetime64[D]
+        navs (np.ndarray): 单位净值
+        event_dates (np.ndarray): 分红和拆分日期，datetime64[D]
+        event_kinds (np.ndarray): 'dividend'或'split'
+        event_values (np.ndarray): 每份分红或拆分折算比值
+        base_factor (float, optional): 这段净值之前最后一天的复权因子. Defaults to 1.0.
+
+    Returns:
+        np.ndarray: 每个净值日的复权因子
+    """
+    multipliers = np.ones(len(navs))
+    if len(event_dates):
+        rows = np.searchsorted(nav_dates, event_dates, side='left')
+        in_range = rows < len(navs)
+        rows, event_kinds, event_values = rows[in_range], event_kinds[in_range], event_values[in_range]
+
+        is_dividend = event_kinds == 'dividend'
+        event_multipliers = np.where(is_dividend, (navs[rows] + event_values) / navs[rows], event_values)
+        np.multiply.at(multipliers, rows, event_multipliers)
+    return base_factor * np.cumprod(multipliers)
+
+
+def _load_fund_events(cursor, fund_id: str, from_date: str):
+    # 读取某基金from_date及之后的分红和拆分，返回(日期, 类型, 数值)
+    cursor.execute('''
+        SELECT ex_dividend_date, 'dividend', dividend_per_share
+        FROM fund_dividends
+        WHERE fund_id = ? AND ex_dividend_date >= ? AND dividend_per_share IS NOT NULL
+        UNION ALL
+        SELECT split_date, 'split', split_ratio
+        FROM fund_splits
+        WHERE fund_id = ? AND split_date >= ?
+    ''', (fund_id, from_date, fund_id, from_date))
+
+    events = []
+    for event_date, event_kind, value in cursor.fetchall():
+        if event_kind == 'split':
+            try:
+                value = calculate_split_ratio(value)
+            except (ValueError, AttributeError, ZeroDivisionError):
+                print(f"{fund_id} 无法解析拆分比例 {value}，忽略")
+                continue
+        events.append((event_date, event_kind, float(value)))
+    return events
+
+
+def get_funds_to_adjust(cursor):
+    """找出需要更新复权净值的基金及其需要重新计算的起始日期
+
+    起始日期取新增净值的第一天和新增（尚未计入的）分红拆分日期中较早者，该日期及之后的复权净值需要重新计算。
+
+    Returns:
+        dict: {基金代码: 起始日期}
+    """
+    recompute_from = {}
+
+    # 有新净值的基金，从最后一个已复权日期之后开始。最新净值日期包括已归档的净值
+    nav_dates = get_all_fund_latest_date_from_db(cursor, 'fund_nav', 'value_date')
+    adjusted_dates = get_all_fund_latest_date_from_db(cursor, 'fund_adjusted_nav', 'value_date')
+    for fund_id, last_nav_date in nav_dates.items():
+        last_adjusted_date = adjusted_dates.get(fund_id)
+        if last_adjusted_date is not None and last_nav_date <= last_adjusted_date:
+            continue
+        # 空字符串小于任何日期，表示从头计算；否则从最后已复权日期的下一天开始
+        if last_adjusted_date is None:
+            recompute_from[fund_id] = ''
+        else:
+            recompute_from[fund_id] = (datetime.date.fromisoformat(last_adjusted_date) + datetime.timedelta(days=1)).isoformat()
+
+    # 有新分红或拆分的基金，从最早的新事件日期开始
+    cursor.execute('''
+        SELECT events.fund_id, MIN(events.event_date)
+        FROM (
+            SELECT fund_id, ex_dividend_date AS event_date, 'dividend' AS event_type
+            FROM fund_dividends WHERE dividend_per_share IS NOT NULL
+            UNION ALL
+            SELECT fund_id, split_date, 'split' FROM fund_splits
+        ) AS events
+        LEFT JOIN fund_adjustment_events AS applied
+            ON events.fund_id = applied.fund_id AND events.event_date = applied.event_date AND events.event_type = applied.event_type
+        WHERE applied.fund_id IS NULL
+        GROUP BY events.fund_id;
+    ''')
+    for fund_id, first_event_date in cursor.fetchall():
+        recompute_from[fund_id] = min(recompute_from.get(fund_id, first_event_date), first_event_date)
+
+    return recompute_from
+
+
+def update_fund_adjusted_nav(cursor, fund_id: str, from_date: str):
+    """重新计算某基金from_date及之后的复权净值，之前的不变。不提交
+
+    Returns:
+        int: 写入的行数
+    """
+    # 起始日期之前最后一天的复权因子作为基数
+    cursor.execute('''
+        SELECT adjust_factor FROM fund_adjusted_nav
+        WHERE fund_id = ? AND value_date < ?
+        ORDER BY value_date DESC LIMIT 1;
+    ''', (fund_id, from_date))
+    row = cursor.fetchone()
+    base_factor = row[0] if row else 1.0
+
+    # 同时读取已归档的净值
+    nav_rows = [
+        (value_date, nav)
+        for _, value_date, nav in iter_nav_rows(cursor.connection, 'fund_nav', 'nav', [fund_id], start_date=from_date or None)
+        if nav is not None
+    ]
+    events = _load_fund_events(cursor, fund_id, from_date)
+
+    cursor.execute('DELETE FROM fund_adjusted_nav WHERE fund_id = ? AND value_date >= ?', (fund_id, from_date))
+    cursor.executemany('''
+        INSERT OR IGNORE INTO fund_adjustment_events (fund_id, event_date, event_type)
+        VALUES (?, ?, ?)
+    ''', [(fund_id, event_date, event_kind) for event_date, event_kind, _ in events])
+    if not nav_rows:
+        return 0
+
+    value_dates = [value_date for value_date, _ in nav_rows]
+    nav_dates = np.array(value_dates, dtype='datetime64[D]')
+    navs = np.array([nav for _, nav in nav_rows], dtype=float)
+    if events:
+        event_dates = np.array([event[0] for event in events], dtype='datetime64[D]')
+        event_kinds = np.array([event[1] for event in events])
+        event_values = np.array([event[2] for event in events], dtype=float)
+    else:
+        event_dates = np.array([], dtype='datetime64[D]')
+        event_kinds = np.array([], dtype=str)
+        event_values = np.array([], dtype=float)
+
+    factors = compute_adjust_factors(nav_dates, navs, event_dates, event_kinds, event_values, base_factor)
+    cursor.executemany('''
+        INSERT INTO fund_adjusted_nav (fund_id, value_date, adjusted_nav, adjust_factor)
+        VALUES (?, ?, ?, ?)
+    ''', zip([fund_id] * len(value_dates), value_dates, (navs * factors).tolist(), factors.tolist()))
+    return len(value_dates)
+
+
+def save_all_fund_adjusted_nav(funds_db_file_path: str, rebuild: bool = False, commit_batch_size: int = 200):
+    """增量更新fund_adjusted_nav表：只重新计算有新净值或新分红拆分的基金，且只计算受影响的日期及之后部分
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        rebuild (bool, optional): 清空后全部重新计算，历史净值被修正后使用. Defaults to False.
+        commit_batch_size (int, optional): 每处理多少个基金提交一次. Defaults to 200.
+    """
+    create_if_not_exists_adjusted_nav_tables(funds_db_file_path)
+
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+
+    if rebuild:
+        cursor.execute('DELETE FROM fund_adjusted_nav')
+        cursor.execute('DELETE FROM fund_adjustment_events')
+        conn.commit()
+
+    recompute_from = get_funds_to_adjust(cursor)
+    print(f"更新 {len(recompute_from)} 个基金的复权净值")
+
+    for i, fund_id in enumerate(sorted(recompute_from), start=1):
+        update_fund_adjusted_nav(cursor, fund_id, recompute_from[fund_id])
+        if i % commit_batch_size == 0:
+            conn.commit()
+    conn.commit()
+
+    cursor.close()
+    conn.close()
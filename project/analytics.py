@@ -0,0 +1,214 @@
+import sqlite3
+import numpy as np
+from nav_archive import get_nav_fund_ids, iter_nav_rows
+
+# 每年交易日数，用于年化
+trading_days_per_year = 252
+
+# 区间收益率的列名和对应的自然日数
+period_return_days = {
+    'return_1m': 30,
+    'return_3m': 91,
+    'return_6m': 182,
+    'return_1y': 365,
+    'return_3y': 365 * 3,
+}
+
+
+def create_if_not_exists_fund_metrics_table(funds_db_file_path: str):
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+
+    # 创建基金业绩指标表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fund_metrics (
+            fund_id VARCHAR(20) PRIMARY KEY,    -- 基金代码
+            as_of_date DATE,                    -- 计算截止的净值日期
+            return_1m REAL,                     -- 近1月收益率
+            return_3m REAL,                     -- 近3月收益率
+            return_6m REAL,                     -- 近6月收益率
+            return_1y REAL,                     -- 近1年收益率
+            return_3y REAL,                     -- 近3年收益率
+            return_since_start REAL,            -- 区间起始（或成立）以来收益率
+            annual_volatility REAL,             -- 近1年年化波动率
+            sharpe_ratio REAL,                  -- 近1年夏普比率
+            max_drawdown REAL,                  -- 最大回撤（负数）
+            max_drawdown_days INTEGER,          -- 最长回撤持续自然日数（从前高到收复前高或截止日）
+            current_drawdown REAL               -- 当前回撤（负数）
+        )
+    ''')
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def load_nav_matrix(funds_db_file_path: str, fund_ids=None, start_date: str = None, end_date: str = None,
+                    table_name: str = 'fund_cumulative_nav', value_column: str = 'cumulative_nav'):
+    """把净值表读成日期×基金的稠密矩阵，某基金某日无净值时为NaN
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        fund_ids (list, optional): 基金代码，为None时读取全部基金. Defaults to None.
+        start_date (str, optional): 起始日期YYYY-MM-DD（含）. Defaults to None.
+        end_date (str, optional): 截止日期YYYY-MM-DD（含）. Defaults to None.
+        table_name (str, optional): 净值表. Defaults to 'fund_cumulative_nav'.
+        value_column (str, optional): 净值列. Defaults to 'cumulative_nav'.
+
+    Returns:
+        tuple: (dates, fund_ids, matrix)
+            dates: 升序日期 (np.ndarray, datetime64[D])
+            fund_ids: 升序基金代码 (np.ndarray)
+            matrix: 净值 (np.ndarray, float64, shape=(len(dates), len(fund_ids)))
+    """
+    conn = sqlite3.connect(funds_db_file_path)
+    # 同时读取已归档的净值
+    rows = list(iter_nav_rows(conn, table_name, value_column, fund_ids, start_date, end_date))
+    conn.close()
+
+    if not rows:
+        return np.array([], dtype='datetime64[D]'), np.array([], dtype=str), np.empty((0, 0))
+
+    row_fund_ids, row_dates, row_values = zip(*rows)
+    unique_fund_ids, fund_index = np.unique(np.array(row_fund_ids), return_inverse=True)
+    unique_dates, date_index = np.unique(np.array(row_dates, dtype='datetime64[D]'), return_inverse=True)
+
+    matrix = np.full((len(unique_dates), len(unique_fund_ids)), np.nan)
+    matrix[date_index, fund_index] = np.array(row_values, dtype=float)
+    return unique_dates, unique_fund_ids, matrix
+
+
+def forward_fill(matrix):
+    """按列用前一个有效值填充NaN，每列第一个有效值之前仍为NaN"""
+    n_rows, n_cols = matrix.shape
+    valid = ~np.isnan(matrix)
+    last_valid_row = np.where(valid, np.arange(n_rows)[:, None], 0)
+    np.maximum.accumulate(last_valid_row, axis=0, out=last_valid_row)
+    return matrix[last_valid_row, np.arange(n_cols)]
+
+
+def last_valid_rows(matrix):
+    """每列最后一个非NaN值所在的行，整列为NaN时为最后一行"""
+    return len(matrix) - 1 - np.argmax(~np.isnan(matrix[::-1]), axis=0)
+
+
+def compute_fund_metrics(dates, matrix, risk_free_rate: float = 0.0):
+    """对日期×基金净值矩阵整体计算每个基金的业绩和回撤指标
+
+    每个基金只使用截至其最后一个净值日期（即as_of_date）的数据，已停止披露净值的基金
+    不会把最后的净值向后填充到矩阵末尾参与计算。
+
+    Args:
+        dates (np.ndarray): 升序日期，datetime64[D]
+        matrix (np.ndarray): 净值矩阵，shape=(len(dates), 基金数)，无净值处为NaN
+        risk_free_rate (float, optional): 年化无风险利率，计算夏普比率用. Defaults to 0.0.
+
+    Returns:
+        dict: {指标名: 每个基金的指标值 (np.ndarray)}，指标名同fund_metrics表的列
+    """
+    n_rows, n_cols = matrix.shape
+    columns = np.arange(n_cols)
+    missing = np.isnan(matrix)
+    end_row = last_valid_rows(matrix)
+    filled = forward_fill(matrix)
+    # 每个基金最后一个净值之后的位置不填充
+    filled[np.arange(n_rows)[:, None] > end_row] = np.nan
+    last_nav = filled[end_row, columns]
+    day_numbers = dates.astype('datetime64[D]').astype(np.int64)
+    end_day = day_numbers[end_row]
+
+    metrics = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 区间收益率：截止日净值 / 区间起点当日或之前最近的净值 - 1
+        for column, days in period_return_days.items():
+            start_row = np.searchsorted(day_numbers, end_day - days, side='right') - 1
+            metrics[column] = np.where(start_row >= 0, last_nav / filled[np.maximum(start_row, 0), columns] - 1, np.nan)
+
+        first_valid_row = np.argmax(~missing, axis=0)
+        metrics['return_since_start'] = last_nav / filled[first_valid_row, columns] - 1
+
+        # 日收益率，当天没有净值的位置为NaN，不当作0收益
+        daily_returns = filled[1:] / filled[:-1] - 1
+        daily_returns[missing[1:]] = np.nan
+
+        # 近1年年化波动率和夏普比率，daily_returns第i行为第i+1个日期的收益率
+        window_start = np.searchsorted(day_numbers, end_day - 365, side='right')
+        window_returns = np.where(np.arange(n_rows - 1)[:, None] >= window_start - 1, daily_returns, np.nan)
+        counts = np.sum(~np.isnan(window_returns), axis=0)
+        enough = counts >= 2
+        volatility = np.full(n_cols, np.nan)
+        mean_return = np.full(n_cols, np.nan)
+        if enough.any():
+            volatility[enough] = np.nanstd(window_returns[:, enough], axis=0, ddof=1) * np.sqrt(trading_days_per_year)
+            mean_return[enough] = np.nanmean(window_returns[:, enough], axis=0) * trading_days_per_year
+        metrics['annual_volatility'] = volatility
+        metrics['sharpe_ratio'] = np.where(volatility > 0, (mean_return - risk_free_rate) / volatility, np.nan)
+
+        # 回撤：相对此前最高净值的跌幅
+        running_max = np.fmax.accumulate(filled, axis=0)
+        drawdowns = filled / running_max - 1
+        metrics['max_drawdown'] = np.nanmin(drawdowns, axis=0) if n_rows else np.full(n_cols, np.nan)
+        metrics['current_drawdown'] = drawdowns[end_row, columns]
+
+        # 回撤持续时间：每个日期距最近一次创新高的自然日数，取最大值
+        at_peak = filled >= running_max
+        peak_row = np.where(at_peak, np.arange(n_rows)[:, None], 0)
+        np.maximum.accumulate(peak_row, axis=0, out=peak_row)
+        durations = day_numbers[:, None] - day_numbers[peak_row]
+        durations[np.isnan(filled)] = 0
+        metrics['max_drawdown_days'] = durations.max(axis=0)
+
+    return metrics
+
+
+def save_all_fund_metrics(funds_db_file_path: str, start_date: str = None, end_date: str = None,
+                          block_size: int = 2000, risk_free_rate: float = 0.0):
+    """计算所有基金的业绩和回撤指标，存入fund_metrics表
+
+    每次读取block_size个基金的累计净值矩阵整体计算，限制内存占用。
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        start_date (str, optional): 起始日期YYYY-MM-DD，为None时使用全部历史. Defaults to None.
+        end_date (str, optional): 截止日期YYYY-MM-DD. Defaults to None.
+        block_size (int, optional): 每次计算的基金数. Defaults to 2000.
+        risk_free_rate (float, optional): 年化无风险利率. Defaults to 0.0.
+    """
+    create_if_not_exists_fund_metrics_table(funds_db_file_path)
+
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    all_fund_ids = get_nav_fund_ids(cursor, 'fund_cumulative_nav')
+
+    metric_columns = list(period_return_days) + [
+        'return_since_start', 'annual_volatility', 'sharpe_ratio',
+        'max_drawdown', 'max_drawdown_days', 'current_drawdown'
+    ]
+    insert_query = f'''
+        INSERT OR REPLACE INTO fund_metrics (fund_id, as_of_date, {', '.join(metric_columns)})
+        VALUES (?, ?, {', '.join('?' * len(metric_columns))})
+    '''
+
+    for block_start in range(0, len(all_fund_ids), block_size):
+        block_fund_ids = all_fund_ids[block_start:block_start + block_size]
+        dates, fund_ids, matrix = load_nav_matrix(funds_db_file_path, block_fund_ids, start_date, end_date)
+        if len(dates) == 0:
+            continue
+        metrics = compute_fund_metrics(dates, matrix, risk_free_rate)
+
+        # 每个基金最后一个有净值的日期，指标都截至该日期计算
+        as_of_dates = dates[last_valid_rows(matrix)].astype(str).tolist()
+
+        columns = []
+        for column in metric_columns:
+            values = metrics[column].astype(object)
+            values[np.isnan(metrics[column].astype(float))] = None
+            if column == 'max_drawdown_days':
+                values = [None if value is None else int(value) for value in values]
+            columns.append(values)
+        cursor.executemany(insert_query, zip(fund_ids.tolist(), as_of_dates, *columns))
+        conn.commit()
+        print(f"fund_metrics {block_start + len(block_fund_ids)}/{len(all_fund_ids)}")
+
+    cursor.close()
+    conn.close()
@@ -0,0 +1,458 @@
+"""基金数据只读HTTP服务
+
+    python api_server.py --port 8765
+
+接口（均为GET，返回JSON）：
+    /funds/{fund_id}                            基金信息和筛选汇总
+    /funds/{fund_id}/nav?kind=nav&start=&end=   净值序列，kind为nav或cumulative_nav，分块传输
+    /funds/{fund_id}/metrics                    fund_metrics表中的业绩指标
+    /screen?open=1&fund_type=债券型&...          参数同fund_summary.screen_funds
+    /metrics                                    本服务的Prometheus格式指标
+    /health                                     连接池和缓存状态
+
+数据库以只读方式打开，不阻塞写入任务；写入任务提交后缓存全部失效。
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import sqlite3
+import time
+import urllib.parse
+from collections import OrderedDict
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from fund_summary import build_screen_query, summary_columns
+from init_utils import default_db_file_path
+from nav_archive import iter_nav_rows
+
+# 净值接口的kind -> (表名, 净值列名)
+nav_kinds = {
+    'nav': ('fund_nav', 'nav'),
+    'cumulative_nav': ('fund_cumulative_nav', 'cumulative_nav'),
+}
+
+# /screen的查询参数 -> 转换函数
+screen_params = {
+    'open': lambda value: value.lower() in ('1', 'true', 'yes'),
+    'fund_type': str,
+    'max_redemption_period': int,
+    'max_subscription_rate': float,
+    'max_redemption_rate': float,
+    'manager_unchanged_since': str,
+    'min_scale': float,
+    'max_scale': float,
+    'order_by': str,
+    'limit': int,
+}
+
+http_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ReadOnlyConnectionPool:
+    """固定数量的只读SQLite连接，在事件循环线程中取用和归还，取不到连接时异步等待
+
+    等待连接不占用执行器线程：持有连接的请求总能拿到线程执行查询，流式请求长时间持有连接时
+    其他请求只是排队，不会因为线程都在等连接而死锁。
+    """
+
+    def __init__(self, funds_db_file_path: str, size: int = 4, timeout: float = 30):
+        """
+        Args:
+            funds_db_file_path (str): 数据库文件路径
+            size (int, optional): 连接数. Defaults to 4.
+            timeout (float, optional): 数据库被锁时的等待秒数. Defaults to 30.
+        """
+        self.size = size
+        self._connections = asyncio.Queue()
+        uri = f'file:{urllib.parse.quote(str(funds_db_file_path))}?mode=ro'
+        for _ in range(size):
+            # 连接在线程池的不同线程中使用，同一时间只被一个请求持有
+            self._connections.put_nowait(sqlite3.connect(uri, uri=True, timeout=timeout, check_same_thread=False))
+
+    async def acquire(self):
+        return await self._connections.get()
+
+    def release(self, conn):
+        self._connections.put_nowait(conn)
+
+    def available(self):
+        return self._connections.qsize()
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+class LRUCache:
+    """按响应字节数和条目数限制大小的LRU缓存，只在事件循环线程中使用"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entries: int = 10000):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, content_type: str, body: bytes):
+        # 单个响应超过总大小的1/8时不缓存，避免一次挤掉大部分条目
+        if len(body) > self.max_bytes // 8:
+            return
+        old_entry = self._entries.pop(key, None)
+        if old_entry is not None:
+            self.total_bytes -= len(old_entry[1])
+        self._entries[key] = (content_type, body)
+        self.total_bytes += len(body)
+        while self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries:
+            _, (_, evicted_body) = self._entries.popitem(last=False)
+            self.total_bytes -= len(evicted_body)
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+
+def _json_bytes(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _endpoint_label(path: str):
+    # 指标标签中用{fund_id}代替基金代码，避免每个基金产生一组指标
+    parts = path.strip('/').split('/')
+    if len(parts) >= 2 and parts[0] == 'funds':
+        parts[1] = '{fund_id}'
+    return '/' + '/'.join(parts)
+
+
+class FundsApiServer:
+    """基于asyncio.start_server的HTTP/1.1服务，数据库查询在线程池中执行，不阻塞事件循环
+
+    先在事件循环中取得连接，再把用该连接的查询交给线程池，同时执行的查询数不超过连接数，线程池与连接池一样大即可。
+    """
+
+    def __init__(self, funds_db_file_path: str = default_db_file_path, pool_size: int = 4,
+                 cache_max_bytes: int = 64 * 1024 * 1024, nav_chunk_rows: int = 2000, keep_alive_seconds: float = 30):
+        """
+        Args:
+            funds_db_file_path (str, optional): 数据库文件路径. Defaults to default_db_file_path.
+            pool_size (int, optional): 只读连接数，也是同时执行的查询数和线程池的线程数. Defaults to 4.
+            cache_max_bytes (int, optional): 缓存的响应总字节数上限. Defaults to 64MB.
+            nav_chunk_rows (int, optional): 净值序列每块的行数. Defaults to 2000.
+            keep_alive_seconds (float, optional): 空闲连接保持的秒数. Defaults to 30.
+        """
+        self.funds_db_file_path = str(funds_db_file_path)
+        self.pool = ReadOnlyConnectionPool(self.funds_db_file_path, pool_size)
+        self.cache = LRUCache(cache_max_bytes)
+        self.nav_chunk_rows = nav_chunk_rows
+        self.keep_alive_seconds = keep_alive_seconds
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='api-db')
+        # 其他连接提交后PRAGMA data_version会变化，用于判断缓存是否失效
+        self._version_conn = sqlite3.connect(
+            f'file:{urllib.parse.quote(self.funds_db_file_path)}?mode=ro', uri=True, check_same_thread=False
+        )
+        self._data_version = None
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+        self._version_conn.close()
+
+    def _check_data_version(self):
+        # 数据库有新的提交时清空缓存，返回当前版本
+        data_version = self._version_conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version != self._data_version:
+            if self._data_version is not None:
+                metrics.inc('api_cache_invalidations_total')
+            self.cache.clear()
+            self._data_version = data_version
+        return data_version
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    @staticmethod
+    def _execute(conn, query: str, params):
+        cursor = conn.execute(query, params)
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        cursor.close()
+        return columns, rows
+
+    async def _query(self, query: str, params=()):
+        """取得连接后在线程池中执行查询
+
+        Returns:
+            tuple: (列名列表, 行列表)
+        """
+        conn = await self.pool.acquire()
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(self._execute, conn, query, params)
+        # 查询结束后才归还连接：请求被取消时线程中的查询可能还在用这个连接
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.pool.release, conn))
+        return await asyncio.wrap_future(future)
+
+    async def _query_dicts(self, query: str, params=()):
+        columns, rows = await self._query(query, params)
+        return [dict(zip(columns, row)) for row in rows]
+
+    async def get_fund(self, fund_id: str, query_params: dict):
+        funds = await self._query_dicts('SELECT * FROM funds WHERE fund_id = ?', (fund_id,))
+        if not funds:
+            raise HttpError(404, f'fund {fund_id} not found')
+        summaries = await self._query_dicts('SELECT * FROM fund_summary WHERE fund_id = ?', (fund_id,))
+        return 'application/json', _json_bytes({'fund': funds[0], 'summary': summaries[0] if summaries else None})
+
+    async def get_fund_metrics(self, fund_id: str, query_params: dict):
+        try:
+            fund_metrics = await self._query_dicts('SELECT * FROM fund_metrics WHERE fund_id = ?', (fund_id,))
+        except sqlite3.OperationalError as e:
+            raise HttpError(404, f'fund_metrics not available: {e}')
+        if not fund_metrics:
+            raise HttpError(404, f'no metrics for fund {fund_id}')
+        return 'application/json', _json_bytes(fund_metrics[0])
+
+    async def screen(self, query_params: dict):
+        kwargs = {}
+        for name, value in query_params.items():
+            if name not in screen_params:
+                raise HttpError(400, f'unknown parameter {name}, expected one of {list(screen_params)}')
+            try:
+                kwargs['open_for_subscription' if name == 'open' else name] = screen_params[name](value)
+            except ValueError:
+                raise HttpError(400, f'invalid value for {name}: {value}')
+        try:
+            query, params = build_screen_query(**kwargs)
+        except Exception as e:
+            raise HttpError(400, str(e))
+        columns, rows = await self._query(query, params)
+        return 'application/json', _json_bytes([dict(zip(summary_columns, row)) for row in rows])
+
+    def get_fund_nav(self, fund_id: str, query_params: dict):
+        """检查参数，返回按块生成净值序列JSON的异步生成器"""
+        kind = query_params.get('kind', 'nav')
+        if kind not in nav_kinds:
+            raise HttpError(400, f'unknown kind {kind}, expected one of {list(nav_kinds)}')
+        table_name, value_column = nav_kinds[kind]
+        for name in ('start', 'end'):
+            if name in query_params:
+                try:
+                    datetime.date.fromisoformat(query_params[name])
+                except ValueError:
+                    raise HttpError(400, f'invalid value for {name}: {query_params[name]}')
+        return self._stream_nav(fund_id, kind, table_name, value_column, query_params.get('start'), query_params.get('end'))
+
+    async def _stream_nav(self, fund_id: str, kind: str, table_name: str, value_column: str, start_date: str, end_date: str):
+        # 整个序列不需要一次读入内存，连接在发送完成或客户端断开后归还。同时读取已归档的净值
+        conn = await self.pool.acquire()
+        rows_iter = iter_nav_rows(conn, table_name, value_column, [fund_id], start_date, end_date, self.nav_chunk_rows)
+        try:
+            yield _json_bytes({'fund_id': fund_id, 'kind': kind})[:-1] + b',"data":['
+            first = True
+            while rows := await self._run(lambda: [[value_date, value] for _, value_date, value
+                                                   in itertools.islice(rows_iter, self.nav_chunk_rows)]):
+                chunk = _json_bytes(rows)[1:-1]
+                yield chunk if first else b',' + chunk
+                first = False
+            yield b']}'
+        finally:
+            # 在执行器线程中关闭生成器，释放其中的游标
+            await self._run(rows_iter.close)
+            self.pool.release(conn)
+
+    async def dispatch(self, path: str, query_params: dict):
+        """路由请求
+
+        Returns:
+            tuple: (content_type, 响应内容, 是否可缓存)，响应内容为bytes或逐块生成bytes的异步生成器
+        """
+        parts = [urllib.parse.unquote(part) for part in path.strip('/').split('/') if part]
+        if parts == ['health']:
+            return 'application/json', _json_bytes({
+                'ok': True,
+                'pool_available': self.pool.available(),
+                'cache_entries': len(self.cache),
+                'cache_bytes': self.cache.total_bytes,
+            }), False
+        if parts == ['metrics']:
+            return 'text/plain; version=0.0.4', metrics.default_registry.to_prometheus().encode('utf-8'), False
+        if parts == ['screen']:
+            return *(await self.screen(query_params)), True
+        if len(parts) == 2 and parts[0] == 'funds':
+            return *(await self.get_fund(parts[1], query_params)), True
+        if len(parts) == 3 and parts[0] == 'funds' and parts[2] == 'nav':
+            return 'application/json', self.get_fund_nav(parts[1], query_params), True
+        if len(parts) == 3 and parts[0] == 'funds' and parts[2] == 'metrics':
+            return *(await self.get_fund_metrics(parts[1], query_params)), True
+        raise HttpError(404, f'no route for {path}')
+
+    async def _write_response(self, writer, status: int, content_type: str, body, keep_alive: bool,
+                              cache_status: str = None):
+        headers = [
+            f'HTTP/1.1 {status} {http_reasons.get(status, "")}',
+            f'Content-Type: {content_type}',
+            f'Connection: {"keep-alive" if keep_alive else "close"}',
+        ]
+        if cache_status is not None:
+            headers.append(f'X-Cache: {cache_status}')
+
+        if isinstance(body, bytes):
+            headers.append(f'Content-Length: {len(body)}')
+            writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+            return body
+
+        # 分块传输，边查询边发送，同时收集完整内容用于缓存
+        headers.append('Transfer-Encoding: chunked')
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1'))
+        chunks = []
+        async with aclosing(body):
+            try:
+                async for chunk in body:
+                    chunks.append(chunk)
+                    writer.write(f'{len(chunk):x}\r\n'.encode('latin-1') + chunk + b'\r\n')
+                    await writer.drain()
+            except Exception as e:
+                # 状态码已经发出，无法再返回错误，断开连接让客户端知道响应不完整
+                metrics.inc('failures_total', stage='api_stream')
+                raise ConnectionResetError(f'stream aborted: {e}')
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return b''.join(chunks)
+
+    async def handle_request(self, method: str, target: str, writer, keep_alive: bool):
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(target)
+        query_params = dict(urllib.parse.parse_qsl(url.query))
+        endpoint = _endpoint_label(url.path)
+        status = 200
+        try:
+            if method != 'GET':
+                raise HttpError(405, f'method {method} not allowed')
+
+            data_version = self._check_data_version()
+            cache_key = (url.path, tuple(sorted(query_params.items())))
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.inc('api_cache_hits_total', endpoint=endpoint)
+                await self._write_response(writer, 200, cached[0], cached[1], keep_alive, 'hit')
+                return
+
+            content_type, body, cacheable = await self.dispatch(url.path, query_params)
+            if not cacheable:
+                await self._write_response(writer, 200, content_type, body, keep_alive)
+                return
+            sent_body = await self._write_response(writer, 200, content_type, body, keep_alive, 'miss')
+            # 查询期间数据库有新的提交时不缓存，避免缓存旧数据
+            if self._check_data_version() == data_version:
+                self.cache.put(cache_key, content_type, sent_body)
+        except HttpError as e:
+            status = e.status
+            await self._write_response(writer, e.status, 'application/json', _json_bytes({'error': str(e)}), keep_alive)
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            status = 500
+            await self._write_response(writer, 500, 'application/json',
+                                       _json_bytes({'error': f'{type(e).__name__}: {e}'}), keep_alive)
+        finally:
+            metrics.inc('api_requests_total', endpoint=endpoint, status=status)
+            metrics.observe('api_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    header_bytes = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keep_alive_seconds)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    return
+                lines = header_bytes.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    await self._write_response(writer, 400, 'application/json',
+                                               _json_bytes({'error': 'bad request line'}), False)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                # 只支持GET，忽略请求体
+                try:
+                    content_length = int(headers.get('content-length') or 0)
+                    if content_length < 0:
+                        raise ValueError(content_length)
+                except ValueError:
+                    await self._write_response(writer, 400, 'application/json',
+                                               _json_bytes({'error': 'bad content-length'}), False)
+                    return
+                if content_length:
+                    try:
+                        await reader.readexactly(content_length)
+                    except asyncio.IncompleteReadError:
+                        return
+
+                connection_header = headers.get('connection', '').lower()
+                keep_alive = connection_header != 'close' if version == 'HTTP/1.1' else connection_header == 'keep-alive'
+                await self.handle_request(method, target, writer, keep_alive)
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8765):
+        """开始监听，返回asyncio.Server"""
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def _serve_forever(funds_db_file_path: str, host: str, port: int, pool_size: int, cache_max_bytes: int):
+    server = FundsApiServer(funds_db_file_path, pool_size, cache_max_bytes)
+    try:
+        asyncio_server = await server.start(host, port)
+        print(f"监听 http://{host}:{port}")
+        async with asyncio_server:
+            await asyncio_server.serve_forever()
+    finally:
+        server.close()
+
+
+def serve(funds_db_file_path: str = default_db_file_path, host: str = '127.0.0.1', port: int = 8765,
+          pool_size: int = 4, cache_max_bytes: int = 64 * 1024 * 1024):
+    """启动服务，直到进程被中断"""
+    try:
+        asyncio.run(_serve_forever(str(funds_db_file_path), host, port, pool_size, cache_max_bytes))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='基金数据只读HTTP服务')
+    parser.add_argument('--db', default=str(default_db_file_path), help='数据库文件路径')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pool-size', type=int, default=4, help='只读连接数')
+    parser.add_argument('--cache-mb', type=int, default=64, help='缓存大小（MB）')
+    args = parser.parse_args()
+    serve(args.db, args.host, args.port, args.pool_size, args.cache_mb * 1024 * 1024)
@@ -0,0 +1,387 @@
+"""离线性能基准：不访问天天基金网，用录制的网页和模拟的akshare测量解析、转换和写库的吞吐量
+
+用法：
+    python benchmark.py                      # 使用默认参数运行全部基准
+    python benchmark.py --funds 500 --json result.json
+    python benchmark.py --record 000001 110022   # 录制真实网页到fixtures目录（需要联网）
+    python benchmark.py --import-time          # 只测量各模块的导入时间
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import pathlib
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import crawler
+import init_utils
+import metrics
+
+default_fixtures_dir = pathlib.Path(__file__).parent / "benchmark_fixtures"
+
+# 导入时间基准测量的模块，以及不应在导入这些模块时加载的慢依赖
+import_time_modules = ['cli', 'init_utils', 'fund_summary', 'work_queue', 'refresh_scheduler', 'analytics', 'crawler']
+heavy_modules = ['akshare', 'pandas', 'bs4', 'lxml', 'requests', 'numpy']
+
+
+def record_fixtures(fund_codes, fixtures_dir=default_fixtures_dir):
+    """下载基金详情页和费率页保存为基准用的网页
+
+    Args:
+        fund_codes (list): 基金代码
+        fixtures_dir (str, optional): 保存目录. Defaults to default_fixtures_dir.
+    """
+    fixtures_dir = pathlib.Path(fixtures_dir)
+    fixtures_dir.mkdir(parents=True, exist_ok=True)
+    for fund_code in fund_codes:
+        (fixtures_dir / f'fund_{fund_code}.html').write_text(crawler.fetch_fund_page(fund_code), encoding='utf-8')
+        (fixtures_dir / f'jjfl_{fund_code}.html').write_text(crawler.fetch_redemption_page(fund_code), encoding='utf-8')
+        print(f"{fund_code} 已录制")
+
+
+def load_fixtures(fixtures_dir=default_fixtures_dir):
+    """读取录制的网页
+
+    Raises:
+        Exception: 目录中没有成对的详情页和费率页
+
+    Returns:
+        dict: {基金代码: (详情页HTML, 费率页HTML)}
+    """
+    fixtures_dir = pathlib.Path(fixtures_dir)
+    fixtures = {}
+    for fund_page_path in sorted(fixtures_dir.glob('fund_*.html')):
+        fund_code = fund_page_path.stem.split('_', 1)[1]
+        fee_page_path = fixtures_dir / f'jjfl_{fund_code}.html'
+        if fee_page_path.exists():
+            fixtures[fund_code] = (fund_page_path.read_text(encoding='utf-8'), fee_page_path.read_text(encoding='utf-8'))
+    if not fixtures:
+        raise Exception(f"No fund_*.html / jjfl_*.html fixture pairs found in {fixtures_dir}")
+    return fixtures
+
+
+class FakeAkshare:
+    """模拟akshare中本项目用到的接口，按基金代码生成确定的数据，大小与真实数据相当
+
+    生成的数据会缓存，调用warm_up预先生成后，基准时间不含生成数据的开销。
+    """
+
+    def __init__(self, n_funds: int = 200, nav_days: int = 3000, n_dividends: int = 10, n_splits: int = 1,
+                 end_date: str = '2024-06-28'):
+        """
+        Args:
+            n_funds (int, optional): fund_open_fund_daily_em返回的基金数. Defaults to 200.
+            nav_days (int, optional): 每个基金的净值天数，约12年交易日. Defaults to 3000.
+            n_dividends (int, optional): 每个基金的分红次数. Defaults to 10.
+            n_splits (int, optional): 每个基金的拆分次数. Defaults to 1.
+            end_date (str, optional): 最新净值日期. Defaults to '2024-06-28'.
+        """
+        self.n_funds = n_funds
+        self.nav_days = nav_days
+        self.n_dividends = n_dividends
+        self.n_splits = n_splits
+        self.nav_dates = pd.bdate_range(end=end_date, periods=nav_days).date
+        self._frames = {}
+
+    def fund_ids(self):
+        return [f'{i:06d}' for i in range(1, self.n_funds + 1)]
+
+    def warm_up(self, indicators=('单位净值走势', '累计净值走势', '分红送配详情', '拆分详情')):
+        """预先生成所有基金的数据"""
+        for fund_id in self.fund_ids():
+            for indicator in indicators:
+                self.fund_open_fund_info_em(fund_id, indicator)
+
+    def fund_open_fund_daily_em(self):
+        fund_codes = self.fund_ids()
+        rng = np.random.default_rng(0)
+        navs = (1 + rng.random(self.n_funds)).round(4).astype(str)
+        last_date, previous_date = self.nav_dates[-1], self.nav_dates[-2]
+        return pd.DataFrame({
+            '基金代码': fund_codes,
+            '基金简称': [f'模拟基金{fund_code}' for fund_code in fund_codes],
+            f'{last_date}-单位净值': navs,
+            f'{last_date}-累计净值': navs,
+            f'{previous_date}-单位净值': navs,
+            f'{previous_date}-累计净值': navs,
+            '日增长值': '0.0000',
+            '日增长率': '0.00',
+            '申购状态': '开放申购',
+            '赎回状态': '开放赎回',
+            '手续费': '0.15%',
+        })
+
+    def fund_open_fund_info_em(self, symbol: str, indicator: str):
+        key = (symbol, indicator)
+        if key not in self._frames:
+            self._frames[key] = self._generate_fund_info(symbol, indicator)
+        return self._frames[key]
+
+    def fund_fhsp_tables(self, fund_id: str):
+        # 代替init_utils.fetch_fund_fhsp_tables，返回(分红送配详情, 拆分详情)
+        return self.fund_open_fund_info_em(fund_id, '分红送配详情'), self.fund_open_fund_info_em(fund_id, '拆分详情')
+
+    def _generate_fund_info(self, symbol: str, indicator: str):
+        rng = np.random.default_rng(int(symbol))
+        if indicator in ('单位净值走势', '累计净值走势'):
+            navs = (1 + np.cumsum(rng.normal(0, 0.01, self.nav_days))).round(4)
+            if indicator == '单位净值走势':
+                return pd.DataFrame({'净值日期': self.nav_dates, '单位净值': navs, '日增长率': 0.0})
+            return pd.DataFrame({'净值日期': self.nav_dates, '累计净值': navs + 0.5})
+
+        if indicator == '分红送配详情':
+            dates = sorted(rng.choice(self.nav_dates, self.n_dividends, replace=False), reverse=True)
+            return pd.DataFrame({
+                '年份': [f'{date.year}年' for date in dates],
+                '权益登记日': dates,
+                '除息日': dates,
+                '每份分红': [f'每份派现金{value:.4f}元' for value in rng.uniform(0.01, 0.2, len(dates))],
+                '分红发放日': dates,
+            })
+
+        if indicator == '拆分详情':
+            dates = sorted(rng.choice(self.nav_dates, self.n_splits, replace=False), reverse=True)
+            return pd.DataFrame({
+                '年份': [f'{date.year}年' for date in dates],
+                '拆分折算日': [date.isoformat() for date in dates],
+                '拆分类型': '份额折算',
+                '拆分折算比例': [f'1:{value:.4f}' for value in rng.uniform(1, 1.2, len(dates))],
+            })
+
+        raise Exception(f"Unsupported indicator {indicator}")
+
+
+@contextlib.contextmanager
+def patched(obj, name: str, value):
+    # 临时替换模块属性
+    original = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, original)
+
+
+def _fixture_fetch_text(fixtures, page_counter: list):
+    # 按URL中的基金代码返回录制的网页，代替crawler.fetch_text，page_counter[0]记录返回的网页数
+    def fetch_text(url: str, *args, **kwargs):
+        fund_code = re.search(r'(\d{6})\.html', url).group(1)
+        page_counter[0] += 1
+        return fixtures[fund_code][1 if 'jjfl_' in url else 0]
+    return fetch_text
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_parse(fixtures, iterations: int = 200):
+    """解析录制的网页，测量get_fund_basic_info不含网络的吞吐量
+
+    Returns:
+        dict: 基准结果
+    """
+    fund_codes = list(fixtures)
+    page_counter = [0]
+    with patched(crawler, 'fetch_text', _fixture_fetch_text(fixtures, page_counter)):
+        # 预热
+        crawler.get_fund_basic_info(fund_codes[0])
+        page_counter[0] = 0
+        _, seconds = _timed(lambda: [crawler.get_fund_basic_info(fund_codes[i % len(fund_codes)]) for i in range(iterations)])
+
+    pages = page_counter[0]
+    return {
+        'name': 'get_fund_basic_info',
+        'funds': iterations,
+        'pages': pages,
+        'seconds': seconds,
+        'pages_per_sec': pages / seconds,
+    }
+
+
+def bench_converters(fake_ak: FakeAkshare):
+    """用模拟的akshare调用get_fund_all_*数据获取和转换函数，测量转换吞吐量
+
+    Returns:
+        list: 每个函数的基准结果
+    """
+    converters = [
+        init_utils.get_fund_all_nav_data,
+        init_utils.get_fund_all_cumulative_nav_data,
+        init_utils.get_fund_all_dividend_data_for_save,
+        init_utils.get_fund_all_split_data_for_save,
+    ]
+    fund_ids = fake_ak.fund_ids()
+    fake_ak.warm_up()
+
+    results = []
+    with patched(init_utils, 'ak', fake_ak), patched(init_utils, 'fetch_fund_fhsp_tables', fake_ak.fund_fhsp_tables):
+        for converter in converters:
+            fund_data, seconds = _timed(lambda: [converter(fund_id) for fund_id in fund_ids])
+            rows = sum(len(data) for data in fund_data)
+            results.append({
+                'name': converter.__name__,
+                'funds': len(fund_ids),
+                'rows': rows,
+                'seconds': seconds,
+                'rows_per_sec': rows / seconds,
+            })
+    return results
+
+
+def _count_rows(db_file_path: str, table_name: str):
+    conn = sqlite3.connect(db_file_path)
+    count = conn.execute(f'SELECT COUNT(*) FROM {table_name}').fetchone()[0]
+    conn.close()
+    return count
+
+
+def bench_writers(fake_ak: FakeAkshare, concurrency: int = 8):
+    """在临时数据库上端到端运行save_all_*函数，含获取（模拟）、转换和写库
+
+    Returns:
+        list: 每个函数的基准结果
+    """
+    writers = [
+        ('save_all_fund_nav_data', init_utils.save_all_fund_nav_data, ['fund_nav']),
+        ('save_all_fund_cumulative_nav_data', init_utils.save_all_fund_cumulative_nav_data, ['fund_cumulative_nav']),
+        ('save_all_fund_dividend_data', init_utils.save_all_fund_dividend_data, ['fund_dividends']),
+        ('save_all_fund_split_data', init_utils.save_all_fund_split_data, ['fund_splits']),
+        (f'sync_all_fund_history_data(concurrency={concurrency})',
+         lambda path: init_utils.sync_all_fund_history_data(path, concurrency=concurrency),
+         list(init_utils.history_data_sources)),
+    ]
+
+    fake_ak.warm_up()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir, patched(init_utils, 'ak', fake_ak), \
+         patched(init_utils, 'fetch_fund_fhsp_tables', fake_ak.fund_fhsp_tables), contextlib.redirect_stdout(io.StringIO()):
+        db_file_path = str(pathlib.Path(tmp_dir) / 'funds.db')
+        init_utils.create_if_not_exists_db_tables(db_file_path)
+        init_utils.save_all_fund_partial_data(db_file_path)
+
+        for name, writer, table_names in writers:
+            _, seconds = _timed(writer, db_file_path)
+            rows = sum(_count_rows(db_file_path, table_name) for table_name in table_names)
+            results.append({
+                'name': name,
+                'funds': fake_ak.n_funds,
+                'rows': rows,
+                'seconds': seconds,
+                'rows_per_sec': rows / seconds,
+            })
+    return results
+
+
+def bench_import_time(modules=import_time_modules, repeats: int = 5):
+    """在新的Python进程中分别导入各模块，测量导入时间（取repeats次中的最小值）和随之加载的慢依赖，
+    并测量运行cli.py --help的总耗时
+
+    Returns:
+        list: 每个模块的基准结果
+    """
+    project_dir = pathlib.Path(__file__).parent
+    results = []
+    for module in modules:
+        code = (
+            'import json, sys, time\n'
+            't = time.perf_counter()\n'
+            f'import {module}\n'
+            'seconds = time.perf_counter() - t\n'
+            f'print(json.dumps([seconds, [m for m in {heavy_modules!r} if m in sys.modules]]))'
+        )
+        runs = [
+            json.loads(subprocess.run([sys.executable, '-c', code], cwd=project_dir, capture_output=True,
+                                      text=True, check=True).stdout)
+            for _ in range(repeats)
+        ]
+        results.append({
+            'name': f'import {module}',
+            'seconds': min(seconds for seconds, _ in runs),
+            'heavy_modules_loaded': runs[0][1],
+        })
+
+    process_seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'cli.py', '--help'], cwd=project_dir, capture_output=True, check=True)
+        process_seconds.append(time.perf_counter() - start)
+    results.append({'name': 'python cli.py --help', 'seconds': min(process_seconds), 'heavy_modules_loaded': []})
+    return results
+
+
+def run_benchmarks(fixtures_dir=default_fixtures_dir, parse_iterations: int = 200, n_funds: int = 200,
+                   nav_days: int = 3000, concurrency: int = 8):
+    """运行全部基准
+
+    Returns:
+        dict: {'environment': ..., 'results': [...], 'stages': 各阶段耗时统计}
+    """
+    fake_ak = FakeAkshare(n_funds=n_funds, nav_days=nav_days)
+    metrics.default_registry.reset()
+    # 运行中定期导出的指标写到临时目录，不覆盖正式任务的指标
+    with tempfile.TemporaryDirectory() as metrics_dir, patched(metrics, 'default_metrics_dir', metrics_dir):
+        results = [bench_parse(load_fixtures(fixtures_dir), parse_iterations)]
+        results.extend(bench_converters(fake_ak))
+        results.extend(bench_writers(fake_ak, concurrency))
+    return {
+        'environment': {
+            'run_at': datetime.datetime.now().isoformat(sep=' ', timespec='seconds'),
+            'n_funds': n_funds,
+            'nav_days': nav_days,
+            'parse_iterations': parse_iterations,
+        },
+        'results': results,
+        'stages': [histogram for histogram in metrics.default_registry.summary()['histograms']
+                   if histogram['name'] == 'stage_seconds'],
+    }
+
+
+def print_results(report):
+    for result in report['results']:
+        if 'pages_per_sec' in result:
+            throughput = f"{result['pages_per_sec']:>12,.1f} pages/s"
+        elif 'heavy_modules_loaded' in result:
+            throughput = f"  loaded: {', '.join(result['heavy_modules_loaded']) or '-'}"
+        else:
+            throughput = f"{result['rows_per_sec']:>12,.0f} rows/s"
+        print(f"{result['name']:<45} {result['seconds']:>8.3f}s {throughput}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线性能基准')
+    parser.add_argument('--fixtures-dir', default=default_fixtures_dir, help='录制网页目录')
+    parser.add_argument('--record', nargs='+', metavar='FUND_CODE', help='录制这些基金的网页后退出（需要联网）')
+    parser.add_argument('--parse-iterations', type=int, default=200, help='解析基准的基金数')
+    parser.add_argument('--funds', type=int, default=200, help='转换和写库基准的基金数')
+    parser.add_argument('--nav-days', type=int, default=3000, help='每个基金的净值天数')
+    parser.add_argument('--concurrency', type=int, default=8, help='sync_all_fund_history_data的线程数')
+    parser.add_argument('--import-time', action='store_true', help='只测量各模块的导入时间')
+    parser.add_argument('--json', help='结果另存为JSON文件')
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures(args.record, args.fixtures_dir)
+        return
+
+    if args.import_time:
+        report = {'results': bench_import_time()}
+    else:
+        report = run_benchmarks(args.fixtures_dir, args.parse_iterations, args.funds, args.nav_days, args.concurrency)
+    print_results(report)
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
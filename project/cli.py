@@ -0,0 +1,198 @@
+"""命令行入口
+
+用法：
+    python cli.py init                          # 创建数据库表
+    python cli.py refresh-list                  # 用开放式基金列表更新基金信息和最新净值
+    python cli.py refresh --deep-budget 4000    # 每日刷新，只深度爬取新增、有变化和过期的基金
+    python cli.py sync-nav --incremental        # 同步历史净值
+    python cli.py crawl-info --resume           # 爬取基金详情页和费率页
+    python cli.py screen --open --fund-type 债券型 --max-redemption-period 30
+    python cli.py similar 000001 --update       # 收益率最相关的基金
+    python cli.py serve --port 8765             # 只读HTTP服务，接口见api_server.py
+    python cli.py compact --before-year 2024    # 旧净值压缩归档并回收空间
+
+akshare、pandas、lxml等依赖导入较慢，只在需要它们的子命令中导入，查询类命令可以很快启动。
+"""
+import argparse
+import json
+import sys
+from init_utils import default_db_file_path, history_data_sources
+
+
+def cmd_init(args):
+    from init_utils import create_if_not_exists_db_tables
+
+    create_if_not_exists_db_tables(args.db)
+    print(f"已创建 {args.db}")
+
+
+def cmd_refresh_list(args):
+    from init_utils import get_akshare, save_all_fund_daily_nav_data, save_all_fund_partial_data
+    from rate_limiter import call_limited
+
+    # 只获取一次基金列表，同时用于更新基金信息和最新净值
+    fund_open_fund_daily_em_df = call_limited('fund.eastmoney.com', get_akshare().fund_open_fund_daily_em)
+    save_all_fund_partial_data(args.db, fund_open_fund_daily_em_df)
+    if not args.skip_nav:
+        save_all_fund_daily_nav_data(args.db, fund_open_fund_daily_em_df)
+
+
+def cmd_refresh(args):
+    from refresh_scheduler import run_scheduled_refresh
+
+    failed_funds = run_scheduled_refresh(args.db, daily_request_budget=args.deep_budget, stale_days=args.stale_days,
+                                         concurrency=args.concurrency, batch_size=args.batch_size)
+    print(f"失败 {len(failed_funds)} 个基金")
+    return 1 if failed_funds else 0
+
+
+def cmd_sync_nav(args):
+    from init_utils import sync_all_fund_history_data
+
+    failed_funds = sync_all_fund_history_data(args.db, args.tables, incremental=args.incremental, resume=args.resume,
+                                              concurrency=args.concurrency)
+    print(f"失败 {len(failed_funds)} 项")
+    return 1 if failed_funds else 0
+
+
+def cmd_crawl_info(args):
+    from init_utils import save_all_fund_basic_info
+
+    failed_funds = save_all_fund_basic_info(args.db, concurrency=args.concurrency, batch_size=args.batch_size,
+                                            resume=args.resume, parser_workers=args.parser_workers)
+    print(f"失败 {len(failed_funds)} 个基金")
+    return 1 if failed_funds else 0
+
+
+def cmd_screen(args):
+    from fund_summary import screen_funds
+
+    funds = screen_funds(
+        args.db,
+        open_for_subscription=True if args.open else None,
+        fund_type=args.fund_type,
+        max_redemption_period=args.max_redemption_period,
+        max_subscription_rate=args.max_subscription_rate,
+        max_redemption_rate=args.max_redemption_rate,
+        manager_unchanged_since=args.manager_unchanged_since,
+        min_scale=args.min_scale,
+        max_scale=args.max_scale,
+        order_by=args.order_by,
+        limit=args.limit,
+    )
+    if args.json:
+        print(json.dumps(funds, ensure_ascii=False, indent=2))
+        return
+
+    for fund in funds:
+        fund = {column: '-' if value is None else value for column, value in fund.items()}
+        print(f"{fund['fund_id']}  {fund['fund_name']:<20}  {fund['fund_type']:<12}  "
+              f"申购费 {fund['subscription_rate']}%  赎回费 {fund['redemption_rate']}%（持有{fund['redemption_period']}天）  "
+              f"规模 {fund['latest_scale']}亿  经理自 {fund['latest_manager_change_date']}")
+    print(f"共 {len(funds)} 个基金")
+
+
+def cmd_similar(args):
+    from similarity import most_correlated_funds, update_similarity_index
+
+    if args.update:
+        update_similarity_index(args.db)
+    for fund_id, correlation, estimate in most_correlated_funds(args.db, args.fund_id, args.k):
+        print(f"{fund_id}  相关系数 {correlation:.4f}  （索引估计 {estimate:.4f}）")
+
+
+def cmd_serve(args):
+    from api_server import serve
+
+    serve(args.db, args.host, args.port, args.pool_size, args.cache_mb * 1024 * 1024)
+
+
+def cmd_compact(args):
+    from nav_archive import compact_nav_tables
+
+    result = compact_nav_tables(args.db, args.tables, before_year=args.before_year, vacuum=not args.no_vacuum)
+    for table_name in args.tables:
+        stats = result[table_name]
+        print(f"{table_name}  归档 {stats['archived_rows']} 条（{stats['archived_blocks']} 个基金年份），"
+              f"因精度保留 {stats['skipped_blocks']} 个基金年份")
+    print(f"数据库 {result['size_before'] / 1024 / 1024:.1f}MB -> {result['size_after'] / 1024 / 1024:.1f}MB")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='基金数据工具')
+    parser.add_argument('--db', default=str(default_db_file_path), help='数据库文件路径')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    init_parser = subparsers.add_parser('init', help='创建数据库表')
+    init_parser.set_defaults(func=cmd_init)
+
+    refresh_parser = subparsers.add_parser('refresh-list', help='用开放式基金列表更新基金名称、申购状态、手续费和最新净值')
+    refresh_parser.add_argument('--skip-nav', action='store_true', help='不写入最新净值')
+    refresh_parser.set_defaults(func=cmd_refresh_list)
+
+    scheduled_parser = subparsers.add_parser('refresh', help='每日刷新：更新基金列表信息，只深度爬取新增、有变化和过期的基金')
+    scheduled_parser.add_argument('--deep-budget', type=int, default=4000, help='深度爬取最多发出的请求数')
+    scheduled_parser.add_argument('--stale-days', type=int, default=30, help='超过多少天未爬取视为过期')
+    scheduled_parser.add_argument('--concurrency', type=int, default=8, help='同时爬取的基金数')
+    scheduled_parser.add_argument('--batch-size', type=int, default=200, help='每批写入的基金数')
+    scheduled_parser.set_defaults(func=cmd_refresh)
+
+    sync_parser = subparsers.add_parser('sync-nav', help='逐个基金同步历史净值、分红、拆分')
+    sync_parser.add_argument('--tables', nargs='+', choices=list(history_data_sources),
+                             default=['fund_nav', 'fund_cumulative_nav'], help='要同步的表')
+    sync_parser.add_argument('--incremental', action='store_true', help='只写入比库中最新日期更新的数据')
+    sync_parser.add_argument('--resume', action='store_true', help='继续上次中断的任务')
+    sync_parser.add_argument('--concurrency', type=int, default=8, help='同时获取的基金数')
+    sync_parser.set_defaults(func=cmd_sync_nav)
+
+    crawl_parser = subparsers.add_parser('crawl-info', help='爬取所有基金的详情页和费率页')
+    crawl_parser.add_argument('--resume', action='store_true', help='继续上次中断的任务')
+    crawl_parser.add_argument('--concurrency', type=int, default=8, help='同时爬取的基金数')
+    crawl_parser.add_argument('--batch-size', type=int, default=200, help='每批写入的基金数')
+    crawl_parser.add_argument('--parser-workers', type=int, default=0, help='解析网页的子进程数')
+    crawl_parser.set_defaults(func=cmd_crawl_info)
+
+    screen_parser = subparsers.add_parser('screen', help='按条件筛选基金')
+    screen_parser.add_argument('--open', action='store_true', help='只显示可以申购的基金')
+    screen_parser.add_argument('--fund-type', help="基金类型前缀，如'债券型'")
+    screen_parser.add_argument('--max-redemption-period', type=int, help='最低赎回费率所须持有天数上限')
+    screen_parser.add_argument('--max-subscription-rate', type=float, help='申购费率（%%）上限')
+    screen_parser.add_argument('--max-redemption-rate', type=float, help='最低赎回费率（%%）上限')
+    screen_parser.add_argument('--manager-unchanged-since', help='基金经理在该日期YYYY-MM-DD之后未变动')
+    screen_parser.add_argument('--min-scale', type=float, help='最新规模（亿）下限')
+    screen_parser.add_argument('--max-scale', type=float, help='最新规模（亿）上限')
+    screen_parser.add_argument('--order-by', default='subscription_rate', help='排序列')
+    screen_parser.add_argument('--limit', type=int, default=50, help='最多显示的基金数')
+    screen_parser.add_argument('--json', action='store_true', help='输出JSON')
+    screen_parser.set_defaults(func=cmd_screen)
+
+    similar_parser = subparsers.add_parser('similar', help='查找日收益率与某基金最相关的基金，如同一基金的其他份额')
+    similar_parser.add_argument('fund_id', help='基金代码')
+    similar_parser.add_argument('-k', type=int, default=10, help='返回的基金数')
+    similar_parser.add_argument('--update', action='store_true', help='查询前用新的累计净值增量更新索引')
+    similar_parser.set_defaults(func=cmd_similar)
+
+    serve_parser = subparsers.add_parser('serve', help='启动只读HTTP服务')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--pool-size', type=int, default=4, help='只读连接数')
+    serve_parser.add_argument('--cache-mb', type=int, default=64, help='缓存大小（MB）')
+    serve_parser.set_defaults(func=cmd_serve)
+
+    compact_parser = subparsers.add_parser('compact', help='把旧净值按基金和年份压缩后移入归档表，并回收数据库空间')
+    compact_parser.add_argument('--tables', nargs='+', choices=['fund_nav', 'fund_cumulative_nav'],
+                                default=['fund_nav', 'fund_cumulative_nav'], help='要归档的表')
+    compact_parser.add_argument('--before-year', type=int, help='归档该年之前的净值，默认保留去年和今年的净值')
+    compact_parser.add_argument('--no-vacuum', action='store_true', help='不执行VACUUM')
+    compact_parser.set_defaults(func=cmd_compact)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,105 @@
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
+import lxml.html
 import re
-from io import StringIO
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import metrics
+from http_client import fetch_text
+
+
+# 与pandas.read_html相同的单元格空白处理：换行和连续空白替换为一个空格
+_cell_whitespace_pattern = re.compile(r'[\r\n]+|\s{2,}')
+
+
+def _has_class_xpath(class_name: str):
+    # 匹配class属性中包含某个类名的XPath条件，同BeautifulSoup的class_参数
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+
+def _cell_text(element):
+    return _cell_whitespace_pattern.sub(' ', element.text_content()).strip()
+
+
+def _only_string(element):
+    """同BeautifulSoup的Tag.string：节点只有一个文本子节点，或只有一个子元素且该子元素满足此条件时返回文本，否则返回None"""
+    if len(element) == 0:
+        return element.text or None
+    if len(element) == 1 and not element.text and not element[0].tail:
+        return _only_string(element[0])
+    return None
+
+
+def _first(elements):
+    return elements[0] if elements else None
+
+
+def fetch_fund_page(fund_code: str):
+    """获取基金详情页网页内容
+
+    Args:
+        fund_code (str): 基金代码
+
+    Raises:
+        Exception: 获取网页内容出错
+
+    Returns:
+        str: 网页HTML
+    """
+    # 目标URL
+    url = f'http://fund.eastmoney.com/{fund_code}.html'
+
+    try:
+        # 发送GET请求，复用连接池和磁盘缓存
+        with metrics.timer(stage='fetch', page='fund'):
+            return fetch_text(url)
+    except Exception as e:
+        raise Exception(f"Error fetching {url} for fund code {fund_code}: {e}")
+
+
+def fetch_redemption_page(fund_code: str):
+    """获取基金费率页网页内容
+
+    Args:
+        fund_code (str): 基金代码
+
+    Raises:
+        Exception: 获取网页内容出错
+
+    Returns:
+        str: 网页HTML
+    """
+    try:
+        # 获取网页内容
+        url = f"http://fundf10.eastmoney.com/jjfl_{fund_code}.html"
+        with metrics.timer(stage='fetch', page='jjfl'):
+            return fetch_text(url)
+    except Exception as e:
+        raise Exception(f"Error fetching {url} for fund code {fund_code}: {e}")
+
+
+def is_money_fund_type(fund_type: str):
+    """是否为货币基金。货币基金一般不收取申购赎回费用，不需要获取费率页"""
+    return '货币型' in fund_type
+
+
+def parse_fund_type(fund_code: str, html: str):
+    """只从基金详情页解析基金类型，用于在获取费率页之前判断是否为货币基金
+
+    Args:
+        fund_code (str): 基金代码
+        html (str): 基金详情页HTML
+
+    Raises:
+        Exception: 解析网页出错
+
+    Returns:
+        str: 基金类型，同parse_fund_basic_info的'类型'
+    """
+    try:
+        cell = lxml.html.fromstring(html).xpath(f"//div[{_has_class_xpath('infoOfFund')}]//table//td")[0]
+        return _cell_text(cell).split('：')[1].split('|')[0].strip()
+    except Exception as e:
+        raise Exception(f"Error extracting fund type for fund code {fund_code}: {e}")
+
 
 def get_fund_basic_info(fund_code: str):
     """获取基金基础信息
@@ -24,27 +121,46 @@ def get_fund_basic_info(fund_code: str):
             '基金经理': (str)
             '最新经理变动日期': YYYY-MM-DD (str)
             '最低赎回费率适用期限': str,
-            '最低赎回费率': str
+            '最低赎回费率': str,
+            '费率表': 申购和赎回费率的全部档位，同parse_fee_tiers (list)
     """
+    fund_page_html = fetch_fund_page(fund_code)
+    with metrics.timer(stage='parse', page='fund'):
+        fund_info = parse_fund_basic_info(fund_code, fund_page_html)
 
-    # 目标URL
-    url = f'http://fund.eastmoney.com/{fund_code}.html'
+    # 获取赎回费用信息，货币基金不获取费率页
+    if is_money_fund_type(fund_info['类型']):
+        fund_info = fund_info | get_least_redemption_period_rate(fund_code, True)
+        fund_info['费率表'] = []
+    else:
+        fee_page_html = fetch_redemption_page(fund_code)
+        with metrics.timer(stage='parse', page='jjfl'):
+            fund_info = fund_info | parse_least_redemption_period_rate(fund_code, fee_page_html)
+            fund_info['费率表'] = parse_fee_tiers(fund_code, fee_page_html)
+    fund_info['基金代码'] = fund_code
 
-    try:
-        # 发送GET请求
-        response = requests.get(url)
-        response.encoding = 'utf-8'
-    except Exception as e:
-        raise Exception(f"Error fetching {url} for fund code {fund_code}: {e}")
-    
+    return fund_info
+
+
+def parse_fund_basic_info(fund_code: str, html: str):
+    """从基金详情页解析基金基础信息，不含赎回费用信息
+
+    Args:
+        fund_code (str): 基金代码
+        html (str): 基金详情页HTML
+
+    Returns:
+        dict: 同get_fund_basic_info，但不含'基金代码'、'最低赎回费率适用期限'、'最低赎回费率'
+    """
     try:
         # 解析HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
+        root = lxml.html.fromstring(html)
     except Exception as e:
         raise Exception(f"Error parsing HTML for fund code {fund_code}: {e}")
     
     try:
-        fund_name = soup.find('div', class_='fundDetail-tit').div.get_text(strip=True).split('(')[0]
+        name_div = root.xpath(f"//div[{_has_class_xpath('fundDetail-tit')}]//div")[0]
+        fund_name = ''.join(text.strip() for text in name_div.itertext()).split('(')[0]
         fund_info = {
             '基金简称': fund_name
         }
@@ -52,34 +168,25 @@ def get_fund_basic_info(fund_code: str):
         raise Exception(f"Error finding fund name div for fund code {fund_code}: {e}")
 
     try:
-        # 找到包含基金信息的div
-        info_div = soup.find('div', class_='infoOfFund')
-    except Exception as e:
-        raise Exception(f"Error finding info div for fund code {fund_code}: {e}")
-    
-    try:
-        # 找到div中的表格
-        table = info_div.find('table')
-        # 使用pandas读取表格
-        df = pd.read_html(StringIO(str(table)))[0]
+        # 找到包含基金信息的div中的表格
+        table = root.xpath(f"//div[{_has_class_xpath('infoOfFund')}]//table")[0]
+        rows = [[_cell_text(td) for td in tr.xpath('./td|./th')] for tr in table.xpath('.//tr')]
     except Exception as e:
         raise Exception(f"Error reading basic info table for fund code {fund_code}: {e}")
-    
-    # print(df)
 
     try:
         # 提取所需信息
-        fund_info['类型'] = df.iloc[0, 0].split('：')[1].split('|')[0].strip()
-        fund_info['规模'] = re.search(r'\d+\.\d+', df.iloc[0, 1]).group()
-        fund_info['成立日'] = df.iloc[1, 0].split('：')[1].strip()
+        fund_info['类型'] = rows[0][0].split('：')[1].split('|')[0].strip()
+        fund_info['规模'] = re.search(r'\d+\.\d+', rows[0][1]).group()
+        fund_info['成立日'] = rows[1][0].split('：')[1].strip()
     except Exception as e:
         raise Exception(f"Error extracting basic info for fund code {fund_code}: {e}")
 
     try:
         # 检查是否存在“封闭期”字段并提取
-        closure_period = table.find('td', string=lambda x: x and '封闭期' in x)
-        if closure_period:
-            closure_text = closure_period.text.split('：')[1].strip()
+        closure_period = _first([td for td in table.iter('td') if '封闭期' in (_only_string(td) or '')])
+        if closure_period is not None:
+            closure_text = closure_period.text_content().split('：')[1].strip()
             # 转换封闭期为月份
             if '年' in closure_text:
                 months = int(re.search(r'\d+', closure_text).group()) * 12
@@ -95,26 +202,25 @@ def get_fund_basic_info(fund_code: str):
     
     try:
         # 获取交易信息
-        buy_way_div = soup.find('div', class_='buyWayStatic')
-        trade_info = buy_way_div.find_all('div', class_='staticItem')
+        buy_way_div = root.xpath(f"//div[{_has_class_xpath('buyWayStatic')}]")[0]
+        trade_info = buy_way_div.xpath(f".//div[{_has_class_xpath('staticItem')}]")
 
         # 提取申购状态
-        # trade_status = buy_way_div.find('div', class_='staticItem').find('span', class_='staticCell')
-        trade_status = trade_info[0].find('span', class_='staticCell')
-        fund_info['申购状态'] = trade_status.text.strip()
+        trade_status = trade_info[0].xpath(f".//span[{_has_class_xpath('staticCell')}]")[0]
+        fund_info['申购状态'] = trade_status.text_content().strip()
 
         # 提取预估开放申购/赎回时间
-        estimated_open_time = trade_info[2].find('span', class_='ui-color-red planData kfadate')
-        if estimated_open_time:
-            estimated_open_time = estimated_open_time.text.strip()
+        estimated_open_time = _first(trade_info[2].xpath(".//span[@class='ui-color-red planData kfadate']"))
+        if estimated_open_time is not None:
+            estimated_open_time = estimated_open_time.text_content().strip()
         else:
             estimated_open_time = ''
         fund_info['预估开放时间'] = estimated_open_time    
 
         # 提取购买手续费
-        fee_info = trade_info[4].find('span', class_='comparePrice').text.strip()
+        fee_info = trade_info[4].xpath(f".//span[{_has_class_xpath('comparePrice')}]")[0].text_content().strip()
         if fee_info == '':
-            fee_info = trade_info[4].find('span', class_='nowPrice').text.strip()
+            fee_info = trade_info[4].xpath(f".//span[{_has_class_xpath('nowPrice')}]")[0].text_content().strip()
         fund_info['申购费率'] = fee_info
     except Exception as e:
         raise Exception(f"Error extracting trade info for fund code {fund_code}: {e}")
@@ -122,23 +228,19 @@ def get_fund_basic_info(fund_code: str):
 
     try:
         # 提取基金经理和任职时间信息
-        manager_tab = soup.find('li', class_='fundManagerTab')
-        manager_table = manager_tab.find('table')
-        manager_df = pd.read_html(StringIO(str(manager_table)))[0]
-
-        # 获取第一行的基金经理和任职时间信息
-        first_row = manager_df.iloc[0]
-        latest_manager_change_date = first_row['任职时间'].split('~')[0].strip()
-        fund_info['基金经理'] = first_row['基金经理']
+        manager_table = root.xpath(f"//li[{_has_class_xpath('fundManagerTab')}]//table")[0]
+        manager_rows = manager_table.xpath('.//tr')
+
+        # 表头为全部由th组成的行，其后第一行为最新的基金经理和任职时间信息
+        header_index = next(i for i, tr in enumerate(manager_rows) if tr.xpath('./th') and not tr.xpath('./td'))
+        header = [_cell_text(th) for th in manager_rows[header_index].xpath('./th')]
+        first_row = [_cell_text(td) for td in manager_rows[header_index + 1].xpath('./td|./th')]
+
+        latest_manager_change_date = first_row[header.index('任职时间')].split('~')[0].strip()
+        fund_info['基金经理'] = first_row[header.index('基金经理')]
         fund_info['最新经理变动日期'] = latest_manager_change_date
     except Exception as e:
         raise Exception(f"Error extracting manager info for fund code {fund_code}: {e}")
-    
-    # 获取赎回费用信息
-    redemption_info = get_least_redemption_period_rate(fund_code, '货币型' in fund_info['类型'])
-
-    fund_info = fund_info | redemption_info
-    fund_info['基金代码'] = fund_code
 
     return fund_info
 
@@ -167,32 +269,39 @@ def get_least_redemption_period_rate(fund_code: str, is_money_fund: bool):
             '最低赎回费率': ''
             }
 
-    try:
-        # 获取网页内容
-        url = f"http://fundf10.eastmoney.com/jjfl_{fund_code}.html"
-        response = requests.get(url)
-        response.encoding = 'utf-8' 
-    except Exception as e:
-        raise Exception(f"Error fetching {url} for fund code {fund_code}: {e}")
-    
+    fee_page_html = fetch_redemption_page(fund_code)
+    with metrics.timer(stage='parse', page='jjfl'):
+        return parse_least_redemption_period_rate(fund_code, fee_page_html)
+
+
+def parse_least_redemption_period_rate(fund_code: str, html: str):
+    """从基金费率页解析最低赎回费率和对应须持有的时长
+
+    Args:
+        fund_code (str): 基金代码
+        html (str): 基金费率页HTML
+
+    Returns:
+        dict: 同get_least_redemption_period_rate
+    """
     try:
         # 解析网页内容
-        soup = BeautifulSoup(response.text, 'html.parser')
+        root = lxml.html.fromstring(html)
     except Exception as e:
         raise Exception(f"Error parsing HTML for fund code {fund_code}: {e}")
     
     try:
         # 找到赎回费用表格
-        table = soup.find_all('table', class_='w650 comm jjfl')[-1]
+        table = root.xpath("//table[@class='w650 comm jjfl']")[-1]
 
         # 提取表格最后一行数据
-        last_row = table.find_all('tr')[-1]
-        columns = last_row.find_all('td')
+        last_row = table.xpath('.//tr')[-1]
+        columns = last_row.xpath('.//td')
 
         # 获取数据
-        # applicable_amount = columns[0].text.strip()
-        applicable_period = columns[1].text.strip()
-        redemption_rate = columns[2].text.strip()
+        # applicable_amount = columns[0].text_content().strip()
+        applicable_period = columns[1].text_content().strip()
+        redemption_rate = columns[2].text_content().strip()
     except Exception as e:
         raise Exception(f"Error extracting redemption table info for fund code {fund_code}: {e}")
     
@@ -214,6 +323,192 @@ def get_least_redemption_period_rate(fund_code: str, is_money_fund: bool):
     }
     return redemption_info
 
+
+def parse_fee_tiers(fund_code: str, html: str):
+    """从基金费率页解析申购、赎回等费率表格的全部档位
+
+    Args:
+        fund_code (str): 基金代码
+        html (str): 基金费率页HTML
+
+    Raises:
+        Exception: 解析网页出错
+        Exception: 解析费率表格出错
+
+    Returns:
+        list: 每个档位为dict，数值转换见fee_schedule.normalize_fee_tiers
+            '费率类型': 表格标题，如'申购费率（前端）'、'赎回费率' (str)
+            '适用金额': 如'小于100万元'，不限为'---' (str)
+            '适用期限': 如'大于等于7天，小于1年'，不限为'---' (str)
+            '费率': 如'1.50%|0.15%|0.15%'、'每笔1000元' (str)
+    """
+    try:
+        root = lxml.html.fromstring(html)
+    except Exception as e:
+        raise Exception(f"Error parsing HTML for fund code {fund_code}: {e}")
+
+    try:
+        fee_tiers = []
+        for box in root.xpath(f"//div[{_has_class_xpath('boxitem')}]"):
+            title = _first(box.xpath(f".//h4//label[{_has_class_xpath('left')}]"))
+            table = _first(box.xpath("./table[@class='w650 comm jjfl']"))
+            if title is None or table is None:
+                continue
+            # 表头为'适用金额'、'适用期限'、费率，数据行都由td组成
+            for tr in table.xpath('.//tr[td]'):
+                cells = [_cell_text(td) for td in tr.xpath('./td')]
+                if len(cells) < 3:
+                    continue
+                fee_tiers.append({
+                    '费率类型': _cell_text(title),
+                    '适用金额': cells[0],
+                    '适用期限': cells[1],
+                    '费率': cells[2],
+                })
+    except Exception as e:
+        raise Exception(f"Error extracting fee tables for fund code {fund_code}: {e}")
+    return fee_tiers
+
+
+def parse_fund_pages(fund_code: str, fund_page_html: str, fee_page_html: str):
+    """解析基金详情页和费率页，得到完整的基金基础信息。纯CPU计算，可以在子进程中执行
+
+    Args:
+        fund_code (str): 基金代码
+        fund_page_html (str): 基金详情页HTML
+        fee_page_html (str): 基金费率页HTML，货币基金不使用，可以为None
+
+    Returns:
+        dict: 同get_fund_basic_info
+    """
+    fund_info = parse_fund_basic_info(fund_code, fund_page_html)
+    if is_money_fund_type(fund_info['类型']):
+        redemption_info = get_least_redemption_period_rate(fund_code, True)
+        fee_tiers = []
+    else:
+        redemption_info = parse_least_redemption_period_rate(fund_code, fee_page_html)
+        fee_tiers = parse_fee_tiers(fund_code, fee_page_html)
+
+    fund_info = fund_info | redemption_info
+    fund_info['费率表'] = fee_tiers
+    fund_info['基金代码'] = fund_code
+    return fund_info
+
+
+def _fetch_fund_pages(fund_code: str, fee_page_executor: ThreadPoolExecutor, fund_type: str = None):
+    # 已知不是货币基金时费率页与详情页同时请求；类型未知或为货币基金时先获取详情页，
+    # 从中解析出类型后只对非货币基金请求费率页
+    if fund_type is not None and not is_money_fund_type(fund_type):
+        fee_page_future = fee_page_executor.submit(fetch_redemption_page, fund_code)
+        try:
+            fund_page_html = fetch_fund_page(fund_code)
+        except Exception:
+            fee_page_future.cancel()
+            raise
+        return fund_page_html, fee_page_future.result()
+
+    fund_page_html = fetch_fund_page(fund_code)
+    if is_money_fund_type(parse_fund_type(fund_code, fund_page_html)):
+        return fund_page_html, None
+    return fund_page_html, fetch_redemption_page(fund_code)
+
+
+def _crawl_one_fund_basic_info(fund_code: str, fee_page_executor: ThreadPoolExecutor, fund_type: str = None):
+    fund_pages = _fetch_fund_pages(fund_code, fee_page_executor, fund_type)
+    with metrics.timer(stage='parse', page='fund+jjfl'):
+        return parse_fund_pages(fund_code, *fund_pages)
+
+
+def _parse_fund_pages_timed(fund_code: str, fund_page_html: str, fee_page_html: str):
+    # 在子进程中解析并返回耗时，子进程中记录的指标不会传回主进程
+    start = time.perf_counter()
+    return parse_fund_pages(fund_code, fund_page_html, fee_page_html), time.perf_counter() - start
+
+
+def crawl_basic_info(fund_codes, concurrency: int = 8, parser_workers: int = 0, fund_types: dict = None):
+    """并发获取多个基金的基础信息，按完成先后逐个返回
+
+    parser_workers大于0时，下载线程只获取网页，解析交给parser_workers个子进程，不受GIL限制。
+    Windows下使用子进程时，调用方需放在 if __name__ == '__main__': 之下。
+    货币基金不请求费率页。fund_types中已知不是货币基金的，费率页与详情页同时请求，其余先请求详情页判断类型。
+
+    Args:
+        fund_codes (iterable): 基金代码
+        concurrency (int, optional): 同时下载的基金数. Defaults to 8.
+        parser_workers (int, optional): 解析网页的子进程数，为0时在下载线程中直接解析. Defaults to 0.
+        fund_types (dict, optional): {基金代码: 基金类型}，如上次爬取时funds表中的fund_type. Defaults to None.
+
+    Yields:
+        tuple: (基金代码, 基金基础信息dict, 异常)，成功时异常为None，失败时基金基础信息为None
+    """
+    if parser_workers > 0:
+        yield from _crawl_basic_info_with_parser_processes(fund_codes, concurrency, parser_workers, fund_types or {})
+        return
+    fund_types = fund_types or {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as fund_page_executor, \
+         ThreadPoolExecutor(max_workers=concurrency) as fee_page_executor:
+        futures = {
+            fund_page_executor.submit(_crawl_one_fund_basic_info, fund_code, fee_page_executor, fund_types.get(fund_code)): fund_code
+            for fund_code in fund_codes
+        }
+        try:
+            for future in as_completed(futures):
+                fund_code = futures[future]
+                try:
+                    yield fund_code, future.result(), None
+                except Exception as e:
+                    yield fund_code, None, e
+        finally:
+            # 调用方提前停止迭代时，不再等待尚未开始的任务
+            for future in futures:
+                future.cancel()
+
+
+def _crawl_basic_info_with_parser_processes(fund_codes, concurrency: int, parser_workers: int, fund_types: dict):
+    fund_code_iter = iter(fund_codes)
+    # 限制已下载未解析的网页数量，避免下载快于解析时占用过多内存
+    max_funds_in_flight = concurrency + parser_workers * 2
+
+    with ThreadPoolExecutor(max_workers=concurrency) as fund_page_executor, \
+         ThreadPoolExecutor(max_workers=concurrency) as fee_page_executor, \
+         ProcessPoolExecutor(max_workers=parser_workers) as parser_executor:
+        # future -> (阶段, 基金代码)，阶段为'fetch'或'parse'
+        pending = {}
+
+        def submit_fetches():
+            while len(pending) < max_funds_in_flight:
+                fund_code = next(fund_code_iter, None)
+                if fund_code is None:
+                    return
+                pending[fund_page_executor.submit(_fetch_fund_pages, fund_code, fee_page_executor,
+                                                  fund_types.get(fund_code))] = ('fetch', fund_code)
+
+        try:
+            submit_fetches()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, fund_code = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if stage == 'parse':
+                            metrics.inc('failures_total', stage='parse', page='fund+jjfl')
+                        yield fund_code, None, e
+                        continue
+
+                    if stage == 'fetch':
+                        pending[parser_executor.submit(_parse_fund_pages_timed, fund_code, *result)] = ('parse', fund_code)
+                    else:
+                        fund_info, parse_seconds = result
+                        metrics.observe('stage_seconds', parse_seconds, stage='parse', page='fund+jjfl')
+                        yield fund_code, fund_info, None
+                submit_fetches()
+        finally:
+            for future in pending:
+                future.cancel()
+
 # test
 # print(get_fund_basic_info('018647'))
 # print(get_least_redemption_period_rate('050025'))
\ No newline at end of file
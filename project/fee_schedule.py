@@ -0,0 +1,282 @@
+import re
+import sqlite3
+import numpy as np
+
+# 费率页表格标题 -> fee_type，其他表格（认购费率、运作费用等）不保存
+fee_table_types = {
+    '申购费率': 'subscription',
+    '申购费率（前端）': 'subscription',
+    '申购费率（后端）': 'subscription_back_end',
+    '赎回费率': 'redemption',
+}
+
+fund_fee_tier_schemas = [
+    # 创建基金费率档位表，每行为费率页中一个表格的一行，金额和期限转换为数值区间
+    '''
+    CREATE TABLE IF NOT EXISTS fund_fee_tiers (
+        fund_id VARCHAR(20),                -- 基金代码
+        fee_type TEXT,                      -- subscription: 前端申购, subscription_back_end: 后端申购, redemption: 赎回
+        tier INTEGER,                       -- 档位，表格中的行号，从0开始
+        min_amount REAL,                    -- 适用金额下限（元，含）
+        max_amount REAL,                    -- 适用金额上限（元，不含），无上限为NULL
+        min_days INTEGER,                   -- 适用持有天数下限（含）
+        max_days INTEGER,                   -- 适用持有天数上限（不含），无上限为NULL
+        rate REAL,                          -- 实际费率（%），有优惠时为天天基金优惠费率，按笔收费时为NULL
+        original_rate REAL,                 -- 原费率（%）
+        fixed_fee REAL,                     -- 每笔固定费用（元），按费率收费时为NULL
+        amount_text TEXT,                   -- 适用金额原文
+        period_text TEXT,                   -- 适用期限原文
+        rate_text TEXT,                     -- 费率原文
+        PRIMARY KEY (fund_id, fee_type, tier)
+    ) WITHOUT ROWID
+    ''',
+    # 按费用类型和持有期限查询，如持有7天后赎回费为0的基金
+    '''
+    CREATE INDEX IF NOT EXISTS idx_fund_fee_tiers_type_days ON fund_fee_tiers (fee_type, min_days, max_days, rate)
+    ''',
+]
+
+fee_tier_columns = [
+    'fund_id', 'fee_type', 'tier', 'min_amount', 'max_amount', 'min_days', 'max_days',
+    'rate', 'original_rate', 'fixed_fee', 'amount_text', 'period_text', 'rate_text'
+]
+
+# 期限和金额单位换算
+period_unit_days = {'天': 1, '日': 1, '周': 7, '个月': 30, '月': 30, '年': 365}
+amount_unit_yuan = {'元': 1, '万元': 10000, '亿元': 100000000}
+
+_bound_pattern = re.compile(r'(大于等于|大于|小于等于|小于|≥|>|≤|<)\s*(\d+(?:\.\d+)?)\s*(个月|天|日|周|月|年|万元|亿元|元)')
+
+
+def create_if_not_exists_fund_fee_tiers_table(funds_db_file_path: str):
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    for schema in fund_fee_tier_schemas:
+        cursor.execute(schema)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def parse_bounds(text: str, units: dict, integer: bool):
+    """把'大于等于7天，小于1年'、'小于100万元'等文本转换为[下限, 上限)区间
+
+    Args:
+        text (str): 适用期限或适用金额原文，'---'或空表示不限
+        units (dict): 单位 -> 换算系数
+        integer (bool): 是否为整数（天数），'大于N天'转换为下限N+1，'小于等于N天'转换为上限N+1
+
+    Raises:
+        Exception: 有单位不在units中
+
+    Returns:
+        tuple: (下限, 上限)，上限为None表示不限
+    """
+    lower, upper = 0, None
+    step = 1 if integer else 0
+    for operator, number, unit in _bound_pattern.findall(text or ''):
+        if unit not in units:
+            raise Exception(f"Unknown unit {unit} in {text}")
+        value = float(number) * units[unit]
+        if integer:
+            value = int(round(value))
+        if operator in ('大于等于', '≥'):
+            lower = value
+        elif operator in ('大于', '>'):
+            lower = value + step
+        elif operator in ('小于', '<'):
+            upper = value
+        else:
+            upper = value + step
+    return lower, upper
+
+
+def parse_rate(text: str):
+    """把费率文本转换为数值
+
+    '1.50%|0.15%|0.15%'为原费率|天天基金优惠费率|活期宝优惠费率，'每笔1000元'为按笔收费
+
+    Returns:
+        tuple: (实际费率%, 原费率%, 每笔固定费用元)，没有的项为None
+    """
+    text = (text or '').strip()
+    fixed_fee_match = re.search(r'每笔\s*(\d+(?:\.\d+)?)\s*元', text)
+    if fixed_fee_match:
+        return None, None, float(fixed_fee_match.group(1))
+
+    rates = [float(match) for match in re.findall(r'(\d+(?:\.\d+)?)\s*%', text)]
+    if not rates:
+        return None, None, None
+    original_rate = rates[0]
+    rate = rates[1] if len(rates) > 1 else original_rate
+    return rate, original_rate, None
+
+
+def normalize_fee_tiers(fund_id: str, fee_tiers):
+    """把crawler.parse_fee_tiers的结果转换为fund_fee_tiers表的行
+
+    Args:
+        fund_id (str): 基金代码
+        fee_tiers (list): [{'费率类型', '适用金额', '适用期限', '费率'}]
+
+    Returns:
+        list: 按fee_tier_columns顺序的行
+    """
+    rows = []
+    tier_numbers = {}
+    for fee_tier in fee_tiers:
+        fee_type = fee_table_types.get(fee_tier['费率类型'])
+        if fee_type is None:
+            continue
+        tier = tier_numbers[fee_type] = tier_numbers.get(fee_type, -1) + 1
+        min_amount, max_amount = parse_bounds(fee_tier['适用金额'], amount_unit_yuan, integer=False)
+        min_days, max_days = parse_bounds(fee_tier['适用期限'], period_unit_days, integer=True)
+        rate, original_rate, fixed_fee = parse_rate(fee_tier['费率'])
+        rows.append((
+            fund_id, fee_type, tier, min_amount, max_amount, min_days, max_days,
+            rate, original_rate, fixed_fee, fee_tier['适用金额'], fee_tier['适用期限'], fee_tier['费率']
+        ))
+    return rows
+
+
+def replace_fund_fee_tiers(cursor, fee_tiers_by_fund: dict):
+    """用新解析的费率表替换这些基金在fund_fee_tiers表中的全部档位。不提交
+
+    Args:
+        cursor (sqlite3.Cursor): 数据库游标
+        fee_tiers_by_fund (dict): {基金代码: crawler.parse_fee_tiers的结果}
+    """
+    for schema in fund_fee_tier_schemas:
+        cursor.execute(schema)
+    cursor.executemany('DELETE FROM fund_fee_tiers WHERE fund_id = ?', [(fund_id,) for fund_id in fee_tiers_by_fund])
+    cursor.executemany(f'''
+        INSERT INTO fund_fee_tiers ({', '.join(fee_tier_columns)})
+        VALUES ({', '.join('?' * len(fee_tier_columns))})
+    ''', [
+        row
+        for fund_id, fee_tiers in fee_tiers_by_fund.items()
+        for row in normalize_fee_tiers(fund_id, fee_tiers)
+    ])
+
+
+class FeeSchedules:
+    """把fund_fee_tiers表读入数组，批量计算持有成本，不访问网络"""
+
+    def __init__(self, funds_db_file_path: str, fund_ids=None):
+        """
+        Args:
+            funds_db_file_path (str): 数据库文件路径
+            fund_ids (list, optional): 只读取这些基金，为None时读取全部. Defaults to None.
+        """
+        conn = sqlite3.connect(funds_db_file_path)
+        cursor = conn.cursor()
+        select_query = '''
+            SELECT fund_id, fee_type, min_amount, max_amount, min_days, max_days, rate, fixed_fee
+            FROM fund_fee_tiers
+        '''
+        if fund_ids is None:
+            cursor.execute(f'{select_query} ORDER BY fund_id, fee_type, tier')
+            rows = cursor.fetchall()
+        else:
+            # 去重并排序，分批查询的结果仍按基金代码有序
+            fund_ids = sorted(set(fund_ids))
+            rows = []
+            # 分批查询，避免超过SQLite参数个数上限
+            for start in range(0, len(fund_ids), 500):
+                batch = fund_ids[start:start + 500]
+                cursor.execute(f"{select_query} WHERE fund_id IN ({', '.join('?' * len(batch))}) "
+                               f"ORDER BY fund_id, fee_type, tier", batch)
+                rows.extend(cursor.fetchall())
+        cursor.close()
+        conn.close()
+
+        columns = list(zip(*rows)) if rows else [()] * 8
+        self.tier_fund_ids = np.array(columns[0], dtype=str)
+        self.fee_types = np.array(columns[1], dtype=str)
+        self.min_amounts = np.array([0 if value is None else value for value in columns[2]], dtype=np.float64)
+        self.max_amounts = np.array([np.inf if value is None else value for value in columns[3]], dtype=np.float64)
+        self.min_days = np.array([0 if value is None else value for value in columns[4]], dtype=np.float64)
+        self.max_days = np.array([np.inf if value is None else value for value in columns[5]], dtype=np.float64)
+        self.rates = np.array([np.nan if value is None else value for value in columns[6]], dtype=np.float64) / 100
+        self.fixed_fees = np.array([np.nan if value is None else value for value in columns[7]], dtype=np.float64)
+
+    def _match_tiers(self, fund_ids, fee_type: str, amounts, days):
+        # 每个基金在金额和持有天数所在的档位，返回(基金位置, 档位行号)
+        # 档位按基金代码排序，每个基金的档位是连续的一段，展开为(基金位置, 档位行号)对后一起比较
+        starts = np.searchsorted(self.tier_fund_ids, fund_ids, side='left')
+        ends = np.searchsorted(self.tier_fund_ids, fund_ids, side='right')
+        counts = ends - starts
+        fund_positions = np.repeat(np.arange(len(fund_ids)), counts)
+        rows = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+
+        tier_amounts = amounts[fund_positions]
+        tier_days = days[fund_positions]
+        matched = (
+            (self.fee_types[rows] == fee_type) &
+            (self.min_amounts[rows] <= tier_amounts) & (tier_amounts < self.max_amounts[rows]) &
+            (self.min_days[rows] <= tier_days) & (tier_days < self.max_days[rows])
+        )
+        return fund_positions[matched], rows[matched]
+
+    def holding_cost(self, fund_ids, amount, days, fee_type: str = 'subscription'):
+        """计算按amount元申购、持有days天后全部赎回的交易费用，假设期间净值不变
+
+        申购费按外扣法：净申购金额 = 申购金额 / (1 + 申购费率)，按笔收费时为申购金额 - 每笔费用；
+        赎回费 = 净申购金额 × 赎回费率。管理费、托管费、销售服务费已从净值中扣除，不计入。
+
+        Args:
+            fund_ids (list): 基金代码
+            amount (float or np.ndarray): 申购金额（元），数组时与fund_ids一一对应
+            days (int or np.ndarray): 持有天数，数组时与fund_ids一一对应
+            fee_type (str, optional): 申购费类型，'subscription'或'subscription_back_end'. Defaults to 'subscription'.
+
+        Returns:
+            dict:
+                'subscription_fee': 申购费（元） (np.ndarray)
+                'redemption_fee': 赎回费（元） (np.ndarray)
+                'total_cost': 合计（元） (np.ndarray)
+                'cost_rate': 合计 / 申购金额 (np.ndarray)
+            没有费率数据的基金（包括不保存费率档位的货币基金）为NaN，有费率数据但缺少某类费用的视为该费用为0
+        """
+        fund_ids = np.asarray(fund_ids, dtype=str)
+        n_funds = len(fund_ids)
+        amounts = np.broadcast_to(np.asarray(amount, dtype=np.float64), (n_funds,))
+        days = np.broadcast_to(np.asarray(days, dtype=np.float64), (n_funds,))
+
+        subscription_fees = np.zeros(n_funds)
+        redemption_rates = np.zeros(n_funds)
+        if n_funds:
+            positions, rows = self._match_tiers(fund_ids, fee_type, amounts, days)
+            with np.errstate(invalid='ignore'):
+                subscription_fees[positions] = np.where(
+                    np.isnan(self.fixed_fees[rows]),
+                    amounts[positions] - amounts[positions] / (1 + self.rates[rows]),
+                    np.minimum(self.fixed_fees[rows], amounts[positions]),
+                )
+            positions, rows = self._match_tiers(fund_ids, 'redemption', amounts, days)
+            redemption_rates[positions] = self.rates[rows]
+        # 档位没有费率（'---'）时不收费
+        subscription_fees = np.nan_to_num(subscription_fees)
+        redemption_rates = np.nan_to_num(redemption_rates)
+
+        redemption_fees = (amounts - subscription_fees) * redemption_rates
+        total_costs = subscription_fees + redemption_fees
+
+        has_schedule = np.searchsorted(self.tier_fund_ids, fund_ids, side='right') > \
+            np.searchsorted(self.tier_fund_ids, fund_ids, side='left')
+        for costs in (subscription_fees, redemption_fees, total_costs):
+            costs[~has_schedule] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cost_rates = total_costs / amounts
+        return {
+            'subscription_fee': subscription_fees,
+            'redemption_fee': redemption_fees,
+            'total_cost': total_costs,
+            'cost_rate': cost_rates,
+        }
+
+
+def holding_cost(funds_db_file_path: str, fund_ids, amount, days, fee_type: str = 'subscription'):
+    """从fund_fee_tiers表读取费率，计算多个基金申购amount元持有days天后赎回的交易费用，见FeeSchedules.holding_cost"""
+    fund_ids = list(fund_ids)
+    return FeeSchedules(funds_db_file_path, fund_ids).holding_cost(fund_ids, amount, days, fee_type)
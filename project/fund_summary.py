@@ -0,0 +1,251 @@
+import re
+import sqlite3
+
+# 视为可以申购的申购状态
+open_trading_statuses = ('开放申购', '限大额')
+
+fund_summary_schemas = [
+    # 创建基金筛选汇总表，由funds表的文本字段转换为数值，筛选时不需要在Python中解析字符串
+    '''
+    CREATE TABLE IF NOT EXISTS fund_summary (
+        fund_id VARCHAR(20) PRIMARY KEY,    -- 基金代码
+        fund_name TEXT,                     -- 基金简称
+        fund_type TEXT,                     -- 基金类型
+        is_open INTEGER,                    -- 是否可以申购，1: 是, 0: 否
+        subscription_rate REAL,             -- 申购费率（%）
+        redemption_period INTEGER,          -- 最低赎回费率所须持有天数，货币基金为0
+        redemption_rate REAL,               -- 最低赎回费率（%），货币基金为0
+        closed_months INTEGER,              -- 封闭期（月），无封闭期为0
+        latest_scale REAL,                  -- 最新规模（亿）
+        inception_date DATE,                -- 成立日
+        latest_manager_change_date DATE     -- 最新基金经理变动日期
+    ) WITHOUT ROWID
+    ''',
+    # 覆盖索引，筛选条件和返回的列都在索引中（表没有rowid，索引自带主键fund_id），不需要回表
+    '''
+    CREATE INDEX IF NOT EXISTS idx_fund_summary_open_type ON fund_summary (
+        is_open, fund_type, subscription_rate, redemption_period, redemption_rate,
+        latest_manager_change_date, latest_scale, fund_name, closed_months, inception_date
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_fund_summary_redemption ON fund_summary (
+        redemption_period, subscription_rate, is_open, fund_type, redemption_rate,
+        latest_manager_change_date, latest_scale, fund_name, closed_months, inception_date
+    )
+    ''',
+]
+
+# screen_funds返回的列
+summary_columns = [
+    'fund_id', 'fund_name', 'fund_type', 'is_open', 'subscription_rate', 'redemption_period',
+    'redemption_rate', 'closed_months', 'latest_scale', 'inception_date', 'latest_manager_change_date'
+]
+
+
+def create_if_not_exists_fund_summary_table(funds_db_file_path: str):
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    for schema in fund_summary_schemas:
+        cursor.execute(schema)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def parse_number(text):
+    """从'0.15%'、'12.34'等文本中取出数值，没有数值时返回None"""
+    if text is None:
+        return None
+    if isinstance(text, (int, float)):
+        return float(text)
+    match = re.search(r'-?\d+(?:\.\d+)?', text)
+    return float(match.group()) if match else None
+
+
+def normalize_fund_row(row):
+    """把funds表的一行转换为fund_summary表的一行
+
+    Args:
+        row (tuple): (fund_id, fund_name, fund_type, trading_status, subscription_rate, redemption_period,
+                      redemption_rate, closed_period, latest_scale, inception_date, latest_manager_change_date)
+
+    Returns:
+        tuple: 按summary_columns顺序的数值化结果
+    """
+    (fund_id, fund_name, fund_type, trading_status, subscription_rate, redemption_period,
+     redemption_rate, closed_period, latest_scale, inception_date, latest_manager_change_date) = row
+
+    redemption_period = parse_number(redemption_period)
+    redemption_rate = parse_number(redemption_rate)
+    # 货币基金不收取赎回费用，也没有持有期限
+    if fund_type and '货币型' in fund_type:
+        redemption_period = 0 if redemption_period is None else redemption_period
+        redemption_rate = 0.0 if redemption_rate is None else redemption_rate
+
+    closed_months = parse_number(closed_period)
+
+    return (
+        fund_id,
+        fund_name,
+        fund_type or None,
+        int(trading_status in open_trading_statuses) if trading_status else None,
+        parse_number(subscription_rate),
+        None if redemption_period is None else int(redemption_period),
+        redemption_rate,
+        None if closed_months is None else int(closed_months),
+        parse_number(latest_scale),
+        inception_date or None,
+        latest_manager_change_date or None,
+    )
+
+
+def update_fund_summary(cursor, fund_ids=None):
+    """用funds表更新fund_summary表。不提交
+
+    Args:
+        cursor (sqlite3.Cursor): 数据库游标
+        fund_ids (list, optional): 需要更新的基金代码，为None时更新全部. Defaults to None.
+    """
+    for schema in fund_summary_schemas:
+        cursor.execute(schema)
+
+    select_query = '''
+        SELECT fund_id, fund_name, fund_type, trading_status, subscription_rate, redemption_period,
+               redemption_rate, closed_period, latest_scale, inception_date, latest_manager_change_date
+        FROM funds
+    '''
+    if fund_ids is None:
+        cursor.execute(select_query)
+        rows = cursor.fetchall()
+    else:
+        fund_ids = list(fund_ids)
+        rows = []
+        # 分批查询，避免超过SQLite参数个数上限
+        for start in range(0, len(fund_ids), 500):
+            batch = fund_ids[start:start + 500]
+            cursor.execute(f"{select_query} WHERE fund_id IN ({', '.join('?' * len(batch))})", batch)
+            rows.extend(cursor.fetchall())
+
+    cursor.executemany(f'''
+        INSERT OR REPLACE INTO fund_summary ({', '.join(summary_columns)})
+        VALUES ({', '.join('?' * len(summary_columns))})
+    ''', [normalize_fund_row(row) for row in rows])
+
+
+def refresh_fund_summary(funds_db_file_path: str, fund_ids=None):
+    """用funds表重建或部分更新fund_summary表
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        fund_ids (list, optional): 需要更新的基金代码，为None时更新全部. Defaults to None.
+    """
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    try:
+        update_fund_summary(cursor, fund_ids)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def build_screen_query(open_for_subscription: bool = None, fund_type: str = None,
+                       max_redemption_period: int = None, max_subscription_rate: float = None,
+                       max_redemption_rate: float = None, manager_unchanged_since: str = None,
+                       min_scale: float = None, max_scale: float = None,
+                       order_by: str = 'subscription_rate', limit: int = None):
+    """生成screen_funds的SQL和参数，参数同screen_funds
+
+    Raises:
+        Exception: 排序列不存在
+
+    Returns:
+        tuple: (SQL, 参数列表)，结果的列为summary_columns
+    """
+    if order_by not in summary_columns:
+        raise Exception(f"Unknown order_by column {order_by}")
+
+    conditions = []
+    params = []
+    if open_for_subscription is not None:
+        conditions.append('is_open = ?')
+        params.append(int(open_for_subscription))
+    if fund_type is not None:
+        # 用范围条件代替LIKE，可以使用索引
+        conditions.append('fund_type >= ? AND fund_type < ?')
+        params.extend([fund_type, fund_type + '\uffff'])
+    if max_redemption_period is not None:
+        conditions.append('redemption_period <= ?')
+        params.append(max_redemption_period)
+    if max_subscription_rate is not None:
+        conditions.append('subscription_rate <= ?')
+        params.append(max_subscription_rate)
+    if max_redemption_rate is not None:
+        conditions.append('redemption_rate <= ?')
+        params.append(max_redemption_rate)
+    if manager_unchanged_since is not None:
+        conditions.append('latest_manager_change_date <= ?')
+        params.append(manager_unchanged_since)
+    if min_scale is not None:
+        conditions.append('latest_scale >= ?')
+        params.append(min_scale)
+    if max_scale is not None:
+        conditions.append('latest_scale <= ?')
+        params.append(max_scale)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    limit_clause = 'LIMIT ?' if limit is not None else ''
+    if limit is not None:
+        params.append(limit)
+
+    query = f'''
+        SELECT {', '.join(summary_columns)}
+        FROM fund_summary
+        {where_clause}
+        ORDER BY {order_by} IS NULL, {order_by}, fund_id
+        {limit_clause};
+    '''
+    return query, params
+
+
+def screen_funds(funds_db_file_path: str, open_for_subscription: bool = None, fund_type: str = None,
+                 max_redemption_period: int = None, max_subscription_rate: float = None,
+                 max_redemption_rate: float = None, manager_unchanged_since: str = None,
+                 min_scale: float = None, max_scale: float = None,
+                 order_by: str = 'subscription_rate', limit: int = None):
+    """按条件筛选基金，所有条件都在SQL中过滤，为None的条件不使用
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        open_for_subscription (bool, optional): 是否可以申购. Defaults to None.
+        fund_type (str, optional): 基金类型前缀，如'债券型'匹配'债券型-长债'. Defaults to None.
+        max_redemption_period (int, optional): 最低赎回费率所须持有天数不超过该值. Defaults to None.
+        max_subscription_rate (float, optional): 申购费率（%）不超过该值. Defaults to None.
+        max_redemption_rate (float, optional): 最低赎回费率（%）不超过该值. Defaults to None.
+        manager_unchanged_since (str, optional): 基金经理在该日期YYYY-MM-DD及之前就任且此后未变动. Defaults to None.
+        min_scale (float, optional): 最新规模（亿）下限. Defaults to None.
+        max_scale (float, optional): 最新规模（亿）上限. Defaults to None.
+        order_by (str, optional): 排序列，summary_columns之一. Defaults to 'subscription_rate'.
+        limit (int, optional): 最多返回的基金数. Defaults to None.
+
+    Raises:
+        Exception: 排序列不存在
+
+    Returns:
+        list: 符合条件的基金，每个为{列名: 值}
+    """
+    query, params = build_screen_query(
+        open_for_subscription, fund_type, max_redemption_period, max_subscription_rate, max_redemption_rate,
+        manager_unchanged_since, min_scale, max_scale, order_by, limit
+    )
+
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return [dict(zip(summary_columns, row)) for row in rows]
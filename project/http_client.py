@@ -0,0 +1,190 @@
+import hashlib
+import os
+import pathlib
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+from rate_limiter import get_limiter
+
+default_cache_dir = pathlib.Path(__file__).parent.parent / "data" / "http_cache"
+
+
+class RawResponseCache:
+    """按URL内容寻址的网页原始内容磁盘缓存
+
+    文件名为URL的sha256，过期时间以文件修改时间计算，总大小超过上限时优先删除最旧的文件。
+    """
+
+    def __init__(self, cache_dir=default_cache_dir, ttl_seconds: float = 24 * 3600, max_bytes: int = 2 * 1024 ** 3):
+        """
+        Args:
+            cache_dir (str, optional): 缓存目录. Defaults to default_cache_dir.
+            ttl_seconds (float, optional): 缓存有效时长（秒），设为float('inf')则永不过期. Defaults to 1天.
+            max_bytes (int, optional): 缓存总大小上限（字节）. Defaults to 2GB.
+        """
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def _path(self, url: str):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self.cache_dir / digest[:2] / digest
+
+    def get(self, url: str):
+        """读取缓存
+
+        Returns:
+            bytes: 网页原始内容，不存在或已过期时为None
+        """
+        path = self._path(url)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl_seconds:
+                return None
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, url: str, content: bytes):
+        """写入缓存，必要时淘汰旧文件"""
+        path = self._path(url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # 先写临时文件再替换，避免并发读到写了一半的内容
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(content)
+        try:
+            old_size = path.stat().st_size
+        except FileNotFoundError:
+            old_size = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_total_bytes()
+            else:
+                self._total_bytes += len(content) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _cache_files(self):
+        return [p for p in self.cache_dir.glob('*/*') if not p.name.endswith('.tmp')]
+
+    def _scan_total_bytes(self):
+        return sum(p.stat().st_size for p in self._cache_files())
+
+    def _evict(self):
+        # 删除最旧的文件，直到总大小降到上限的90%以下
+        target_bytes = self.max_bytes * 0.9
+        files = []
+        for p in self._cache_files():
+            try:
+                stat = p.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, p))
+        files.sort()
+
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, p in files:
+            if total_bytes <= target_bytes:
+                break
+            try:
+                p.unlink()
+                total_bytes -= size
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total_bytes
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            for p in self._cache_files():
+                p.unlink(missing_ok=True)
+            self._total_bytes = 0
+
+
+default_cache = RawResponseCache()
+
+# URL路径中的数字（基金代码等）替换为占位符，得到统计用的接口名
+_endpoint_digits_pattern = re.compile(r'\d+')
+
+
+def get_endpoint(url: str):
+    """把URL归并为接口名，如http://fundf10.eastmoney.com/jjfl_000001.html -> fundf10.eastmoney.com/jjfl_{n}.html"""
+    parts = urlsplit(url)
+    return f"{parts.hostname}{_endpoint_digits_pattern.sub('{n}', parts.path)}"
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_maxsize: int = 32):
+    """获取共享的requests.Session，复用到同一host的keep-alive连接
+
+    Args:
+        pool_maxsize (int, optional): 每个host的最大连接数，仅在第一次调用时生效. Defaults to 32.
+
+    Returns:
+        requests.Session: 共享会话
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def fetch_text(url: str, encoding: str = 'utf-8', use_cache: bool = True, timeout: float = 30):
+    """获取网页内容，优先读取磁盘缓存。网络请求受该host的自适应并发限制，熔断期间等待恢复
+
+    Args:
+        url (str): 网址
+        encoding (str, optional): 网页编码. Defaults to 'utf-8'.
+        use_cache (bool, optional): 是否读写缓存. Defaults to True.
+        timeout (float, optional): 请求超时（秒）. Defaults to 30.
+
+    Raises:
+        requests.RequestException: 请求失败或返回非2xx状态码
+
+    Returns:
+        str: 网页内容
+    """
+    endpoint = get_endpoint(url)
+    if use_cache:
+        content = default_cache.get(url)
+        if content is not None:
+            metrics.inc('http_cache_hits_total', endpoint=endpoint)
+            return content.decode(encoding, errors='replace')
+
+    limiter = get_limiter(urlsplit(url).hostname)
+    limiter.acquire()
+    start = time.monotonic()
+    try:
+        response = get_session().get(url, timeout=timeout)
+    except requests.RequestException as e:
+        latency = time.monotonic() - start
+        limiter.release(latency, error=e)
+        metrics.observe('http_request_seconds', latency, endpoint=endpoint)
+        metrics.inc('http_requests_total', endpoint=endpoint, status=type(e).__name__)
+        raise
+    latency = time.monotonic() - start
+    limiter.release(latency, status_code=response.status_code)
+    metrics.observe('http_request_seconds', latency, endpoint=endpoint)
+    metrics.inc('http_requests_total', endpoint=endpoint, status=str(response.status_code))
+    response.raise_for_status()
+    content = response.content
+    metrics.inc('http_response_bytes_total', len(content), endpoint=endpoint)
+
+    if use_cache:
+        default_cache.put(url, content)
+    return content.decode(encoding, errors='replace')
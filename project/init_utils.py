@@ -1,11 +1,108 @@
 import sqlite3
 import pathlib
-import akshare as ak
 import re
+import queue
+import threading
+import time
+from itertools import repeat
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import metrics
+from rate_limiter import call_limited
 
 default_db_file_path = pathlib.Path(__file__).parent.parent / "data" / "funds.db"
 
+# akshare依赖很多，导入需要约1秒，只在第一次获取网络数据时由get_akshare导入。测试时可以直接替换为模拟对象
+# fee_schedule、nav_archive依赖numpy，与fund_summary一样只在建表、读写时用到，在用到的函数内导入，import init_utils不为此付出导入时间
+ak = None
+
+
+def get_akshare():
+    """导入并返回akshare模块"""
+    global ak
+    if ak is None:
+        import akshare
+        ak = akshare
+    return ak
+
+# 历史数据表的建表语句，主键(fund_id, 日期)使同一基金的数据按日期聚集存放，按基金查询时间段不需要全表扫描
+history_table_schemas = {
+    # 基金单位净值表
+    'fund_nav': '''
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            fund_id VARCHAR(20),                -- 基金代码
+            value_date DATE,                    -- 净值日期
+            nav DECIMAL(10, 4),           -- 净值
+            PRIMARY KEY (fund_id, value_date),
+            FOREIGN KEY (fund_id) REFERENCES funds(fund_id)
+        ) WITHOUT ROWID
+    ''',
+    # 基金累计净值表
+    'fund_cumulative_nav': '''
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            fund_id VARCHAR(20),                -- 基金代码
+            value_date DATE,                    -- 净值日期
+            cumulative_nav DECIMAL(10, 4),      -- 累计净值
+            PRIMARY KEY (fund_id, value_date),
+            FOREIGN KEY (fund_id) REFERENCES funds(fund_id)
+        ) WITHOUT ROWID
+    ''',
+    # 基金分红表
+    'fund_dividends': '''
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            fund_id VARCHAR(20),                -- 基金代码
+            ex_dividend_date DATE,              -- 除息日
+            dividend_per_share DECIMAL(10, 4),  -- 每份分红
+            PRIMARY KEY (fund_id, ex_dividend_date),
+            FOREIGN KEY (fund_id) REFERENCES funds(fund_id)
+        ) WITHOUT ROWID
+    ''',
+    # 基金拆分表
+    'fund_splits': '''
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            fund_id VARCHAR(20),                -- 基金代码
+            split_date DATE,                    -- 拆分折算日
+            split_type TEXT,                    -- 拆分类型
+            split_ratio TEXT,                   -- 拆分折算比例
+            PRIMARY KEY (fund_id, split_date),
+            FOREIGN KEY (fund_id) REFERENCES funds(fund_id)
+        ) WITHOUT ROWID
+    ''',
+}
+
+# 历史数据表的二级索引，按日期横截面查询用。批量全量导入时先删除，导入完成后重建
+history_table_indexes = {
+    'idx_fund_nav_value_date': 'CREATE INDEX IF NOT EXISTS idx_fund_nav_value_date ON fund_nav (value_date)',
+    'idx_fund_cumulative_nav_value_date': 'CREATE INDEX IF NOT EXISTS idx_fund_cumulative_nav_value_date ON fund_cumulative_nav (value_date)',
+}
+
+
+def connect_db(funds_db_file_path: str, bulk_load: bool = False, timeout: float = 60):
+    """连接数据库并设置WAL模式
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        bulk_load (bool, optional): 批量导入模式，关闭每次提交时的fsync，断电可能丢失最近提交的数据，但不会损坏数据库. Defaults to False.
+        timeout (float, optional): 其他连接（如其他worker进程）持有写锁时最多等待的秒数. Defaults to 60.
+
+    Returns:
+        sqlite3.Connection: 数据库连接
+    """
+    conn = sqlite3.connect(funds_db_file_path, timeout=timeout)
+    # WAL模式下读写互不阻塞，且该设置会保存在数据库文件中
+    conn.execute('PRAGMA journal_mode = WAL')
+    if bulk_load:
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA cache_size = -262144')  # 256MB
+        conn.execute('PRAGMA temp_store = MEMORY')
+    else:
+        conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
+
+
 def create_if_not_exists_db_tables(funds_db_file_path):
+    from fee_schedule import fund_fee_tier_schemas
+    from fund_summary import fund_summary_schemas
+
     # 连接到SQLite数据库（如果不存在则创建）
     conn = sqlite3.connect(funds_db_file_path)
     cursor = conn.cursor()
@@ -29,78 +126,110 @@ def create_if_not_exists_db_tables(funds_db_file_path):
     );
     ''')
 
-    # 创建基金单位净值表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS fund_nav (
-            fund_id VARCHAR(20),                -- 基金代码
-            value_date DATE,                    -- 净值日期
-            nav DECIMAL(10, 4),           -- 净值
-            FOREIGN KEY (fund_id) REFERENCES funds(fund_id)
-        )
-    ''')
+    # 创建基金净值、累计净值、分红、拆分表
+    for table_name, schema in history_table_schemas.items():
+        cursor.execute(schema.format(table_name=table_name))
 
-    # 创建基金累计净值表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS fund_cumulative_nav (
-            fund_id VARCHAR(20),                -- 基金代码
-            value_date DATE,                    -- 净值日期
-            cumulative_nav DECIMAL(10, 4),      -- 累计净值
-            FOREIGN KEY (fund_id) REFERENCES funds(fund_id)
-        )
-    ''')
+    # 创建基金筛选汇总表
+    for schema in fund_summary_schemas:
+        cursor.execute(schema)
 
-    # 创建基金分红表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS fund_dividends (
-            fund_id VARCHAR(20),                -- 基金代码
-            ex_dividend_date DATE,              -- 除息日
-            dividend_per_share DECIMAL(10, 4),  -- 每份分红
-            FOREIGN KEY (fund_id) REFERENCES funds(fund_id)
-        )
-    ''')
+    # 创建基金费率档位表
+    for schema in fund_fee_tier_schemas:
+        cursor.execute(schema)
 
-    # 创建基金拆分表
+    # 创建爬取任务进度表，记录每个基金每项数据的爬取状态，中断后可以继续
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS fund_splits (
+        CREATE TABLE IF NOT EXISTS crawl_jobs (
             fund_id VARCHAR(20),                -- 基金代码
-            split_date DATE,                    -- 拆分折算日
-            split_type TEXT,                    -- 拆分类型
-            split_ratio TEXT,                   -- 拆分折算比例
-            FOREIGN KEY (fund_id) REFERENCES funds(fund_id)
-        )
+            indicator TEXT,                     -- 数据项，即写入的表名，如funds、fund_nav
+            status TEXT,                        -- done: 已完成, failed: 失败
+            updated_at TIMESTAMP,               -- 状态更新时间
+            error TEXT,                         -- 失败原因
+            PRIMARY KEY (fund_id, indicator)
+        ) WITHOUT ROWID
     ''')
 
     conn.commit()
     cursor.close()
     conn.close()
 
+    # 旧版本建的表没有主键，需要升级
+    upgrade_db_tables(funds_db_file_path)
+
+
+def upgrade_db_tables(funds_db_file_path: str):
+    """把旧版本没有主键的历史数据表重建为带主键的表，重复数据只保留最后插入的一条，并建立索引
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+    """
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+
+    for table_name, schema in history_table_schemas.items():
+        columns = cursor.execute(f'PRAGMA table_info({table_name})').fetchall()
+        # table_info每行第6个元素表示该列在主键中的位置，0表示不在主键中
+        if any(column[5] for column in columns):
+            continue
+
+        print(f"升级 {table_name}")
+        column_names = ', '.join(column[1] for column in columns)
+        cursor.execute(schema.format(table_name=f'{table_name}_new'))
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO {table_name}_new ({column_names})
+            SELECT {column_names} FROM {table_name} ORDER BY rowid
+        ''')
+        cursor.execute(f'DROP TABLE {table_name}')
+        cursor.execute(f'ALTER TABLE {table_name}_new RENAME TO {table_name}')
+        conn.commit()
+
+    for index_sql in history_table_indexes.values():
+        cursor.execute(index_sql)
+    conn.commit()
+
+    cursor.close()
+    conn.close()
+
 
-def save_all_fund_partial_data(funds_db_file_path: str):
+def save_all_fund_partial_data(funds_db_file_path: str, fund_open_fund_daily_em_df=None):
     """获取所有开放式基金的基金代码、基金简称、申购状态、手续费，存入数据库funds表
 
     Args:
         funds_db_file_path (str): 数据库文件路径
+        fund_open_fund_daily_em_df (pd.DataFrame, optional): 已获取的ak.fund_open_fund_daily_em()结果，为None时重新获取. Defaults to None.
     """
+    from fund_summary import update_fund_summary
+
     # 连接数据库
     conn = sqlite3.connect(funds_db_file_path)
     cursor = conn.cursor()
 
     # 先用列表的部分信息一次性更新所有基金
-    fund_open_fund_daily_em_df = ak.fund_open_fund_daily_em()
+    if fund_open_fund_daily_em_df is None:
+        fund_open_fund_daily_em_df = call_limited('fund.eastmoney.com', get_akshare().fund_open_fund_daily_em)
     partial_funds_basic_data = [tuple(row) for row in fund_open_fund_daily_em_df[['基金代码', '基金简称', '申购状态', '手续费']].values]
     
+    # 只更新这几列，保留详情页爬取的其他信息
     insert_query = '''
-    INSERT OR REPLACE INTO funds (
+    INSERT INTO funds (
         fund_id,            fund_name,      
         trading_status,     subscription_rate)
-    VALUES (?, ?, ?, ?);
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(fund_id) DO UPDATE SET
+        fund_name = excluded.fund_name,
+        trading_status = excluded.trading_status,
+        subscription_rate = excluded.subscription_rate;
     '''
 
     try:
         # 执行批量插入
-        cursor.executemany(insert_query, partial_funds_basic_data)
-        # 提交更改
-        conn.commit()
+        with metrics.timer(stage='db_write', table='funds'):
+            cursor.executemany(insert_query, partial_funds_basic_data)
+            update_fund_summary(cursor)
+            # 提交更改
+            conn.commit()
+        metrics.inc('rows_written_total', len(partial_funds_basic_data), table='funds')
         print("批量插入成功")
     except Exception as e:
         print(f"批量插入失败: {e}")
@@ -111,6 +240,79 @@ def save_all_fund_partial_data(funds_db_file_path: str):
         conn.close()
 
 
+def get_fund_daily_nav_data_for_save(fund_open_fund_daily_em_df):
+    """从开放式基金净值列表中提取每只基金的单位净值和累计净值
+
+    列表的列名形如'2024-07-01-单位净值'、'2024-07-01-累计净值'，包含最近两个净值日期，空值表示该基金当日未公布净值。
+
+    Args:
+        fund_open_fund_daily_em_df (pd.DataFrame): ak.fund_open_fund_daily_em()的结果
+
+    Returns:
+        tuple: (fund_nav_data, fund_cumulative_nav_data)，分别为fund_nav表和fund_cumulative_nav表待插入的数据
+    """
+    import pandas as pd
+
+    fund_nav_data = []
+    fund_cumulative_nav_data = []
+    fund_ids = fund_open_fund_daily_em_df['基金代码']
+
+    for column in fund_open_fund_daily_em_df.columns:
+        column_match = re.fullmatch(r'(\d{4}-\d{2}-\d{2})-(单位净值|累计净值)', column)
+        if column_match is None:
+            continue
+
+        value_date, indicator = column_match.groups()
+        values = pd.to_numeric(fund_open_fund_daily_em_df[column], errors='coerce')
+        published = values.notna()
+        rows = zip(fund_ids[published], [value_date] * int(published.sum()), values[published].tolist())
+
+        if indicator == '单位净值':
+            fund_nav_data.extend(rows)
+        else:
+            fund_cumulative_nav_data.extend(rows)
+
+    return fund_nav_data, fund_cumulative_nav_data
+
+
+def save_all_fund_daily_nav_data(funds_db_file_path: str, fund_open_fund_daily_em_df=None):
+    """用开放式基金净值列表一次性追加所有基金最近的单位净值和累计净值，存入fund_nav表和fund_cumulative_nav表。
+    每日更新用，逐个基金获取全部历史净值的save_all_fund_nav_data等只用于补全历史数据。
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        fund_open_fund_daily_em_df (pd.DataFrame, optional): 已获取的ak.fund_open_fund_daily_em()结果，为None时重新获取. Defaults to None.
+    """
+    if fund_open_fund_daily_em_df is None:
+        fund_open_fund_daily_em_df = call_limited('fund.eastmoney.com', get_akshare().fund_open_fund_daily_em)
+    fund_nav_data, fund_cumulative_nav_data = get_fund_daily_nav_data_for_save(fund_open_fund_daily_em_df)
+
+    conn = connect_db(funds_db_file_path)
+    cursor = conn.cursor()
+
+    try:
+        # 只写入比库中已有日期更新的净值，重复运行不会产生重复数据
+        for table_name, column_name, data in (('fund_nav', 'nav', fund_nav_data),
+                                              ('fund_cumulative_nav', 'cumulative_nav', fund_cumulative_nav_data)):
+            latest_dates = get_all_fund_latest_date_from_db(cursor, table_name, 'value_date')
+            new_data = [row for row in data if row[1] > latest_dates.get(row[0], '')]
+            with metrics.timer(stage='db_write', table=table_name):
+                cursor.executemany(f'''
+                    INSERT OR REPLACE INTO {table_name} (fund_id, value_date, {column_name})
+                    VALUES (?, ?, ?)
+                ''', new_data)
+            metrics.inc('rows_written_total', len(new_data), table=table_name)
+            print(f"{table_name} 追加 {len(new_data)} 条")
+        # 两张表在同一个事务中提交
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
 def get_all_fund_id_asc_from_db(funds_db_file_path: str):
     """获取数据库funds表所有基金代码，升序排列
 
@@ -136,137 +338,682 @@ def get_all_fund_id_asc_from_db(funds_db_file_path: str):
     return fund_ids
 
 
-def get_fund_all_nav_data(fund_id: str):
-    fund_nav_data = []
-    fund_open_fund_info_em_df = ak.fund_open_fund_info_em(symbol=fund_id, indicator="单位净值走势")
-    if fund_open_fund_info_em_df is not None:
-        fund_nav_data = [(fund_id, row['净值日期'].isoformat(), row['单位净值']) for index, row in fund_open_fund_info_em_df.iterrows()]
-    return fund_nav_data
+def get_all_fund_types_from_db(cursor):
+    """获取funds表中已爬取过详情页的基金类型
 
+    Returns:
+        dict: {基金代码: 基金类型}
+    """
+    cursor.execute('SELECT fund_id, fund_type FROM funds WHERE fund_type IS NOT NULL;')
+    return dict(cursor.fetchall())
 
-def save_all_fund_nav_data(funds_db_file_path: str):
-    """获取funds表里所有基金的每日单位净值，存入fund_nav表。耗时很长。
+
+def start_crawl_jobs(cursor, indicator: str, resume: bool, fund_ids=None):
+    """开始某项数据的爬取任务
+
+    Args:
+        cursor (sqlite3.Cursor): 数据库游标
+        indicator (str): 数据项，即写入的表名
+        resume (bool): 为True时继续上次的任务；为False时清空该数据项的进度重新开始
+        fund_ids (list, optional): 只处理这些基金时只读取它们的进度，为None时读取该数据项的全部进度.
+            resume为False时忽略. Defaults to None.
+
+    Returns:
+        set: 可以跳过的已完成基金代码
+    """
+    if not resume:
+        cursor.execute('DELETE FROM crawl_jobs WHERE indicator = ?', (indicator,))
+        return set()
+    if fund_ids is None:
+        cursor.execute('''
+            SELECT fund_id, status
+            FROM crawl_jobs
+            WHERE indicator = ?;
+        ''', (indicator,))
+        rows = cursor.fetchall()
+    else:
+        # 分批按主键查询，避免超过SQLite参数个数上限
+        fund_ids = list(fund_ids)
+        rows = []
+        for start in range(0, len(fund_ids), 500):
+            batch = fund_ids[start:start + 500]
+            cursor.execute(f'''
+                SELECT fund_id, status
+                FROM crawl_jobs
+                WHERE indicator = ? AND fund_id IN ({', '.join('?' * len(batch))});
+            ''', [indicator, *batch])
+            rows.extend(cursor.fetchall())
+    metrics.inc('crawl_retries_total', sum(status == 'failed' for _, status in rows), indicator=indicator)
+    return {fund_id for fund_id, status in rows if status == 'done'}
+
+
+def save_crawl_job_status(cursor, indicator: str, fund_ids, status: str, error: str = None):
+    """记录基金某项数据的爬取状态，不提交
 
     Args:
-        funds_db_file_path (str): _description_
+        cursor (sqlite3.Cursor): 数据库游标
+        indicator (str): 数据项，即写入的表名
+        fund_ids (list): 基金代码
+        status (str): 'done'或'failed'
+        error (str, optional): 失败原因. Defaults to None.
     """
+    cursor.executemany('''
+        INSERT OR REPLACE INTO crawl_jobs (fund_id, indicator, status, updated_at, error)
+        VALUES (?, ?, ?, datetime('now', 'localtime'), ?)
+    ''', [(fund_id, indicator, status, error) for fund_id in fund_ids])
+
+
+def save_funds_basic_info(funds_db_file_path: str, funds_basic_info, crawl_job_indicator: str = 'funds'):
+    """批量写入基金基础信息到funds表，已存在的基金则更新
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        funds_basic_info (list): crawler.get_fund_basic_info返回的dict列表
+        crawl_job_indicator (str, optional): 在同一事务中把这些基金在crawl_jobs表中该任务的状态记为完成，
+            为None时不写crawl_jobs表（如refresh_scheduler的进度记录在fund_crawl_state表中）. Defaults to 'funds'.
+    """
+    from fee_schedule import replace_fund_fee_tiers
+    from fund_summary import update_fund_summary
+
+    data_to_upsert = [
+        (
+            data['基金代码'],   data['基金简称'],   data['成立日'],         data['规模'],       data['类型'],
+            data['申购状态'],   data['封闭期'],     data['预估开放时间'],   data['申购费率'],   data['最低赎回费率适用期限'],
+            data['最低赎回费率'], data['基金经理'], data['最新经理变动日期']
+        )
+        for data in funds_basic_info
+    ]
+
+    upsert_query = '''
+    INSERT INTO funds (
+        fund_id,            fund_name,      inception_date,         latest_scale,      fund_type,
+        trading_status,     closed_period,  estimated_opening_time, subscription_rate, redemption_period,
+        redemption_rate,    fund_manager,   latest_manager_change_date)
+    VALUES (?, ?, ?, ?, ?,
+            ?, ?, ?, ?, ?,
+            ?, ?, ?)
+    ON CONFLICT(fund_id) DO UPDATE SET
+        fund_name = excluded.fund_name,
+        inception_date = excluded.inception_date,
+        latest_scale = excluded.latest_scale,
+        fund_type = excluded.fund_type,
+        trading_status = excluded.trading_status,
+        closed_period = excluded.closed_period,
+        estimated_opening_time = excluded.estimated_opening_time,
+        subscription_rate = excluded.subscription_rate,
+        redemption_period = excluded.redemption_period,
+        redemption_rate = excluded.redemption_rate,
+        fund_manager = excluded.fund_manager,
+        latest_manager_change_date = excluded.latest_manager_change_date;
+    '''
+
     conn = sqlite3.connect(funds_db_file_path)
     cursor = conn.cursor()
+    try:
+        with metrics.timer(stage='db_write', table='funds'):
+            cursor.executemany(upsert_query, data_to_upsert)
+            if crawl_job_indicator is not None:
+                save_crawl_job_status(cursor, crawl_job_indicator, [data[0] for data in data_to_upsert], 'done')
+            update_fund_summary(cursor, [data[0] for data in data_to_upsert])
+            replace_fund_fee_tiers(cursor, {data['基金代码']: data['费率表'] for data in funds_basic_info if '费率表' in data})
+            conn.commit()
+        metrics.inc('rows_written_total', len(data_to_upsert), table='funds')
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
 
-    fund_ids = get_all_fund_id_asc_from_db(funds_db_file_path)
 
-    # 获取每个基金的每日单位净值
-    for fund_id in fund_ids:
-        print(fund_id)
-        fund_nav_data = get_fund_all_nav_data(fund_id)
+def save_all_fund_basic_info(funds_db_file_path: str, concurrency: int = 8, batch_size: int = 200, resume: bool = False,
+                             parser_workers: int = 0, fund_ids=None):
+    """并发爬取funds表里所有基金的基础信息，分批写回funds表
 
-        # 保存基金历史全部每日单位净值到数据库
-        cursor.executemany('''
-            INSERT INTO fund_nav (fund_id, value_date, nav)
-            VALUES (?, ?, ?)
-        ''', fund_nav_data)
-        conn.commit()
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        concurrency (int, optional): 同时爬取的基金数. Defaults to 8.
+        batch_size (int, optional): 每批写入的基金数. Defaults to 200.
+        resume (bool, optional): 继续上次中断的爬取，跳过已完成的基金，只重试失败和未爬取的. Defaults to False.
+        parser_workers (int, optional): 解析网页的子进程数，为0时在下载线程中解析，见crawler.crawl_basic_info. Defaults to 0.
+        fund_ids (list, optional): 只爬取这些基金，为None时爬取funds表里所有基金. Defaults to None.
 
-    # conn.commit()
-    cursor.close()
-    conn.close()
+    Returns:
+        dict: 爬取失败的基金代码及对应异常
+    """
+    # crawler依赖requests和lxml，只在爬取时导入
+    from crawler import crawl_basic_info
+
+    conn = connect_db(funds_db_file_path)
+    cursor = conn.cursor()
+    done_fund_ids = start_crawl_jobs(cursor, 'funds', resume, fund_ids)
+    conn.commit()
+
+    if fund_ids is None:
+        fund_ids = get_all_fund_id_asc_from_db(funds_db_file_path)
+    fund_ids = [fund_id for fund_id in fund_ids if fund_id not in done_fund_ids]
+    # 已知类型的货币基金不请求费率页，非货币基金两个页面同时请求
+    fund_types = get_all_fund_types_from_db(cursor)
+
+    failed_funds = {}
+    funds_basic_info = []
+    try:
+        for fund_id, fund_info, error in crawl_basic_info(fund_ids, concurrency, parser_workers, fund_types):
+            if error is not None:
+                print(f"{fund_id} 获取失败: {error}")
+                failed_funds[fund_id] = error
+                save_crawl_job_status(cursor, 'funds', [fund_id], 'failed', str(error))
+                conn.commit()
+                metrics.inc('funds_processed_total', indicator='funds', status='failed')
+                continue
+
+            print(fund_id)
+            metrics.inc('funds_processed_total', indicator='funds', status='done')
+            funds_basic_info.append(fund_info)
+            if len(funds_basic_info) >= batch_size:
+                save_funds_basic_info(funds_db_file_path, funds_basic_info)
+                funds_basic_info = []
+                metrics.export_metrics(min_interval_seconds=30)
+    finally:
+        # 中断时也保存已爬取的部分
+        if funds_basic_info:
+            save_funds_basic_info(funds_db_file_path, funds_basic_info)
+        cursor.close()
+        conn.close()
+        metrics.export_metrics()
+
+    return failed_funds
+
+
+def format_dates_for_save(dates):
+    """把一列日期整体转换为YYYY-MM-DD字符串
+
+    Args:
+        dates (pd.Series): datetime.date、datetime64或日期字符串
+
+    Returns:
+        list: YYYY-MM-DD字符串
+    """
+    import pandas as pd
+
+    # datetime64[D]转字符串在numpy内部完成，不用逐行调用isoformat
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype(str).tolist()
+
+
+def convert_fund_nav_df_for_save(fund_id: str, fund_open_fund_info_em_df, value_column: str):
+    """把单位净值走势或累计净值走势DataFrame转换为待插入的数据
+
+    Args:
+        fund_id (str): 基金代码
+        fund_open_fund_info_em_df (pd.DataFrame): ak.fund_open_fund_info_em的结果
+        value_column (str): 净值列名，'单位净值'或'累计净值'
+
+    Returns:
+        list: [(基金代码, 净值日期, 净值), ...]
+    """
+    if fund_open_fund_info_em_df is None or fund_open_fund_info_em_df.empty:
+        return []
+    value_dates = format_dates_for_save(fund_open_fund_info_em_df['净值日期'])
+    values = fund_open_fund_info_em_df[value_column].to_numpy(dtype=float).tolist()
+    return list(zip(repeat(fund_id), value_dates, values))
+
+
+def fetch_fund_info_em(host: str, fund_id: str, indicator: str):
+    """在host的并发限制下调用ak.fund_open_fund_info_em，并记录接口耗时
+
+    Args:
+        host (str): 该指标实际访问的host
+        fund_id (str): 基金代码
+        indicator (str): ak.fund_open_fund_info_em的indicator参数
+
+    Returns:
+        pd.DataFrame: ak.fund_open_fund_info_em的结果
+    """
+    start = time.perf_counter()
+    try:
+        with metrics.timer(stage='fetch', indicator=indicator):
+            return call_limited(host, get_akshare().fund_open_fund_info_em, symbol=fund_id, indicator=indicator)
+    finally:
+        metrics.observe('http_request_seconds', time.perf_counter() - start,
+                        endpoint=f'{host}/fund_open_fund_info_em?indicator={indicator}')
+
+
+def get_fund_all_nav_data(fund_id: str):
+    fund_open_fund_info_em_df = fetch_fund_info_em('fund.eastmoney.com', fund_id, "单位净值走势")
+    with metrics.timer(stage='convert', table='fund_nav'):
+        return convert_fund_nav_df_for_save(fund_id, fund_open_fund_info_em_df, '单位净值')
+
+
+def get_all_fund_latest_date_from_db(cursor, table_name: str, date_column: str, fund_ids=None):
+    """获取某张历史数据表里每个基金的最新日期
+
+    Args:
+        cursor (sqlite3.Cursor): 数据库游标
+        table_name (str): 表名，如fund_nav
+        date_column (str): 日期列名，如value_date
+        fund_ids (list, optional): 只查询这些基金，按主键查找，不扫描全表；为None时查询全部基金. Defaults to None.
+
+    Returns:
+        dict: {基金代码: 最新日期(YYYY-MM-DD)}，包括已移入归档表的净值
+    """
+    from nav_archive import archive_table_name, archived_nav_tables, has_archive_table
+
+    if fund_ids is None:
+        batches = [None]
+    else:
+        # 分批查询，避免超过SQLite参数个数上限
+        fund_ids = list(fund_ids)
+        batches = [fund_ids[start:start + 500] for start in range(0, len(fund_ids), 500)]
+    # 归档表只在compact_nav_tables归档后才存在，没有时只查询净值表
+    with_archive = table_name in archived_nav_tables and has_archive_table(cursor, table_name)
+
+    latest_dates = {}
+    for batch in batches:
+        where_clause = '' if batch is None else f"WHERE fund_id IN ({', '.join('?' * len(batch))})"
+        params = [] if batch is None else batch
+        if with_archive:
+            cursor.execute(f'''
+                SELECT fund_id, MAX(last_date)
+                FROM (
+                    SELECT fund_id, MAX({date_column}) AS last_date FROM {table_name} {where_clause} GROUP BY fund_id
+                    UNION ALL
+                    SELECT fund_id, MAX(last_date) FROM {archive_table_name(table_name)} {where_clause} GROUP BY fund_id
+                )
+                GROUP BY fund_id;
+            ''', params * 2)
+        else:
+            cursor.execute(f'''
+                SELECT fund_id, MAX({date_column})
+                FROM {table_name}
+                {where_clause}
+                GROUP BY fund_id;
+            ''', params)
+        latest_dates.update(cursor.fetchall())
+    return latest_dates
+
+
+def save_all_fund_nav_data(funds_db_file_path: str, incremental: bool = False, resume: bool = False):
+    """获取funds表里所有基金的每日单位净值，存入fund_nav表。耗时很长。
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        incremental (bool, optional): 只写入库中最新净值日期之后的数据. Defaults to False.
+        resume (bool, optional): 继续上次中断的任务，跳过已完成的基金. Defaults to False.
+    """
+    # 保存基金历史全部每日单位净值到数据库
+    sync_all_fund_history_data(funds_db_file_path, ['fund_nav'], incremental, resume, concurrency=1)
+
+
+def calculate_split_ratio(ratio_str: str):
+    """提取拆分比例并计算比值，'1:1.0500'表示每1份折算为1.05份，返回1.05"""
+    left, right = map(float, ratio_str.split(':'))
+    return right / left
+
+
+def convert_fund_split_df_for_save(fund_id: str, fund_open_fund_info_em_df):
+    """把拆分详情DataFrame转换为待插入的数据
+
+    Returns:
+        list: [(基金代码, 拆分折算日, 拆分类型, 拆分折算比例), ...]
+    """
+    if fund_open_fund_info_em_df is None or fund_open_fund_info_em_df.empty:
+        return []
+    return list(zip(repeat(fund_id),
+                    fund_open_fund_info_em_df['拆分折算日'].tolist(),
+                    fund_open_fund_info_em_df['拆分类型'].tolist(),
+                    fund_open_fund_info_em_df['拆分折算比例'].tolist()))
+
+
+def parse_fund_fhsp_tables(html: str):
+    """从分红送配页解析分红和拆分表格，结果与ak.fund_open_fund_info_em的"分红送配详情"、"拆分详情"相同
+
+    Args:
+        html (str): 分红送配页网页内容
+
+    Returns:
+        tuple: (分红送配详情DataFrame, 拆分详情DataFrame)，没有记录时为空DataFrame
+    """
+    import pandas as pd
+    from io import StringIO
+
+    tables = pd.read_html(StringIO(html))
+    # 页面有3个表格时第1个不是分红拆分表
+    dividend_df, split_df = tables[1:3] if len(tables) == 3 else tables[0:2]
+    if dividend_df.iloc[0, 1] == "暂无分红信息!":
+        dividend_df = pd.DataFrame()
+    if split_df.iloc[0, 1] == "暂无拆分信息!":
+        split_df = pd.DataFrame()
+    return dividend_df, split_df
+
+
+def fetch_fund_fhsp_tables(fund_id: str):
+    """获取一次基金的分红送配页，解析出分红和拆分表格。受该host的并发限制，不读写缓存
+
+    ak.fund_open_fund_info_em获取分红和拆分时各请求一次同一网页，同时需要两者时用这个函数只请求一次。
+
+    Args:
+        fund_id (str): 基金代码
+
+    Returns:
+        tuple: (分红送配详情DataFrame, 拆分详情DataFrame)，见parse_fund_fhsp_tables
+    """
+    from http_client import fetch_text
+
+    with metrics.timer(stage='fetch', page='fhsp'):
+        html = fetch_text(f"https://fundf10.eastmoney.com/fhsp_{fund_id}.html", use_cache=False)
+    return parse_fund_fhsp_tables(html)
 
 
 def get_fund_all_split_data_for_save(fund_id: str):
-    fund_dividend_data = []
-    fund_open_fund_info_em_df = ak.fund_open_fund_info_em(symbol=fund_id, indicator="拆分详情")
+    # 分红和拆分数据来自fundf10.eastmoney.com的分红送配页
+    _, fund_split_df = fetch_fund_fhsp_tables(fund_id)
     # 拆分还有不同类型？可能需要进一步处理
-    # fund_open_fund_info_em_df['拆分折算比例'] = fund_open_fund_info_em_df['拆分折算比例'].apply(calculate_ratio)
-    # print(fund_open_fund_info_em_df)
-    if fund_open_fund_info_em_df is not None:
-        fund_dividend_data = [(fund_id, row['拆分折算日'], row['拆分类型'], row['拆分折算比例']) for index, row in fund_open_fund_info_em_df.iterrows()]
-    return fund_dividend_data
+    # fund_split_df['拆分折算比例'] = fund_split_df['拆分折算比例'].apply(calculate_split_ratio)
+    with metrics.timer(stage='convert', table='fund_splits'):
+        return convert_fund_split_df_for_save(fund_id, fund_split_df)
 
 
 # 待验证
-def save_all_fund_split_data(funds_db_file_path: str):
-    conn = sqlite3.connect(funds_db_file_path)
-    cursor = conn.cursor()
+def save_all_fund_split_data(funds_db_file_path: str, incremental: bool = False, resume: bool = False):
+    # 保存基金历史全部拆分到数据库
+    sync_all_fund_history_data(funds_db_file_path, ['fund_splits'], incremental, resume, concurrency=1)
 
-    # 提取拆分比例并计算比值
-    def calculate_ratio(ratio_str):
-        left, right = map(float, ratio_str.split(':'))
-        return right / left
-
-    fund_ids = get_all_fund_id_asc_from_db(funds_db_file_path)
-    for fund_id in fund_ids:
-        print(fund_id)
-        fund_dividend_data = get_fund_all_split_data_for_save(fund_id)
-        
-        # 保存基金历史全部拆分到数据库
-        cursor.executemany('''
-            INSERT INTO fund_splits (fund_id, split_date, split_type, split_ratio)
-            VALUES (?, ?, ?, ?)
-        ''', fund_dividend_data)
-        conn.commit()
 
-    cursor.close()
-    conn.close()
+def convert_fund_dividend_df_for_save(fund_id: str, fund_open_fund_info_em_df):
+    """把分红送配详情DataFrame转换为待插入的数据，'每份派现金0.0500元'提取为0.05，提取不到时为None
+
+    Returns:
+        list: [(基金代码, 除息日, 每份分红), ...]
+    """
+    if fund_open_fund_info_em_df is None or fund_open_fund_info_em_df.empty:
+        return []
+    dividend_per_share = fund_open_fund_info_em_df['每份分红'].astype(str).str.extract(r'(\d+\.\d+)', expand=False).astype(float)
+    dividend_per_share = dividend_per_share.astype(object).where(dividend_per_share.notna(), None)
+    return list(zip(repeat(fund_id),
+                    fund_open_fund_info_em_df['除息日'].tolist(),
+                    dividend_per_share.tolist()))
 
 
 def get_fund_all_dividend_data_for_save(fund_id: str):
-    fund_dividend_data = []
-    fund_open_fund_info_em_df = ak.fund_open_fund_info_em(symbol=fund_id, indicator="分红送配详情")
-    # print(fund_open_fund_info_em_df)
-    if fund_open_fund_info_em_df is not None:
-        fund_open_fund_info_em_df['每份分红'] = fund_open_fund_info_em_df['每份分红'].apply(lambda x: float(re.search(r'\d+\.\d+', x).group()) if re.search(r'\d+\.\d+', x) else None)
-        fund_dividend_data = [(fund_id, row['除息日'], row['每份分红']) for index, row in fund_open_fund_info_em_df.iterrows()]
-    return fund_dividend_data
+    fund_dividend_df, _ = fetch_fund_fhsp_tables(fund_id)
+    with metrics.timer(stage='convert', table='fund_dividends'):
+        return convert_fund_dividend_df_for_save(fund_id, fund_dividend_df)
 
 
-# 待验证
-def save_all_fund_dividend_data(funds_db_file_path: str):
-    conn = sqlite3.connect(funds_db_file_path)
-    cursor = conn.cursor()
+def get_fund_all_dividend_and_split_data_for_save(fund_id: str):
+    """只获取一次分红送配页，同时得到分红和拆分的待插入数据
 
-    fund_ids = get_all_fund_id_asc_from_db(funds_db_file_path)
-    for fund_id in fund_ids:
-        print(fund_id)
-        fund_dividend_data = get_fund_all_dividend_data_for_save(fund_id)
-        
-        # 保存基金历史全部分红到数据库
-        cursor.executemany('''
-            INSERT INTO fund_dividends (fund_id, ex_dividend_date, dividend_per_share)
-            VALUES (?, ?, ?)
-        ''', fund_dividend_data)
-        conn.commit()
+    Returns:
+        dict: {'fund_dividends': 分红待插入数据, 'fund_splits': 拆分待插入数据}
+    """
+    fund_dividend_df, fund_split_df = fetch_fund_fhsp_tables(fund_id)
+    with metrics.timer(stage='convert', table='fund_dividends'):
+        dividend_data = convert_fund_dividend_df_for_save(fund_id, fund_dividend_df)
+    with metrics.timer(stage='convert', table='fund_splits'):
+        split_data = convert_fund_split_df_for_save(fund_id, fund_split_df)
+    return {'fund_dividends': dividend_data, 'fund_splits': split_data}
 
-    cursor.close()
-    conn.close()
+
+# 待验证
+def save_all_fund_dividend_data(funds_db_file_path: str, incremental: bool = False, resume: bool = False):
+    # 保存基金历史全部分红到数据库
+    sync_all_fund_history_data(funds_db_file_path, ['fund_dividends'], incremental, resume, concurrency=1)
 
 
 def get_fund_all_cumulative_nav_data(fund_id: str):
     # 获取基金的每日累计净值
-    fund_cumulative_nav_data = []
-    fund_open_fund_info_em_df = ak.fund_open_fund_info_em(symbol=fund_id, indicator="累计净值走势")
-    if fund_open_fund_info_em_df is not None:
-        fund_cumulative_nav_data = [(fund_id, row['净值日期'].isoformat(), row['累计净值']) for index, row in fund_open_fund_info_em_df.iterrows()]
-    return fund_cumulative_nav_data
+    fund_open_fund_info_em_df = fetch_fund_info_em('fund.eastmoney.com', fund_id, "累计净值走势")
+    with metrics.timer(stage='convert', table='fund_cumulative_nav'):
+        return convert_fund_nav_df_for_save(fund_id, fund_open_fund_info_em_df, '累计净值')
 
 
 # 待验证
-def save_all_fund_cumulative_nav_data(funds_db_file_path: str):
-    conn = sqlite3.connect(funds_db_file_path)
-    cursor = conn.cursor()
-
-    fund_ids = get_all_fund_id_asc_from_db(funds_db_file_path)
-
-    for fund_id in fund_ids:
-        print(fund_id)
-        fund_cumulative_nav_data = get_fund_all_cumulative_nav_data(fund_id)
+def save_all_fund_cumulative_nav_data(funds_db_file_path: str, incremental: bool = False, resume: bool = False):
+    # 保存基金历史全部每日累计净值到数据库
+    sync_all_fund_history_data(funds_db_file_path, ['fund_cumulative_nav'], incremental, resume, concurrency=1)
+
+
+# 历史数据表名 -> (日期列名, 插入语句, 获取单个基金待插入数据的函数)，插入数据每行第2个元素为日期
+history_data_sources = {
+    'fund_nav': ('value_date', '''
+        INSERT OR REPLACE INTO fund_nav (fund_id, value_date, nav)
+        VALUES (?, ?, ?)
+    ''', get_fund_all_nav_data),
+    'fund_cumulative_nav': ('value_date', '''
+        INSERT OR REPLACE INTO fund_cumulative_nav (fund_id, value_date, cumulative_nav)
+        VALUES (?, ?, ?)
+    ''', get_fund_all_cumulative_nav_data),
+    'fund_dividends': ('ex_dividend_date', '''
+        INSERT OR REPLACE INTO fund_dividends (fund_id, ex_dividend_date, dividend_per_share)
+        VALUES (?, ?, ?)
+    ''', get_fund_all_dividend_data_for_save),
+    'fund_splits': ('split_date', '''
+        INSERT OR REPLACE INTO fund_splits (fund_id, split_date, split_type, split_ratio)
+        VALUES (?, ?, ?, ?)
+    ''', get_fund_all_split_data_for_save),
+}
+
+# 来自同一网页的多张历史数据表 -> 只获取一次网页得到这些表待插入数据的函数，返回{表名: 待插入数据}
+# 同步时同一基金需要其中全部表时合并为一个获取任务
+shared_history_data_sources = {
+    ('fund_dividends', 'fund_splits'): get_fund_all_dividend_and_split_data_for_save,
+}
+
+
+def _group_shared_history_tables(table_names):
+    # 把table_names中同一网页的表合并为一组，其余的表各为一组，按首次出现的顺序排列
+    groups = []
+    for table_name in table_names:
+        if any(table_name in group for group in groups):
+            continue
+        shared_tables = next((tables for tables in shared_history_data_sources
+                              if table_name in tables and all(t in table_names for t in tables)), None)
+        groups.append(shared_tables or (table_name,))
+    return groups
+
+
+def _put_unless_stopped(data_queue: queue.Queue, item, stop_event: threading.Event):
+    # 队列满时等待写入线程取出，任务中断后放弃放入，避免写入线程结束后获取线程永远阻塞在put上
+    while not stop_event.is_set():
+        try:
+            data_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _history_data_writer(funds_db_file_path: str, table_names, incremental: bool, defer_indexes: bool, commit_batch_size: int,
+                         data_queue: queue.Queue, writer_errors: list, stop_event: threading.Event, fund_ids=None):
+    # 唯一的写入线程，从队列取出(表名, 基金代码, 数据, 获取时的异常)写入数据库，取到None时结束
+    # 数据和爬取进度在同一个事务中提交，中断后进度与已写入的数据一致
+    # 队列为空时先提交再等待，等待网络获取（如限制器熔断）期间不持有写锁，其他worker和续约不会被阻塞
+    # 出错（包括连接、查询最新日期时数据库被锁）时设置stop_event，获取线程不再放入数据，主线程不再提交任务
+    from nav_archive import archive_table_name, archived_nav_tables, has_archive_table
+
+    conn = None
+    deferred_indexes = []
+    try:
+        conn = connect_db(funds_db_file_path, bulk_load=True)
+        cursor = conn.cursor()
+
+        latest_dates = {
+            table_name: get_all_fund_latest_date_from_db(cursor, table_name, history_data_sources[table_name][0], fund_ids)
+            if incremental else {}
+            for table_name in table_names
+        }
+        # 全量写入时同时删除归档表中该基金的净值，避免与新写入的重复；还没有归档过时不需要删除
+        archive_tables = {
+            table_name: archive_table_name(table_name)
+            for table_name in table_names if table_name in archived_nav_tables and has_archive_table(cursor, table_name)
+        }
+
+        # 全量导入所有基金时先删除相关表的二级索引，避免每次插入都维护索引
+        for index_name, index_sql in history_table_indexes.items():
+            if defer_indexes and any(f' ON {table_name} ' in index_sql for table_name in table_names):
+                cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+                deferred_indexes.append((index_name, index_sql))
+
+        uncommitted_funds = 0
+        while True:
+            try:
+                item = data_queue.get_nowait()
+            except queue.Empty:
+                if uncommitted_funds:
+                    with metrics.timer(stage='db_write', table='commit'):
+                        conn.commit()
+                    uncommitted_funds = 0
+                item = data_queue.get()
+            if item is None:
+                break
+            table_name, fund_id, fund_data, error = item
+
+            if error is not None:
+                print(f"{fund_id} {table_name} 获取失败: {error}")
+                save_crawl_job_status(cursor, table_name, [fund_id], 'failed', str(error))
+                metrics.inc('funds_processed_total', indicator=table_name, status='failed')
+            else:
+                print(fund_id, table_name)
+                if incremental:
+                    latest_date = latest_dates[table_name].get(fund_id)
+                    if latest_date is not None:
+                        fund_data = [row for row in fund_data if row[1] > latest_date]
+
+                with metrics.timer(stage='db_write', table=table_name):
+                    if not incremental:
+                        cursor.execute(f'DELETE FROM {table_name} WHERE fund_id = ?', (fund_id,))
+                        if table_name in archive_tables:
+                            cursor.execute(f'DELETE FROM {archive_tables[table_name]} WHERE fund_id = ?', (fund_id,))
+                    if fund_data:
+                        cursor.executemany(history_data_sources[table_name][1], fund_data)
+                    save_crawl_job_status(cursor, table_name, [fund_id], 'done')
+                metrics.inc('rows_written_total', len(fund_data), table=table_name)
+                metrics.inc('funds_processed_total', indicator=table_name, status='done')
+
+            uncommitted_funds += 1
+            if uncommitted_funds >= commit_batch_size:
+                with metrics.timer(stage='db_write', table='commit'):
+                    conn.commit()
+                uncommitted_funds = 0
+                metrics.export_metrics(min_interval_seconds=30)
+        with metrics.timer(stage='db_write', table='commit'):
+            conn.commit()
+    except Exception as e:
+        writer_errors.append(e)
+        stop_event.set()
+    finally:
+        if conn is not None:
+            try:
+                conn.rollback()
+                for _, index_sql in deferred_indexes:
+                    conn.execute(index_sql)
+                conn.commit()
+            except Exception as e:
+                writer_errors.append(e)
+                stop_event.set()
+            conn.close()
+
+
+def sync_all_fund_history_data(funds_db_file_path: str, table_names=None, incremental: bool = False, resume: bool = False,
+                               concurrency: int = 8, queue_size: int = 64, commit_batch_size: int = 200, fund_ids=None):
+    """一次遍历funds表里所有基金，并发获取每个基金的各项历史数据，经有界队列交给单独的写入线程存入数据库。
+    获取网络数据和写数据库同时进行。
 
-        # 保存基金历史全部每日单位净值到数据库
-        cursor.executemany('''
-            INSERT INTO fund_cumulative_nav (fund_id, value_date, cumulative_nav)
-            VALUES (?, ?, ?)
-        ''', fund_cumulative_nav_data)
-        conn.commit()
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        table_names (list, optional): 要更新的表，为None时更新history_data_sources里的全部表. Defaults to None.
+        incremental (bool, optional): 为True时只写入比库中最新日期更新的数据；
+            为False时先删除该基金的已有数据再全部写入，并在全部写完后再重建二级索引. Defaults to False.
+        resume (bool, optional): 继续上次中断的任务，跳过crawl_jobs表中已完成的(基金, 表)，只重试失败和未处理的. Defaults to False.
+        concurrency (int, optional): 同时获取数据的线程数. Defaults to 8.
+        queue_size (int, optional): 等待写入的数据最多条数，写入跟不上时获取线程会等待. Defaults to 64.
+        commit_batch_size (int, optional): 每写入多少个(基金, 表)提交一次. Defaults to 200.
+        fund_ids (list, optional): 只处理这些基金，为None时处理funds表里所有基金；
+            指定时不删除和重建二级索引，可以与其他进程同时写入. Defaults to None.
+
+    中断（如Ctrl-C）时不再提交新的获取任务，正在获取的数据不再写入，写入线程提交已取出的数据后结束，
+    之后可以用resume=True继续。
+
+    Raises:
+        Exception: 写入数据库出错
 
-    # conn.commit()
+    Returns:
+        dict: 获取失败的{(基金代码, 表名): 异常}
+    """
+    if table_names is None:
+        table_names = list(history_data_sources)
+    defer_indexes = not incremental and fund_ids is None
+    # 只处理部分基金（如work_queue的一批）时，进度和最新日期只查询这些基金，不扫描全表
+    scoped_fund_ids = fund_ids
+    if fund_ids is None:
+        fund_ids = get_all_fund_id_asc_from_db(funds_db_file_path)
+
+    conn = connect_db(funds_db_file_path)
+    cursor = conn.cursor()
+    done_fund_ids = {table_name: start_crawl_jobs(cursor, table_name, resume, scoped_fund_ids) for table_name in table_names}
+    conn.commit()
     cursor.close()
-    conn.close()
\ No newline at end of file
+    conn.close()
+
+    data_queue = queue.Queue(maxsize=queue_size)
+    writer_errors = []
+    stop_event = threading.Event()
+    writer = threading.Thread(target=_history_data_writer,
+                              args=(funds_db_file_path, table_names, incremental, defer_indexes, commit_batch_size,
+                                    data_queue, writer_errors, stop_event, scoped_fund_ids))
+    writer.start()
+
+    failed_funds = {}
+
+    def fetch_fund_history_data(fund_id, group):
+        # group为一次获取得到的表名，同一网页的表（如分红和拆分）只获取一次网页
+        try:
+            if len(group) == 1:
+                fund_data = {group[0]: history_data_sources[group[0]][2](fund_id)}
+            else:
+                fund_data = shared_history_data_sources[group](fund_id)
+        except Exception as e:
+            for table_name in group:
+                if not _put_unless_stopped(data_queue, (table_name, fund_id, None, e), stop_event):
+                    return
+                failed_funds[(fund_id, table_name)] = e
+            return
+        for table_name in group:
+            if not _put_unless_stopped(data_queue, (table_name, fund_id, fund_data[table_name], None), stop_event):
+                return
+
+    # 同一基金的各项数据相邻提交，会被同时获取
+    tasks = ((fund_id, group) for fund_id in fund_ids
+             for group in _group_shared_history_tables([table_name for table_name in table_names
+                                                        if fund_id not in done_fund_ids[table_name]]))
+    # 限制已提交未完成的任务数，中断时只需等待正在获取的任务
+    max_in_flight = concurrency * 2
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        pending = set()
+        for fund_id, group in tasks:
+            # 写入线程出错后不再提交任务
+            if stop_event.is_set():
+                break
+            if len(pending) >= max_in_flight:
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            pending.add(executor.submit(fetch_fund_history_data, fund_id, group))
+        wait(pending)
+    except BaseException:
+        stop_event.set()
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        # 写入线程已经结束时队列可能是满的，不能无限等待放入结束标记
+        while writer.is_alive():
+            try:
+                data_queue.put(None, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+        writer.join()
+        metrics.export_metrics()
+
+    if writer_errors:
+        raise writer_errors[0]
+    return failed_funds
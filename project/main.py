@@ -1,13 +1,13 @@
 import sqlite3
-import akshare as ak
 import pathlib
 import os
-import pandas as pd
 import random
 import time
 from crawler import get_fund_basic_info
 import re
 
+# 下面注释中的示例需要 import akshare as ak，akshare导入很慢，日常使用请运行 python cli.py
+
 """
 思路
 1. 获得所有开放式基金代码
@@ -0,0 +1,222 @@
+import bisect
+import json
+import math
+import os
+import pathlib
+import threading
+import time
+from contextlib import contextmanager
+
+default_metrics_dir = pathlib.Path(__file__).parent.parent / "data" / "metrics"
+
+# 耗时直方图的桶上界（秒）
+default_latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 指标说明，导出Prometheus格式时作为HELP
+metric_descriptions = {
+    'stage_seconds': '各阶段耗时，stage为fetch、parse、convert、db_write',
+    'http_request_seconds': '每个接口的请求耗时，不含缓存命中',
+    'http_requests_total': '每个接口的请求数，按状态码',
+    'http_response_bytes_total': '每个接口收到的字节数',
+    'http_cache_hits_total': '每个接口的磁盘缓存命中数',
+    'rows_written_total': '写入数据库的行数',
+    'funds_processed_total': '处理完的基金数，status为done或failed',
+    'crawl_retries_total': '继续任务时重试之前失败的基金数',
+    'failures_total': '各阶段失败次数',
+    'api_requests_total': 'HTTP服务每个接口的请求数，按状态码',
+    'api_request_seconds': 'HTTP服务每个接口的响应耗时',
+    'api_cache_hits_total': 'HTTP服务每个接口的缓存命中数',
+    'api_cache_invalidations_total': '数据库有新提交导致HTTP服务缓存清空的次数',
+}
+
+
+class Histogram:
+    """固定桶的直方图，同时记录总数、总和和最大值"""
+
+    def __init__(self, buckets=default_latency_buckets):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # 最后一个为+Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float):
+        """按桶内线性插值估计分位数，没有数据时返回None"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.bucket_counts):
+            if cumulative + bucket_count >= rank and bucket_count > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.max
+
+
+class MetricsRegistry:
+    """线程安全的计数器和直方图集合，每个指标可以带标签"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started_at = time.time()
+        self._last_export = 0.0
+        # 导出的文件名（不含扩展名），同一目录下有多个进程导出时各自使用不同的文件名
+        self.export_name = 'metrics'
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器增加value"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """直方图记录一个值"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str = 'stage_seconds', **labels):
+        """记录一段代码的耗时，出错时同样记录，并增加failures_total"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('failures_total', **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started_at = time.time()
+
+    def summary(self):
+        """汇总为可以序列化为JSON的dict
+
+        Returns:
+            dict: {'started_at', 'elapsed_seconds', 'counters': [...], 'histograms': [...]}
+        """
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            histograms = [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'mean': histogram.sum / histogram.count if histogram.count else None,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                    'p99': histogram.quantile(0.99),
+                    'max': histogram.max,
+                }
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ]
+        return {
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            'elapsed_seconds': time.time() - self.started_at,
+            'counters': counters,
+            'histograms': histograms,
+        }
+
+    def to_prometheus(self, prefix: str = 'rika'):
+        """转换为Prometheus文本格式"""
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+            return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+        def format_value(value):
+            return '+Inf' if value == math.inf else repr(float(value))
+
+        lines = []
+        with self._lock:
+            counter_names = sorted({name for name, _ in self.counters})
+            for name in counter_names:
+                lines.append(f'# HELP {prefix}_{name} {metric_descriptions.get(name, name)}')
+                lines.append(f'# TYPE {prefix}_{name} counter')
+                for (metric_name, labels), value in sorted(self.counters.items()):
+                    if metric_name == name:
+                        lines.append(f'{prefix}_{name}{format_labels(labels)} {format_value(value)}')
+
+            histogram_names = sorted({name for name, _ in self.histograms})
+            for name in histogram_names:
+                lines.append(f'# HELP {prefix}_{name} {metric_descriptions.get(name, name)}')
+                lines.append(f'# TYPE {prefix}_{name} histogram')
+                for (metric_name, labels), histogram in sorted(self.histograms.items()):
+                    if metric_name != name:
+                        continue
+                    cumulative = 0
+                    for upper, bucket_count in zip(histogram.buckets + (math.inf,), histogram.bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(f'{prefix}_{name}_bucket{format_labels(labels, [("le", format_value(upper))])} {cumulative}')
+                    lines.append(f'{prefix}_{name}_sum{format_labels(labels)} {format_value(histogram.sum)}')
+                    lines.append(f'{prefix}_{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, metrics_dir=None, min_interval_seconds: float = 0):
+        """把指标写入metrics_dir下的{export_name}.json和{export_name}.prom，可供node_exporter的textfile collector读取
+
+        Args:
+            metrics_dir (str, optional): 导出目录，为None时使用default_metrics_dir. Defaults to None.
+            min_interval_seconds (float, optional): 距上次导出不足该秒数时跳过，用于在循环中定期导出. Defaults to 0.
+
+        Returns:
+            bool: 是否导出
+        """
+        now = time.monotonic()
+        if now - self._last_export < min_interval_seconds:
+            return False
+        self._last_export = now
+
+        metrics_dir = pathlib.Path(default_metrics_dir if metrics_dir is None else metrics_dir)
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        for file_name, content in (
+            (f'{self.export_name}.json', json.dumps(self.summary(), ensure_ascii=False, indent=2)),
+            (f'{self.export_name}.prom', self.to_prometheus()),
+        ):
+            # 先写临时文件再替换，读取方不会读到写了一半的文件
+            tmp_path = metrics_dir / f'{file_name}.{os.getpid()}.tmp'
+            tmp_path.write_text(content, encoding='utf-8')
+            os.replace(tmp_path, metrics_dir / file_name)
+        return True
+
+
+default_registry = MetricsRegistry()
+
+
+def inc(name: str, value: float = 1, **labels):
+    default_registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    default_registry.observe(name, value, **labels)
+
+
+def timer(name: str = 'stage_seconds', **labels):
+    return default_registry.timer(name, **labels)
+
+
+def export_metrics(metrics_dir=None, min_interval_seconds: float = 0):
+    return default_registry.export(metrics_dir, min_interval_seconds)
@@ -0,0 +1,366 @@
+import datetime
+import heapq
+import pathlib
+import sqlite3
+import zlib
+import numpy as np
+
+# 可以归档的净值表 -> 净值列名
+archived_nav_tables = {
+    'fund_nav': 'nav',
+    'fund_cumulative_nav': 'cumulative_nav',
+}
+
+# 归档表，每行为一个基金一年的净值，日期和净值分别差分编码后压缩
+nav_archive_schema = '''
+    CREATE TABLE IF NOT EXISTS {table_name}_archive (
+        fund_id VARCHAR(20),                -- 基金代码
+        year INTEGER,                       -- 年份
+        row_count INTEGER,                  -- 净值条数
+        first_date DATE,                    -- 第一个净值日期
+        last_date DATE,                     -- 最后一个净值日期
+        scale INTEGER,                      -- 净值乘以scale后取整保存
+        dates BLOB,                         -- zlib压缩的日期差分，int32小端，第一个为1970-01-01起的天数
+        nav_values BLOB,                    -- zlib压缩的整数净值差分，int64小端，NULL保存为null_scaled_value
+        PRIMARY KEY (fund_id, year)
+    )
+'''
+
+default_archive_scale = 10000
+
+null_scaled_value = np.iinfo(np.int64).min
+
+
+def archive_table_name(table_name: str):
+    return f'{table_name}_archive'
+
+
+def has_archive_table(cursor, table_name: str):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (archive_table_name(table_name),))
+    return cursor.fetchone() is not None
+
+
+def encode_nav_block(day_numbers, values, scale: int = default_archive_scale):
+    """把一段按日期升序的净值编码为两个压缩BLOB
+
+    Args:
+        day_numbers (np.ndarray): 1970-01-01起的天数
+        values (np.ndarray): 净值，NULL为NaN
+        scale (int, optional): 净值乘以scale后取整. Defaults to default_archive_scale.
+
+    Returns:
+        tuple: (dates, nav_values)，有净值乘以scale后不是整数（会丢失精度）时返回None
+    """
+    scaled = np.round(values * scale)
+    missing = np.isnan(values)
+    if not np.all(missing | (scaled / scale == values)):
+        return None
+    integers = np.where(missing, null_scaled_value, np.nan_to_num(scaled)).astype(np.int64)
+    # 差分在int64上按模运算，解码时累加可以精确还原，包括NULL的标记值
+    with np.errstate(over='ignore'):
+        date_deltas = np.diff(day_numbers.astype(np.int64), prepend=0).astype('<i4')
+        value_deltas = np.diff(integers, prepend=np.int64(0)).astype('<i8')
+    return zlib.compress(date_deltas.tobytes()), zlib.compress(value_deltas.tobytes())
+
+
+def decode_nav_block(dates_blob: bytes, values_blob: bytes, scale: int):
+    """encode_nav_block的逆运算
+
+    Returns:
+        tuple: (day_numbers, values)，NULL为NaN
+    """
+    day_numbers = np.cumsum(np.frombuffer(zlib.decompress(dates_blob), dtype='<i4').astype(np.int64))
+    with np.errstate(over='ignore'):
+        integers = np.cumsum(np.frombuffer(zlib.decompress(values_blob), dtype='<i8'))
+    values = integers / scale
+    values[integers == null_scaled_value] = np.nan
+    return day_numbers, values
+
+
+def iter_archived_rows(cursor, table_name: str, fund_ids=None, start_date: str = None, end_date: str = None):
+    """按(fund_id, value_date)顺序逐行生成归档表中的净值
+
+    Yields:
+        tuple: (基金代码, 日期YYYY-MM-DD, 净值)，NULL为None
+    """
+    conditions = []
+    params = []
+    if fund_ids is not None:
+        conditions.append(f"fund_id IN ({', '.join('?' * len(fund_ids))})")
+        params.extend(fund_ids)
+    if start_date is not None:
+        conditions.append('year >= ?')
+        params.append(int(start_date[:4]))
+    if end_date is not None:
+        conditions.append('year <= ?')
+        params.append(int(end_date[:4]))
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    cursor.execute(f'''
+        SELECT fund_id, scale, dates, nav_values
+        FROM {archive_table_name(table_name)}
+        {where_clause}
+        ORDER BY fund_id, year;
+    ''', params)
+    while blocks := cursor.fetchmany(200):
+        for fund_id, scale, dates_blob, values_blob in blocks:
+            day_numbers, values = decode_nav_block(dates_blob, values_blob, scale)
+            dates = day_numbers.astype('datetime64[D]').astype(str)
+            keep = np.ones(len(dates), dtype=bool)
+            if start_date is not None:
+                keep &= dates >= start_date
+            if end_date is not None:
+                keep &= dates <= end_date
+            for value_date, value in zip(dates[keep].tolist(), values[keep].tolist()):
+                yield fund_id, value_date, None if value != value else value
+
+
+def merge_nav_rows(hot_rows, archived_rows):
+    """合并两个按(fund_id, value_date)排序的行序列，同一日期两边都有时取净值表中的（较新写入的）"""
+    last_key = None
+    # 相同key时heapq.merge先输出前一个序列的元素
+    for row in heapq.merge(hot_rows, archived_rows, key=lambda row: (row[0], row[1])):
+        key = (row[0], row[1])
+        if key != last_key:
+            last_key = key
+            yield row
+
+
+def iter_nav_rows(conn, table_name: str, value_column: str, fund_ids=None, start_date: str = None,
+                  end_date: str = None, chunk_size: int = 50000):
+    """按(fund_id, value_date)顺序逐行生成净值，同时读取净值表和归档表，调用方不需要知道数据是否已归档
+
+    Args:
+        conn (sqlite3.Connection): 数据库连接
+        table_name (str): 净值表
+        value_column (str): 净值列
+        fund_ids (list, optional): 基金代码，为None时读取全部基金. Defaults to None.
+        start_date (str, optional): 起始日期YYYY-MM-DD（含）. Defaults to None.
+        end_date (str, optional): 截止日期YYYY-MM-DD（含）. Defaults to None.
+        chunk_size (int, optional): 每次从数据库读取的行数. Defaults to 50000.
+
+    Yields:
+        tuple: (基金代码, 日期YYYY-MM-DD, 净值)
+    """
+    if fund_ids is not None:
+        # 分批查询，避免超过SQLite参数个数上限；批次按基金代码排序，输出仍然有序
+        fund_ids = sorted(set(fund_ids))
+        for start in range(0, len(fund_ids), 500):
+            yield from _iter_nav_rows(conn, table_name, value_column, fund_ids[start:start + 500],
+                                      start_date, end_date, chunk_size)
+    else:
+        yield from _iter_nav_rows(conn, table_name, value_column, None, start_date, end_date, chunk_size)
+
+
+def _iter_nav_rows(conn, table_name: str, value_column: str, fund_ids, start_date: str, end_date: str, chunk_size: int):
+    conditions = []
+    params = []
+    if fund_ids is not None:
+        conditions.append(f"fund_id IN ({', '.join('?' * len(fund_ids))})")
+        params.extend(fund_ids)
+    if start_date is not None:
+        conditions.append('value_date >= ?')
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append('value_date <= ?')
+        params.append(end_date)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    def hot_rows():
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f'''
+                SELECT fund_id, value_date, {value_column}
+                FROM {table_name}
+                {where_clause}
+                ORDER BY fund_id, value_date;
+            ''', params)
+            while rows := cursor.fetchmany(chunk_size):
+                yield from rows
+        finally:
+            cursor.close()
+
+    archive_cursor = conn.cursor()
+    try:
+        if not has_archive_table(archive_cursor, table_name):
+            yield from hot_rows()
+            return
+        yield from merge_nav_rows(hot_rows(), iter_archived_rows(archive_cursor, table_name, fund_ids, start_date, end_date))
+    finally:
+        archive_cursor.close()
+
+
+def get_nav_fund_ids(cursor, table_name: str):
+    """净值表和归档表中有净值的基金代码，升序"""
+    if not has_archive_table(cursor, table_name):
+        cursor.execute(f'SELECT DISTINCT fund_id FROM {table_name} ORDER BY fund_id;')
+    else:
+        cursor.execute(f'''
+            SELECT fund_id FROM {table_name}
+            UNION
+            SELECT fund_id FROM {archive_table_name(table_name)}
+            ORDER BY fund_id;
+        ''')
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_nav_source_state(cursor, table_name: str):
+    """净值表和归档表的行数、最新日期和净值之和，用于判断导出的数据是否需要更新
+
+    净值之和与行数在同一次扫描中得到，修正已有日期的净值（行数和最新日期不变）时也会变化。
+    """
+    cursor.execute(f'SELECT COUNT(*), MAX(value_date), TOTAL({archived_nav_tables[table_name]}) FROM {table_name};')
+    row_count, max_date, value_sum = cursor.fetchone()
+    source_state = {'row_count': row_count, 'max_date': max_date, 'value_sum': value_sum}
+    if has_archive_table(cursor, table_name):
+        cursor.execute(f'SELECT COUNT(*), SUM(row_count), MAX(last_date) FROM {archive_table_name(table_name)};')
+        block_count, archived_row_count, archived_max_date = cursor.fetchone()
+        if block_count:
+            source_state['archived_blocks'] = block_count
+            source_state['archived_row_count'] = archived_row_count
+            source_state['archived_max_date'] = archived_max_date
+    return source_state
+
+
+def archive_nav_history(funds_db_file_path: str, table_name: str, before_year: int = None,
+                        scale: int = default_archive_scale, batch_size: int = 200):
+    """把净值表中before_year之前的净值按基金和年份移入归档表
+
+    已有同一基金同一年的归档时与之合并，净值表中的值优先。净值乘以scale后不是整数的年份不归档，留在净值表中。
+    每批基金在一个事务中写入归档并删除净值表中的对应行，读取方不会看到数据缺失或重复。
+    归档表在第一次有净值需要归档时才创建，没有归档表时读写净值表不需要合并归档。
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        table_name (str): 净值表，archived_nav_tables之一
+        before_year (int, optional): 归档该年之前的净值，为None时为去年，即保留去年和今年的净值在净值表中. Defaults to None.
+        scale (int, optional): 净值乘以scale后取整保存. Defaults to default_archive_scale.
+        batch_size (int, optional): 每个事务处理的基金数. Defaults to 200.
+
+    Raises:
+        Exception: 表不能归档
+
+    Returns:
+        dict: {'archived_rows': 移入归档的行数, 'archived_blocks': 写入的(基金, 年份)数, 'skipped_blocks': 因精度不归档的数}
+    """
+    if table_name not in archived_nav_tables:
+        raise Exception(f"Unknown nav table {table_name}, expected one of {list(archived_nav_tables)}")
+    value_column = archived_nav_tables[table_name]
+    archive_table = archive_table_name(table_name)
+    if before_year is None:
+        before_year = datetime.date.today().year - 1
+    cutoff_date = f'{before_year:04d}-01-01'
+
+    conn = sqlite3.connect(funds_db_file_path, timeout=60)
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT DISTINCT fund_id FROM {table_name} WHERE value_date < ? ORDER BY fund_id;', (cutoff_date,))
+    fund_ids = [row[0] for row in cursor.fetchall()]
+
+    stats = {'archived_rows': 0, 'archived_blocks': 0, 'skipped_blocks': 0}
+    if not fund_ids:
+        cursor.close()
+        conn.close()
+        return stats
+    cursor.execute(nav_archive_schema.format(table_name=table_name))
+    conn.commit()
+
+    try:
+        for start in range(0, len(fund_ids), batch_size):
+            batch = fund_ids[start:start + batch_size]
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f'''
+                SELECT fund_id, value_date, {value_column}
+                FROM {table_name}
+                WHERE fund_id IN ({placeholders}) AND value_date < ?
+                ORDER BY fund_id, value_date;
+            ''', [*batch, cutoff_date])
+            hot_rows = cursor.fetchall()
+            cursor.execute(f'''
+                SELECT fund_id, year, scale, dates, nav_values
+                FROM {archive_table}
+                WHERE fund_id IN ({placeholders}) AND year < ?
+            ''', [*batch, before_year])
+            existing_blocks = {(fund_id, year): block for fund_id, year, *block in cursor.fetchall()}
+
+            # 按(基金, 年份)分组，行已按基金和日期排序，同组的行连续
+            groups = {}
+            for row in hot_rows:
+                groups.setdefault((row[0], int(row[1][:4])), []).append(row)
+
+            archive_rows = []
+            archived_keys = []
+            for (fund_id, year), rows in groups.items():
+                day_numbers = np.array([row[1] for row in rows], dtype='datetime64[D]').astype(np.int64)
+                values = np.array([np.nan if row[2] is None else row[2] for row in rows], dtype=np.float64)
+                existing_block = existing_blocks.get((fund_id, year))
+                if existing_block is not None:
+                    existing_days, existing_values = decode_nav_block(existing_block[1], existing_block[2], existing_block[0])
+                    # 净值表中的值优先，其余日期保留归档中的值
+                    keep = ~np.isin(existing_days, day_numbers)
+                    day_numbers = np.concatenate([existing_days[keep], day_numbers])
+                    values = np.concatenate([existing_values[keep], values])
+                    order = np.argsort(day_numbers, kind='stable')
+                    day_numbers, values = day_numbers[order], values[order]
+
+                encoded = encode_nav_block(day_numbers, values, scale)
+                if encoded is None:
+                    stats['skipped_blocks'] += 1
+                    continue
+                first_date, last_date = np.array([day_numbers[0], day_numbers[-1]]).astype('datetime64[D]').astype(str)
+                archive_rows.append((fund_id, year, len(day_numbers), first_date, last_date, scale, *encoded))
+                archived_keys.append((fund_id, f'{year:04d}-01-01', f'{year:04d}-12-31'))
+                stats['archived_rows'] += len(rows)
+
+            cursor.executemany(f'''
+                INSERT OR REPLACE INTO {archive_table}
+                    (fund_id, year, row_count, first_date, last_date, scale, dates, nav_values)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', archive_rows)
+            cursor.executemany(f'DELETE FROM {table_name} WHERE fund_id = ? AND value_date BETWEEN ? AND ?', archived_keys)
+            conn.commit()
+            stats['archived_blocks'] += len(archive_rows)
+            print(f"{table_name} 归档 {start + len(batch)}/{len(fund_ids)}")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    return stats
+
+
+def compact_nav_tables(funds_db_file_path: str, table_names=None, before_year: int = None, vacuum: bool = True):
+    """整理净值表：去除旧版本表中的重复行，把旧年份的净值移入压缩的归档表，再VACUUM回收空间
+
+    VACUUM需要独占数据库，应在没有写入任务时运行。
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        table_names (list, optional): 要整理的表，为None时为archived_nav_tables中的全部. Defaults to None.
+        before_year (int, optional): 见archive_nav_history. Defaults to None.
+        vacuum (bool, optional): 是否VACUUM. Defaults to True.
+
+    Returns:
+        dict: {表名: archive_nav_history的统计, 'size_before': 字节数, 'size_after': 字节数}
+    """
+    # 去重由init_utils.upgrade_db_tables完成：旧版本没有主键的表重建为带主键的表
+    from init_utils import upgrade_db_tables
+
+    if table_names is None:
+        table_names = list(archived_nav_tables)
+    db_path = pathlib.Path(funds_db_file_path)
+    result = {'size_before': db_path.stat().st_size}
+
+    upgrade_db_tables(funds_db_file_path)
+    for table_name in table_names:
+        result[table_name] = archive_nav_history(funds_db_file_path, table_name, before_year)
+
+    conn = sqlite3.connect(funds_db_file_path, timeout=60)
+    conn.execute('PRAGMA optimize')
+    if vacuum:
+        conn.execute('VACUUM')
+        # WAL模式下VACUUM的结果先写入WAL，检查点后数据库文件才变小
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    result['size_after'] = db_path.stat().st_size
+    return result
@@ -0,0 +1,342 @@
+import itertools
+import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import numpy as np
+from nav_archive import archive_table_name, get_nav_source_state, has_archive_table, iter_archived_rows, iter_nav_rows, merge_nav_rows
+
+default_nav_store_dir = pathlib.Path(__file__).parent.parent / "data" / "nav_store"
+
+# 存储名 -> (表名, 净值列名)
+nav_store_sources = {
+    'nav': ('fund_nav', 'nav'),
+    'cumulative_nav': ('fund_cumulative_nav', 'cumulative_nav'),
+}
+
+
+def _truncate_npy(path: pathlib.Path, length: int):
+    # 只保留前length个元素，复制到新文件后替换
+    source = np.load(path, mmap_mode='r')
+    tmp_path = path.with_name(f'{path.stem}.truncated.npy')
+    target = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=source.dtype, shape=(length,))
+    target[:] = source[:length]
+    target.flush()
+    del source, target
+    os.replace(tmp_path, path)
+
+
+def export_nav_store(funds_db_file_path: str, kind: str = 'nav', store_dir=default_nav_store_dir,
+                     force: bool = False, chunk_size: int = 200000):
+    """把净值表导出为按基金连续存放的列式文件，供内存映射读取
+
+    目录下包含：
+        fund_ids.npy: 升序基金代码
+        offsets.npy: 第i个基金的数据位于[offsets[i], offsets[i+1])
+        dates.npy: 净值日期 (datetime64[D])，每个基金内升序
+        values.npy: 净值 (float64)，无净值为NaN
+        meta.json: 导出时数据表的行数、最新日期和净值之和
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        kind (str, optional): 'nav'或'cumulative_nav'. Defaults to 'nav'.
+        store_dir (str, optional): 存储根目录. Defaults to default_nav_store_dir.
+        force (bool, optional): 数据表没有变化时也重新导出. Defaults to False.
+        chunk_size (int, optional): 每次从数据库读取的行数. Defaults to 200000.
+
+    Returns:
+        bool: 是否重新导出
+    """
+    table_name, value_column = nav_store_sources[kind]
+    target_dir = pathlib.Path(store_dir) / kind
+
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    # 用净值表和归档表的行数、最新日期和净值之和判断是否有变化
+    source_state = get_nav_source_state(cursor, table_name)
+
+    meta_path = target_dir / 'meta.json'
+    if not force and meta_path.exists():
+        meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        if meta.get('source_state') == source_state:
+            cursor.close()
+            conn.close()
+            return False
+
+    # 先写到临时目录，完成后替换，读取方不会读到写了一半的文件
+    tmp_dir = target_dir.with_name(f'{kind}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    # 净值表和归档表有重复日期时合并后的行数会少于两者之和，写完后再截断
+    capacity = source_state['row_count'] + source_state.get('archived_row_count', 0)
+    dates = np.lib.format.open_memmap(tmp_dir / 'dates.npy', mode='w+', dtype='datetime64[D]', shape=(capacity,))
+    values = np.lib.format.open_memmap(tmp_dir / 'values.npy', mode='w+', dtype=np.float64, shape=(capacity,))
+
+    fund_ids = []
+    offsets = []
+    position = 0
+    # 按主键顺序读取，同一基金的数据连续且日期升序
+    rows_iter = iter_nav_rows(conn, table_name, value_column, chunk_size=chunk_size)
+    while rows := list(itertools.islice(rows_iter, chunk_size)):
+        chunk_fund_ids, chunk_dates, chunk_values = zip(*rows)
+        end = position + len(rows)
+        dates[position:end] = np.array(chunk_dates, dtype='datetime64[D]')
+        values[position:end] = np.array([np.nan if value is None else value for value in chunk_values], dtype=np.float64)
+
+        # 记录每个基金第一行的位置
+        chunk_fund_ids = np.array(chunk_fund_ids)
+        starts = np.flatnonzero(np.r_[True, chunk_fund_ids[1:] != chunk_fund_ids[:-1]])
+        for start in starts:
+            if not fund_ids or fund_ids[-1] != chunk_fund_ids[start]:
+                fund_ids.append(chunk_fund_ids[start])
+                offsets.append(position + start)
+        position = end
+    offsets.append(position)
+
+    cursor.close()
+    conn.close()
+
+    dates.flush()
+    values.flush()
+    del dates, values
+    if position < capacity:
+        for file_name in ('dates.npy', 'values.npy'):
+            _truncate_npy(tmp_dir / file_name, position)
+    np.save(tmp_dir / 'fund_ids.npy', np.array(fund_ids, dtype=str))
+    np.save(tmp_dir / 'offsets.npy', np.array(offsets, dtype=np.int64))
+    (tmp_dir / 'meta.json').write_text(json.dumps({
+        'table_name': table_name,
+        'source_state': source_state,
+    }, ensure_ascii=False), encoding='utf-8')
+
+    old_dir = target_dir.with_name(f'{kind}.old')
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if target_dir.exists():
+        os.replace(target_dir, old_dir)
+    os.replace(tmp_dir, target_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return True
+
+
+def sync_nav_stores(funds_db_file_path: str, store_dir=default_nav_store_dir):
+    """净值表有变化时重新导出单位净值和累计净值存储"""
+    for kind in nav_store_sources:
+        if export_nav_store(funds_db_file_path, kind, store_dir):
+            print(f"{kind} 已导出")
+
+
+def _fill_as_of(fund_dates, fund_values, query_dates, values_row, dates_row):
+    # 每个查询日期取当日或之前最近一个有净值的日期，结果写入values_row和dates_row
+    valid = ~np.isnan(fund_values)
+    if not valid.all():
+        fund_dates, fund_values = fund_dates[valid], fund_values[valid]
+    positions = np.searchsorted(fund_dates, query_dates, side='right') - 1
+    found = positions >= 0
+    values_row[found] = fund_values[positions[found]]
+    dates_row[found] = fund_dates[positions[found]]
+
+
+def _empty_as_of_result(n_funds: int, query_dates):
+    values = np.full((n_funds, len(query_dates)), np.nan)
+    value_dates = np.full((n_funds, len(query_dates)), np.datetime64('NaT'), dtype='datetime64[D]')
+    return values, value_dates
+
+
+def _apply_max_staleness(values, value_dates, query_dates, max_staleness_days):
+    # 最近的净值距查询日期超过max_staleness_days天时视为没有净值
+    if max_staleness_days is not None:
+        stale = (query_dates - value_dates) > np.timedelta64(max_staleness_days, 'D')
+        values[stale] = np.nan
+        value_dates[stale] = np.datetime64('NaT')
+    return values, value_dates
+
+
+class NavStore:
+    """内存映射方式读取export_nav_store导出的净值，按基金和日期范围返回的数组是文件的视图，不复制数据"""
+
+    def __init__(self, kind: str = 'nav', store_dir=default_nav_store_dir):
+        """
+        Args:
+            kind (str, optional): 'nav'或'cumulative_nav'. Defaults to 'nav'.
+            store_dir (str, optional): 存储根目录. Defaults to default_nav_store_dir.
+        """
+        directory = pathlib.Path(store_dir) / kind
+        self.fund_ids = np.load(directory / 'fund_ids.npy')
+        self.offsets = np.load(directory / 'offsets.npy')
+        self.dates = np.load(directory / 'dates.npy', mmap_mode='r')
+        self.values = np.load(directory / 'values.npy', mmap_mode='r')
+        self._fund_index = {fund_id: i for i, fund_id in enumerate(self.fund_ids.tolist())}
+
+    def __contains__(self, fund_id: str):
+        return fund_id in self._fund_index
+
+    def _fund_range(self, fund_id: str, start_date=None, end_date=None):
+        i = self._fund_index[fund_id]
+        begin, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        fund_dates = self.dates[begin:end]
+        if start_date is not None:
+            begin += int(np.searchsorted(fund_dates, np.datetime64(start_date, 'D'), side='left'))
+        if end_date is not None:
+            end = int(self.offsets[i]) + int(np.searchsorted(fund_dates, np.datetime64(end_date, 'D'), side='right'))
+        return begin, max(begin, end)
+
+    def get(self, fund_id: str, start_date=None, end_date=None):
+        """读取单个基金一段日期的净值
+
+        Args:
+            fund_id (str): 基金代码
+            start_date (str, optional): 起始日期YYYY-MM-DD（含）. Defaults to None.
+            end_date (str, optional): 截止日期YYYY-MM-DD（含）. Defaults to None.
+
+        Raises:
+            KeyError: 没有该基金
+
+        Returns:
+            tuple: (dates, values)，均为只读的内存映射视图
+        """
+        begin, end = self._fund_range(fund_id, start_date, end_date)
+        return self.dates[begin:end], self.values[begin:end]
+
+    def get_many(self, fund_ids, start_date=None, end_date=None):
+        """读取多个基金一段日期的净值，不存在的基金跳过
+
+        Returns:
+            dict: {基金代码: (dates, values)}
+        """
+        return {
+            fund_id: self.get(fund_id, start_date, end_date)
+            for fund_id in fund_ids if fund_id in self._fund_index
+        }
+
+    def as_of(self, fund_ids, dates, max_staleness_days: int = None):
+        """批量查询多个基金在多个日期的净值，日期没有净值（节假日、暂停估值）时取之前最近一个有净值的日期
+
+        Args:
+            fund_ids (list): 基金代码
+            dates (list): 查询日期，YYYY-MM-DD或datetime64，不要求有序
+            max_staleness_days (int, optional): 最近的净值距查询日期超过该天数时为NaN，为None时不限. Defaults to None.
+
+        Returns:
+            tuple: (values, value_dates)
+                values: 净值 (np.ndarray, float64, shape=(len(fund_ids), len(dates)))，没有净值为NaN
+                value_dates: 实际使用的净值日期 (np.ndarray, datetime64[D], 同shape)，没有净值为NaT
+        """
+        query_dates = np.asarray(dates, dtype='datetime64[D]')
+        values, value_dates = _empty_as_of_result(len(fund_ids), query_dates)
+        for row, fund_id in enumerate(fund_ids):
+            if fund_id not in self._fund_index:
+                continue
+            begin, end = self._fund_range(fund_id)
+            _fill_as_of(self.dates[begin:end], self.values[begin:end], query_dates, values[row], value_dates[row])
+        return _apply_max_staleness(values, value_dates, query_dates, max_staleness_days)
+
+
+def _archived_rows_as_of(cursor, table_name: str, archive_table: str, fund_ids, min_date: str, max_date: str):
+    # 归档的净值从包含最早查询日期之前最近净值的年份读起，该批基金取最早的年份
+    cursor.execute(f'''
+        SELECT MIN(year) FROM (
+            SELECT MAX(year) AS year FROM {archive_table}
+            WHERE fund_id IN ({', '.join('?' * len(fund_ids))}) AND first_date <= ?
+            GROUP BY fund_id
+        );
+    ''', [*fund_ids, min_date])
+    start_year = cursor.fetchone()[0]
+    start_date = None if start_year is None else f'{start_year:04d}-01-01'
+    return list(iter_archived_rows(cursor, table_name, sorted(fund_ids), start_date, max_date))
+
+
+def query_nav_as_of(funds_db_file_path: str, fund_ids, dates, kind: str = 'nav', max_staleness_days: int = None):
+    """同NavStore.as_of，直接查询数据库。每个基金只读取最早查询日期之前最近的一条到最晚查询日期之间的净值
+
+    Returns:
+        tuple: (values, value_dates)，见NavStore.as_of
+    """
+    table_name, value_column = nav_store_sources[kind]
+    fund_ids = list(fund_ids)
+    query_dates = np.asarray(dates, dtype='datetime64[D]')
+    values, value_dates = _empty_as_of_result(len(fund_ids), query_dates)
+    if len(fund_ids) == 0 or len(query_dates) == 0:
+        return values, value_dates
+    min_date, max_date = str(query_dates.min()), str(query_dates.max())
+
+    fund_rows = {}
+    for fund_id_row, fund_id in enumerate(fund_ids):
+        fund_rows.setdefault(fund_id, []).append(fund_id_row)
+    unique_fund_ids = list(fund_rows)
+
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    archive_table = archive_table_name(table_name) if has_archive_table(cursor, table_name) else None
+    # 分批查询，避免超过SQLite参数个数上限。先按主键找到每个基金最早查询日期当日或之前最近的净值日期，
+    # 再按主键范围读取从该日期到最晚查询日期的净值
+    for start in range(0, len(unique_fund_ids), 500):
+        batch = unique_fund_ids[start:start + 500]
+        cursor.execute(f'''
+            WITH requested(fund_id) AS (VALUES {', '.join(['(?)'] * len(batch))}),
+            starts AS (
+                SELECT fund_id, (
+                    SELECT MAX(value_date) FROM {table_name}
+                    WHERE fund_id = requested.fund_id AND value_date <= ? AND {value_column} IS NOT NULL
+                ) AS start_date
+                FROM requested
+            )
+            SELECT t.fund_id, t.value_date, t.{value_column}
+            FROM starts
+            JOIN {table_name} AS t
+                ON t.fund_id = starts.fund_id AND t.value_date >= COALESCE(starts.start_date, '') AND t.value_date <= ?
+            ORDER BY t.fund_id, t.value_date;
+        ''', [*batch, min_date, max_date])
+        rows = cursor.fetchall()
+        if archive_table is not None:
+            rows = list(merge_nav_rows(rows, _archived_rows_as_of(cursor, table_name, archive_table, batch, min_date, max_date)))
+        if not rows:
+            continue
+
+        row_fund_ids, row_dates, row_values = zip(*rows)
+        row_fund_ids = np.array(row_fund_ids)
+        row_dates = np.array(row_dates, dtype='datetime64[D]')
+        row_values = np.array([np.nan if value is None else value for value in row_values], dtype=np.float64)
+        starts = np.flatnonzero(np.r_[True, row_fund_ids[1:] != row_fund_ids[:-1]])
+        ends = np.r_[starts[1:], len(rows)]
+        for begin, end in zip(starts, ends):
+            first_row, *duplicate_rows = fund_rows[row_fund_ids[begin]]
+            _fill_as_of(row_dates[begin:end], row_values[begin:end], query_dates, values[first_row], value_dates[first_row])
+            for duplicate_row in duplicate_rows:
+                values[duplicate_row] = values[first_row]
+                value_dates[duplicate_row] = value_dates[first_row]
+    cursor.close()
+    conn.close()
+    return _apply_max_staleness(values, value_dates, query_dates, max_staleness_days)
+
+
+def get_nav_as_of(funds_db_file_path: str, fund_ids, dates, kind: str = 'nav', store_dir=default_nav_store_dir,
+                  max_staleness_days: int = None):
+    """批量查询多个基金在多个日期的净值，已导出存储时使用NavStore，否则查询数据库
+
+    导出后数据表有变化（行数、最新日期或净值之和与meta.json中的不一致）时，存储已过期，改为查询数据库，
+    需要用sync_nav_stores重新导出后才会再使用存储。
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        fund_ids (list): 基金代码
+        dates (list): 查询日期
+        kind (str, optional): 'nav'或'cumulative_nav'. Defaults to 'nav'.
+        store_dir (str, optional): 存储根目录. Defaults to default_nav_store_dir.
+        max_staleness_days (int, optional): 见NavStore.as_of. Defaults to None.
+
+    Returns:
+        tuple: (values, value_dates)，见NavStore.as_of
+    """
+    meta_path = pathlib.Path(store_dir) / kind / 'meta.json'
+    if meta_path.exists():
+        meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        conn = sqlite3.connect(funds_db_file_path)
+        cursor = conn.cursor()
+        source_state = get_nav_source_state(cursor, nav_store_sources[kind][0])
+        cursor.close()
+        conn.close()
+        if meta.get('source_state') == source_state:
+            return NavStore(kind, store_dir).as_of(fund_ids, dates, max_staleness_days)
+    return query_nav_as_of(funds_db_file_path, fund_ids, dates, kind, max_staleness_days)
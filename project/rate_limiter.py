@@ -0,0 +1,261 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 这些状态码表示请求过快被限流，eastmoney的反爬拦截返回403
+throttle_status_codes = {403, 429, 503}
+
+
+class CircuitOpenError(Exception):
+    """等待超时时该host仍处于熔断期"""
+
+
+def _is_timeout(error: Exception):
+    # 只在请求出错时才导入requests，模块本身不依赖requests，导入更快
+    import requests
+    return isinstance(error, (requests.Timeout, TimeoutError))
+
+
+def _is_transport_error(error: Exception):
+    # 连接失败和超时说明host有问题；解析出错、数据为空等其他异常与host状态无关
+    import requests
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+class HostLimiter:
+    """单个host的自适应并发限制器
+
+    请求正常时并发上限加性增长（每完成约一个上限数量的成功请求加1），
+    被限流、超时或延迟明显升高时乘性减小；连续失败达到阈值时熔断一段时间，
+    熔断到期后只放行一个探测请求，成功则恢复，失败则熔断时间加倍。
+    熔断期间和探测进行中，acquire等待而不是失败，调用方不需要自己重试。
+    只有连接错误、超时、403、429和5xx状态码计为失败。
+    延迟的基准是最近latency_window个请求中的最低延迟，偶尔一次特别快的响应不会一直压低并发上限；
+    耗时随数据量变化的请求（如akshare接口）不参与延迟判断，只按限流和失败减小并发上限。
+    """
+
+    def __init__(self, host: str, initial_concurrency: float = 4, min_concurrency: float = 1,
+                 max_concurrency: float = 32, decrease_factor: float = 0.5, latency_factor: float = 3.0,
+                 latency_window: int = 50, failure_threshold: int = 5, open_seconds: float = 30,
+                 max_open_seconds: float = 600):
+        """
+        Args:
+            host (str): host名
+            initial_concurrency (float, optional): 初始并发上限. Defaults to 4.
+            min_concurrency (float, optional): 并发上限的最小值. Defaults to 1.
+            max_concurrency (float, optional): 并发上限的最大值. Defaults to 32.
+            decrease_factor (float, optional): 被限流时并发上限乘以该系数. Defaults to 0.5.
+            latency_factor (float, optional): 延迟超过最近最低延迟的该倍数时视为拥塞. Defaults to 3.0.
+            latency_window (int, optional): 最近最低延迟取最近多少个参与延迟判断的请求. Defaults to 50.
+            failure_threshold (int, optional): 连续失败多少次后熔断. Defaults to 5.
+            open_seconds (float, optional): 首次熔断时长（秒）. Defaults to 30.
+            max_open_seconds (float, optional): 熔断时长上限（秒）. Defaults to 600.
+        """
+        self.host = host
+        self.limit = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.failure_threshold = failure_threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+
+        self.in_flight = 0
+        self.latency_ewma = None
+        # 只由参与延迟判断的请求更新
+        self.comparable_latency_ewma = None
+        self.recent_latencies = deque(maxlen=latency_window)
+        self.consecutive_failures = 0
+        self.open_seconds = open_seconds
+        self.open_until = 0.0
+        self.half_open_probe = False
+        self.last_decrease = 0.0
+
+        # 统计
+        self.successes = 0
+        self.throttles = 0
+        self.failures = 0
+        self.status_counts = {}
+
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float = None):
+        """等待可用的并发名额。熔断期间等到熔断到期，探测请求进行中时等待探测结果
+
+        熔断时长不超过max_open_seconds，timeout为None时最多等待约该时长后即可发出探测请求。
+
+        Args:
+            timeout (float, optional): 最长等待时间（秒），为None时一直等待. Defaults to None.
+
+        Raises:
+            CircuitOpenError: 等待超时时仍处于熔断期或探测中
+            TimeoutError: 等待超时
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                # 熔断期间等到到期；到期后释放名额或探测结果会唤醒等待者
+                wait_seconds = None
+                if now < self.open_until:
+                    wait_seconds = self.open_until - now
+                elif self.open_until and not self.half_open_probe:
+                    # 熔断到期，只放行一个探测请求
+                    if self.in_flight == 0:
+                        self.half_open_probe = True
+                        self.in_flight += 1
+                        return
+                elif not self.open_until and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+
+                remaining = None if deadline is None else deadline - now
+                if remaining is not None and remaining <= 0:
+                    if self.open_until:
+                        raise CircuitOpenError(f"{self.host} 熔断中，等待 {timeout} 秒后仍未恢复")
+                    raise TimeoutError(f"等待 {self.host} 并发名额超时")
+                if wait_seconds is None or (remaining is not None and remaining < wait_seconds):
+                    wait_seconds = remaining
+                self._condition.wait(wait_seconds)
+
+    def release(self, latency: float, status_code: int = None, error: Exception = None, latency_congestion: bool = True):
+        """归还并发名额并根据请求结果调整并发上限
+
+        Args:
+            latency (float): 请求耗时（秒）
+            status_code (int, optional): HTTP状态码. Defaults to None.
+            error (Exception, optional): 请求抛出的异常，连接错误和超时之外的异常视为host已正常响应. Defaults to None.
+            latency_congestion (bool, optional): 是否根据该请求的延迟判断拥塞，请求耗时与数据量有关时为False. Defaults to True.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if status_code is not None:
+                self.status_counts[status_code] = self.status_counts.get(status_code, 0) + 1
+
+            throttled = status_code in throttle_status_codes or (error is not None and _is_timeout(error))
+            failed = (throttled or (error is not None and _is_transport_error(error))
+                      or (status_code is not None and status_code >= 500))
+
+            if failed:
+                self._on_failure(throttled)
+            else:
+                self._on_success(latency, latency_congestion)
+            self._condition.notify_all()
+
+    def _on_success(self, latency: float, latency_congestion: bool):
+        self.successes += 1
+        self.consecutive_failures = 0
+        if self.half_open_probe or self.open_until:
+            # 探测成功，恢复正常
+            self.half_open_probe = False
+            self.open_until = 0.0
+            self.open_seconds = self.base_open_seconds
+            self.limit = self.min_concurrency
+
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        if latency_congestion:
+            self.comparable_latency_ewma = (latency if self.comparable_latency_ewma is None
+                                            else 0.8 * self.comparable_latency_ewma + 0.2 * latency)
+            self.recent_latencies.append(latency)
+            if self.comparable_latency_ewma > self.latency_factor * max(min(self.recent_latencies), 0.001):
+                # 延迟明显高于最近的最低延迟，视为拥塞
+                self._decrease()
+                return
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def _on_failure(self, throttled: bool):
+        if throttled:
+            self.throttles += 1
+        else:
+            self.failures += 1
+        self.consecutive_failures += 1
+        self._decrease()
+
+        if self.half_open_probe:
+            # 探测失败，熔断时间加倍
+            self.half_open_probe = False
+            self.open_seconds = min(self.max_open_seconds, self.open_seconds * 2)
+            self.open_until = time.monotonic() + self.open_seconds
+        elif self.consecutive_failures >= self.failure_threshold:
+            self.open_until = time.monotonic() + self.open_seconds
+
+    def _decrease(self):
+        # 一个延迟周期内多个请求同时失败只减小一次
+        now = time.monotonic()
+        if now - self.last_decrease < (self.latency_ewma or 0):
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+
+    def stats(self):
+        """返回当前状态和统计，用于观察运行情况"""
+        with self._condition:
+            return {
+                'host': self.host,
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'latency_ewma': self.latency_ewma,
+                'successes': self.successes,
+                'throttles': self.throttles,
+                'failures': self.failures,
+                'status_counts': dict(self.status_counts),
+                'circuit_open': time.monotonic() < self.open_until,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host: str, **kwargs):
+    """获取某个host共享的限制器，不存在时用kwargs创建
+
+    Args:
+        host (str): host名
+
+    Returns:
+        HostLimiter: 限制器
+    """
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter(host, **kwargs)
+        return _limiters[host]
+
+
+@contextmanager
+def limited(host: str, latency_congestion: bool = True):
+    """在host的并发限制下执行一段请求代码，连接错误、超时和403/429/5xx的HTTPError视为失败。
+    需要报告HTTP状态码时直接使用HostLimiter.acquire/release
+
+    Args:
+        host (str): host名
+        latency_congestion (bool, optional): 见HostLimiter.release. Defaults to True.
+    """
+    limiter = get_limiter(host)
+    limiter.acquire()
+    start = time.monotonic()
+    try:
+        yield limiter
+    except Exception as e:
+        import requests
+        status_code = e.response.status_code if isinstance(e, requests.HTTPError) and e.response is not None else None
+        limiter.release(time.monotonic() - start, status_code=status_code, error=e, latency_congestion=latency_congestion)
+        raise
+    limiter.release(time.monotonic() - start, latency_congestion=latency_congestion)
+
+
+def call_limited(host: str, func, *args, **kwargs):
+    """在host的并发限制下调用func，用于akshare等不直接暴露HTTP请求的接口。
+    这类接口的耗时随返回的数据量变化很大，不根据延迟判断拥塞
+
+    Args:
+        host (str): func实际访问的host
+        func (callable): 要调用的函数
+
+    Returns:
+        func的返回值
+    """
+    with limited(host, latency_congestion=False):
+        return func(*args, **kwargs)
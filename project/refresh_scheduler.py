@@ -0,0 +1,172 @@
+import datetime
+import hashlib
+import heapq
+import sqlite3
+from crawler import crawl_basic_info
+from init_utils import get_akshare, get_all_fund_types_from_db, save_all_fund_partial_data, save_funds_basic_info
+from rate_limiter import call_limited
+
+# 开放式基金净值列表中用来判断基金是否有变化的列，净值每天都变，不参与判断
+list_hash_columns = ['基金简称', '申购状态', '赎回状态', '手续费']
+
+# 深度爬取的优先级，数值越小越优先
+PRIORITY_NEW = 0
+PRIORITY_CHANGED = 1
+PRIORITY_STALE = 2
+
+# 每个基金深度爬取需要请求详情页和费率页，货币基金只请求详情页，按上限估计
+requests_per_fund = 2
+
+
+def create_if_not_exists_crawl_state_table(funds_db_file_path: str):
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+
+    # 创建基金爬取状态表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fund_crawl_state (
+            fund_id VARCHAR(20) PRIMARY KEY,    -- 基金代码
+            list_hash TEXT,                     -- 上次深度爬取时基金列表中该基金的内容哈希
+            last_crawled_at TIMESTAMP           -- 上次深度爬取成功的时间
+        )
+    ''')
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def get_fund_list_hashes(fund_open_fund_daily_em_df):
+    """计算开放式基金净值列表中每个基金的内容哈希
+
+    Args:
+        fund_open_fund_daily_em_df (pd.DataFrame): ak.fund_open_fund_daily_em()的结果
+
+    Returns:
+        dict: {基金代码: 哈希}
+    """
+    joined = fund_open_fund_daily_em_df[list_hash_columns].astype(str).agg('\x1f'.join, axis=1)
+    return {
+        fund_id: hashlib.sha1(text.encode('utf-8')).hexdigest()
+        for fund_id, text in zip(fund_open_fund_daily_em_df['基金代码'], joined)
+    }
+
+
+def plan_deep_crawl(funds_db_file_path: str, list_hashes: dict, daily_request_budget: int, stale_days: int = 30):
+    """对比今天的基金列表和数据库，选出需要深度爬取的基金
+
+    优先级依次为：funds表中没有或没有详情页信息的新基金、列表内容与上次深度爬取时不同（或没有记录）的基金、
+    超过stale_days天未爬取的基金，同一优先级内上次爬取越早越优先。
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        list_hashes (dict): get_fund_list_hashes的结果
+        daily_request_budget (int): 今天最多发出的请求数
+        stale_days (int, optional): 超过多少天未爬取视为过期. Defaults to 30.
+
+    Returns:
+        list: [(基金代码, 优先级), ...]，按优先级排列，总请求数不超过daily_request_budget
+    """
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    # 新基金以funds表为准：不在funds表中，或只有基金列表信息、从未写入详情页信息（fund_type为空）
+    cursor.execute('SELECT fund_id FROM funds WHERE fund_type IS NOT NULL;')
+    detailed_fund_ids = {row[0] for row in cursor.fetchall()}
+    # 爬取状态表只用于判断列表内容是否有变化和是否过期
+    cursor.execute('SELECT fund_id, list_hash, last_crawled_at FROM fund_crawl_state;')
+    crawl_states = {fund_id: (list_hash, last_crawled_at) for fund_id, list_hash, last_crawled_at in cursor.fetchall()}
+    cursor.close()
+    conn.close()
+
+    stale_before = (datetime.datetime.now() - datetime.timedelta(days=stale_days)).isoformat(sep=' ', timespec='seconds')
+
+    queue = []
+    for fund_id, list_hash in list_hashes.items():
+        old_hash, last_crawled_at = crawl_states.get(fund_id, (None, None))
+        if fund_id not in detailed_fund_ids:
+            priority = PRIORITY_NEW
+        elif old_hash != list_hash:
+            priority = PRIORITY_CHANGED
+        elif last_crawled_at is None or last_crawled_at < stale_before:
+            priority = PRIORITY_STALE
+        else:
+            continue
+        heapq.heappush(queue, (priority, last_crawled_at or '', fund_id))
+
+    max_funds = daily_request_budget // requests_per_fund
+    return [(fund_id, priority) for priority, _, fund_id in heapq.nsmallest(max_funds, queue)]
+
+
+def save_crawl_state(funds_db_file_path: str, fund_ids, list_hashes: dict):
+    """记录基金深度爬取成功的时间和当时的列表内容哈希"""
+    now = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT OR REPLACE INTO fund_crawl_state (fund_id, list_hash, last_crawled_at)
+        VALUES (?, ?, ?)
+    ''', [(fund_id, list_hashes.get(fund_id), now) for fund_id in fund_ids])
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def run_scheduled_refresh(funds_db_file_path: str, daily_request_budget: int = 4000, stale_days: int = 30,
+                          concurrency: int = 8, batch_size: int = 200):
+    """每日刷新：用基金列表一次性更新所有基金的申购状态和手续费，只对新增、有变化和过期的基金深度爬取详情页
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        daily_request_budget (int, optional): 深度爬取最多发出的请求数. Defaults to 4000.
+        stale_days (int, optional): 超过多少天未爬取视为过期. Defaults to 30.
+        concurrency (int, optional): 同时爬取的基金数. Defaults to 8.
+        batch_size (int, optional): 每批写入的基金数. Defaults to 200.
+
+    Returns:
+        dict: 爬取失败的基金代码及对应异常
+    """
+    create_if_not_exists_crawl_state_table(funds_db_file_path)
+
+    fund_open_fund_daily_em_df = call_limited('fund.eastmoney.com', get_akshare().fund_open_fund_daily_em)
+    list_hashes = get_fund_list_hashes(fund_open_fund_daily_em_df)
+
+    # 先和更新前的funds表对比，再写入列表信息
+    planned_funds = plan_deep_crawl(funds_db_file_path, list_hashes, daily_request_budget, stale_days)
+    save_all_fund_partial_data(funds_db_file_path, fund_open_fund_daily_em_df)
+
+    priority_counts = {}
+    for _, priority in planned_funds:
+        priority_counts[priority] = priority_counts.get(priority, 0) + 1
+    print(f"深度爬取 {len(planned_funds)} 个基金，新基金 {priority_counts.get(PRIORITY_NEW, 0)}，"
+          f"有变化 {priority_counts.get(PRIORITY_CHANGED, 0)}，过期 {priority_counts.get(PRIORITY_STALE, 0)}")
+
+    conn = sqlite3.connect(funds_db_file_path)
+    fund_types = get_all_fund_types_from_db(conn.cursor())
+    conn.close()
+
+    failed_funds = {}
+    funds_basic_info = []
+
+    def save_batch():
+        # 深度爬取的进度只记录在fund_crawl_state表，不改变crawl-info任务在crawl_jobs表中的状态
+        save_funds_basic_info(funds_db_file_path, funds_basic_info, crawl_job_indicator=None)
+        save_crawl_state(funds_db_file_path, [data['基金代码'] for data in funds_basic_info], list_hashes)
+        funds_basic_info.clear()
+
+    try:
+        for fund_id, fund_info, error in crawl_basic_info([fund_id for fund_id, _ in planned_funds], concurrency,
+                                                          fund_types=fund_types):
+            if error is not None:
+                print(f"{fund_id} 获取失败: {error}")
+                failed_funds[fund_id] = error
+                continue
+
+            print(fund_id)
+            funds_basic_info.append(fund_info)
+            if len(funds_basic_info) >= batch_size:
+                save_batch()
+    finally:
+        if funds_basic_info:
+            save_batch()
+
+    return failed_funds
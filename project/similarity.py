@@ -0,0 +1,470 @@
+import itertools
+import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import numpy as np
+from analytics import forward_fill, load_nav_matrix
+from nav_archive import get_nav_fund_ids, get_nav_source_state, iter_nav_rows
+
+default_similarity_index_dir = pathlib.Path(__file__).parent.parent / "data" / "similarity_index"
+
+# 索引中每个基金的累积统计量，文件名 -> dtype
+index_arrays = {
+    'fund_ids': str,
+    'counts': np.int64,         # 收益率个数
+    'sum1': np.float64,         # 收益率之和
+    'sum2': np.float64,         # 收益率平方和
+    'projections': np.float64,  # Σ r_t·R_t，shape=(基金数, dim)
+    'date_sums': np.float64,    # Σ R_t，shape=(基金数, dim)，用于减去均值
+    'last_days': np.int64,      # 已计入的最后一个净值日期（1970-01-01起的天数），没有时为no_day
+    'last_values': np.float64,  # 已计入的最后一个累计净值，计算下一个收益率用
+    'first_days': np.int64,     # 第一个收益率的日期，没有时为no_day
+    'months': np.int64,         # 按月统计量各列对应的月份（1970-01起的月数），所有基金共用
+    'month_counts': np.int32,   # 每月的收益率个数，shape=(基金数, 月数)
+    'month_sum1': np.float32,   # 每月的收益率之和，shape=(基金数, 月数)
+    'month_sum2': np.float32,   # 每月的收益率平方和，shape=(基金数, 月数)
+}
+
+# 按月统计的数组，基金数×月数
+month_arrays = ('month_counts', 'month_sum1', 'month_sum2')
+
+# 索引格式的版本，旧版本的索引需要重新建立
+index_version = 2
+
+no_day = np.iinfo(np.int64).min
+
+# 一批数据的基金数×日期数不超过该值时用稠密矩阵乘积累加投影
+max_dense_cells = 4_000_000
+
+
+def get_date_vectors(day_numbers, dim: int, seed: int, cache: dict = None):
+    """每个日期对应的随机投影向量R_t，由(seed, 日期)决定，增量更新时同一日期得到同一向量
+
+    Args:
+        day_numbers (np.ndarray): 1970-01-01起的天数
+        dim (int): 投影维数
+        seed (int): 随机种子
+        cache (dict, optional): {天数: 向量}，在多次调用间复用. Defaults to None.
+
+    Returns:
+        np.ndarray: shape=(len(day_numbers), dim)，元素服从N(0, 1/dim)
+    """
+    if cache is None:
+        cache = {}
+    vectors = np.empty((len(day_numbers), dim))
+    for i, day in enumerate(day_numbers.tolist()):
+        vector = cache.get(day)
+        if vector is None:
+            vector = cache[day] = np.random.default_rng([seed, day]).standard_normal(dim) / np.sqrt(dim)
+        vectors[i] = vector
+    return vectors
+
+
+def _load_index_state(index_dir: pathlib.Path):
+    meta = json.loads((index_dir / 'meta.json').read_text(encoding='utf-8'))
+    state = {name: np.load(index_dir / f'{name}.npy') for name in index_arrays}
+    return meta, state
+
+
+def _empty_index_state(dim: int):
+    return {
+        'fund_ids': np.array([], dtype=str),
+        'counts': np.zeros(0, dtype=np.int64),
+        'sum1': np.zeros(0),
+        'sum2': np.zeros(0),
+        'projections': np.zeros((0, dim)),
+        'date_sums': np.zeros((0, dim)),
+        'last_days': np.zeros(0, dtype=np.int64),
+        'last_values': np.zeros(0),
+        'first_days': np.zeros(0, dtype=np.int64),
+        'months': np.zeros(0, dtype=np.int64),
+        **{name: np.zeros((0, 0), dtype=index_arrays[name]) for name in month_arrays},
+    }
+
+
+def _add_funds(state, new_fund_ids):
+    # 加入新基金后按基金代码重新排序，新基金的统计量为0
+    fund_ids = np.concatenate([state['fund_ids'], np.array(new_fund_ids, dtype=str)])
+    n_new = len(new_fund_ids)
+    dim = state['projections'].shape[1]
+    n_months = len(state['months'])
+    extended = {
+        'fund_ids': fund_ids,
+        'counts': np.r_[state['counts'], np.zeros(n_new, dtype=np.int64)],
+        'sum1': np.r_[state['sum1'], np.zeros(n_new)],
+        'sum2': np.r_[state['sum2'], np.zeros(n_new)],
+        'projections': np.vstack([state['projections'], np.zeros((n_new, dim))]),
+        'date_sums': np.vstack([state['date_sums'], np.zeros((n_new, dim))]),
+        'last_days': np.r_[state['last_days'], np.full(n_new, no_day, dtype=np.int64)],
+        'last_values': np.r_[state['last_values'], np.full(n_new, np.nan)],
+        'first_days': np.r_[state['first_days'], np.full(n_new, no_day, dtype=np.int64)],
+        **{name: np.vstack([state[name], np.zeros((n_new, n_months), dtype=index_arrays[name])]) for name in month_arrays},
+    }
+    order = np.argsort(fund_ids, kind='stable')
+    return {'months': state['months'], **{name: array[order] for name, array in extended.items()}}
+
+
+def _extend_months(state, first_month: int, last_month: int):
+    # 按月统计的列扩展到覆盖[first_month, last_month]
+    months = state['months']
+    if len(months):
+        first_month, last_month = min(first_month, int(months[0])), max(last_month, int(months[-1]))
+    if len(months) == last_month - first_month + 1:
+        return
+    offset = int(months[0]) - first_month if len(months) else 0
+    for name in month_arrays:
+        extended = np.zeros((len(state['fund_ids']), last_month - first_month + 1), dtype=index_arrays[name])
+        extended[:, offset:offset + len(months)] = state[name]
+        state[name] = extended
+    state['months'] = np.arange(first_month, last_month + 1, dtype=np.int64)
+
+
+def _accumulate_rows(state, rows, dim: int, seed: int, vector_cache: dict):
+    """把一批按(fund_id, value_date)排序的累计净值计入统计量，已计入的日期跳过
+
+    Returns:
+        int: 新计入的收益率个数
+    """
+    row_fund_ids, row_dates, row_values = zip(*rows)
+    fund_index = np.searchsorted(state['fund_ids'], np.array(row_fund_ids, dtype=str))
+    days = np.array(row_dates, dtype='datetime64[D]').astype(np.int64)
+    values = np.array([np.nan if value is None else value for value in row_values], dtype=np.float64)
+
+    keep = (days > state['last_days'][fund_index]) & np.isfinite(values) & (values > 0)
+    fund_index, days, values = fund_index[keep], days[keep], values[keep]
+    if len(fund_index) == 0:
+        return 0
+
+    # 每个基金在这批中的第一行用上次计入的净值计算收益率
+    segment_starts = np.flatnonzero(np.r_[True, fund_index[1:] != fund_index[:-1]])
+    segment_ends = np.r_[segment_starts[1:], len(fund_index)] - 1
+    previous_values = np.r_[np.nan, values[:-1]]
+    previous_values[segment_starts] = state['last_values'][fund_index[segment_starts]]
+    returns = values / previous_values - 1
+
+    state['last_days'][fund_index[segment_ends]] = days[segment_ends]
+    state['last_values'][fund_index[segment_ends]] = values[segment_ends]
+
+    valid = np.isfinite(returns)
+    fund_index, days, returns = fund_index[valid], days[valid], returns[valid]
+    if len(fund_index) == 0:
+        return 0
+
+    unique_days, day_index = np.unique(days, return_inverse=True)
+    date_vectors = get_date_vectors(unique_days, dim, seed, vector_cache)
+
+    # 行按基金连续，按段求和后加到对应基金，每段的基金不重复
+    segment_starts = np.flatnonzero(np.r_[True, fund_index[1:] != fund_index[:-1]])
+    segment_funds = fund_index[segment_starts]
+    state['counts'][segment_funds] += np.add.reduceat(np.ones(len(returns), dtype=np.int64), segment_starts)
+    state['sum1'][segment_funds] += np.add.reduceat(returns, segment_starts)
+    state['sum2'][segment_funds] += np.add.reduceat(returns ** 2, segment_starts)
+    first_returns = state['first_days'][segment_funds] == no_day
+    state['first_days'][segment_funds[first_returns]] = days[segment_starts[first_returns]]
+
+    # 按月累加，查询时据此得到任意两个基金重叠日期内的统计量
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    _extend_months(state, int(months.min()), int(months.max()))
+    month_index = months - state['months'][0]
+    np.add.at(state['month_counts'], (fund_index, month_index), 1)
+    np.add.at(state['month_sum1'], (fund_index, month_index), returns)
+    np.add.at(state['month_sum2'], (fund_index, month_index), returns ** 2)
+
+    if len(segment_starts) * len(unique_days) <= max_dense_cells:
+        # 基金×日期的收益率矩阵乘以日期向量，比逐行按段求和快得多
+        segment_index = np.cumsum(np.r_[False, fund_index[1:] != fund_index[:-1]])
+        segment_returns = np.zeros((len(segment_starts), len(unique_days)))
+        segment_returns[segment_index, day_index] = returns
+        has_return = np.zeros_like(segment_returns)
+        has_return[segment_index, day_index] = 1
+        state['projections'][segment_funds] += segment_returns @ date_vectors
+        state['date_sums'][segment_funds] += has_return @ date_vectors
+    else:
+        row_vectors = date_vectors[day_index]
+        state['projections'][segment_funds] += np.add.reduceat(returns[:, None] * row_vectors, segment_starts)
+        state['date_sums'][segment_funds] += np.add.reduceat(row_vectors, segment_starts)
+    return len(returns)
+
+
+def update_similarity_index(funds_db_file_path: str, index_dir=default_similarity_index_dir, rebuild: bool = False,
+                            dim: int = 128, seed: int = 0, start_date: str = None, chunk_size: int = 50000):
+    """用fund_cumulative_nav的日收益率建立或增量更新基金相似度索引
+
+    每个基金保存收益率的个数、和、平方和，以及随机投影Σ r_t·R_t和ΣR_t，R_t是由日期决定的随机向量。
+    这些量都可以逐日累加，新的净值日期到来时只需计入新的收益率；由它们可以得到z-score标准化后
+    收益率序列的dim维投影，两个投影的内积近似两个基金收益率的相关系数。另外按月保存收益率的个数、和、平方和，
+    查询时把相关系数归一化到两个基金的重叠日期上。每个基金只读取它已计入的最后日期之后的净值，
+    停更或落后的基金不会让其他基金重新读取。历史净值被修改（而不只是追加）后需要rebuild。
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        index_dir (str, optional): 索引目录. Defaults to default_similarity_index_dir.
+        rebuild (bool, optional): 丢弃已有索引重新建立. Defaults to False.
+        dim (int, optional): 投影维数，仅在新建时使用，相关系数估计的误差约为1/sqrt(dim). Defaults to 128.
+        seed (int, optional): 随机种子，仅在新建时使用. Defaults to 0.
+        start_date (str, optional): 只使用该日期YYYY-MM-DD及之后的净值，仅在新建时使用. Defaults to None.
+        chunk_size (int, optional): 每次从数据库读取的行数. Defaults to 50000.
+
+    Returns:
+        int: 新计入的收益率个数
+    """
+    index_dir = pathlib.Path(index_dir)
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    source_state = get_nav_source_state(cursor, 'fund_cumulative_nav')
+
+    state = None
+    if not rebuild and (index_dir / 'meta.json').exists():
+        meta = json.loads((index_dir / 'meta.json').read_text(encoding='utf-8'))
+        dim, seed, start_date = meta['dim'], meta['seed'], meta['start_date']
+        # 旧版本的索引缺少按月统计量，用原来的参数重新建立
+        if meta.get('version') == index_version:
+            if meta['source_state'] == source_state:
+                cursor.close()
+                conn.close()
+                return 0
+            _, state = _load_index_state(index_dir)
+    if state is None:
+        state = _empty_index_state(dim)
+
+    all_fund_ids = get_nav_fund_ids(cursor, 'fund_cumulative_nav')
+    known_fund_ids = set(state['fund_ids'].tolist())
+    new_fund_ids = [fund_id for fund_id in all_fund_ids if fund_id not in known_fund_ids]
+    state = _add_funds(state, new_fund_ids)
+
+    # 同时读取已归档的净值
+    sources = []
+    if (state['last_days'] == no_day).all():
+        sources.append(iter_nav_rows(conn, 'fund_cumulative_nav', 'cumulative_nav', start_date=start_date,
+                                     chunk_size=chunk_size))
+    else:
+        # 每个基金只读取它已计入的最后日期之后的净值，最后日期相同的基金一起读取；新基金读取全部历史
+        for last_day in np.unique(state['last_days']).tolist():
+            group_fund_ids = state['fund_ids'][state['last_days'] == last_day].tolist()
+            group_start_date = start_date
+            if last_day != no_day:
+                group_start_date = max(str(np.datetime64(last_day + 1, 'D')), start_date or '')
+            sources.append(iter_nav_rows(conn, 'fund_cumulative_nav', 'cumulative_nav', group_fund_ids,
+                                         start_date=group_start_date, chunk_size=chunk_size))
+
+    added_returns = 0
+    vector_cache = {}
+    for rows_iter in sources:
+        while rows := list(itertools.islice(rows_iter, chunk_size)):
+            added_returns += _accumulate_rows(state, rows, dim, seed, vector_cache)
+    cursor.close()
+    conn.close()
+
+    # 先写到临时目录，完成后替换，读取方不会读到写了一半的索引
+    tmp_dir = index_dir.with_name(f'{index_dir.name}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    for name in index_arrays:
+        np.save(tmp_dir / f'{name}.npy', state[name])
+    (tmp_dir / 'meta.json').write_text(json.dumps({
+        'version': index_version,
+        'dim': dim,
+        'seed': seed,
+        'start_date': start_date,
+        'source_state': source_state,
+    }, ensure_ascii=False), encoding='utf-8')
+
+    old_dir = index_dir.with_name(f'{index_dir.name}.old')
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if index_dir.exists():
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return added_returns
+
+
+class SimilarityIndex:
+    """读取update_similarity_index建立的索引，按投影内积查询收益率最相关的基金
+
+    两个基金的历史长度不同时，投影内积只包含重叠日期上的协方差，但归一化用的是各自全部历史的方差，
+    会低估相关系数。查询时用按月统计量估计两个基金在重叠日期上的方差，把估计值换算到重叠日期上，
+    与exact_correlations在共同日期上计算的相关系数一致。
+    """
+
+    def __init__(self, index_dir=default_similarity_index_dir):
+        """
+        Args:
+            index_dir (str, optional): 索引目录. Defaults to default_similarity_index_dir.
+        """
+        meta, state = _load_index_state(pathlib.Path(index_dir))
+        if meta.get('version') != index_version:
+            raise Exception(f"相似度索引{index_dir}的版本过旧，请先运行update_similarity_index重新建立")
+        self.dim = meta['dim']
+        self.fund_ids = state['fund_ids']
+        self.counts = state['counts']
+        self.first_days = state['first_days']
+        self.last_days = state['last_days']
+        self._fund_index = {fund_id: i for i, fund_id in enumerate(self.fund_ids.tolist())}
+
+        # 减去均值后的投影 Σ (r_t - mean)·R_t，归一化后内积即相关系数的估计
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.means = np.nan_to_num(state['sum1'] / state['counts'])
+            centered = state['projections'] - self.means[:, None] * state['date_sums']
+            norms = np.linalg.norm(centered, axis=1)
+            self.vectors = np.nan_to_num(centered / norms[:, None]).astype(np.float32)
+        # 全部历史上的离差平方和 Σ (r_t - mean)^2
+        self.squared_deviations = state['sum2'] - self.means * state['sum1']
+
+        # 按月的累积统计量，shape=(3, 基金数, 月数+1)，第m列是第m个月之前的(个数, 和, 平方和)
+        months = state['months'].astype('datetime64[M]')
+        self.month_starts = months.astype('datetime64[D]').astype(np.int64)
+        self.month_ends = (months + 1).astype('datetime64[D]').astype(np.int64) - 1
+        monthly = np.stack([state[name].astype(np.float64) for name in month_arrays])
+        self._cumulative = np.concatenate([np.zeros(monthly.shape[:2] + (1,)), np.cumsum(monthly, axis=2)], axis=2)
+
+    def __contains__(self, fund_id: str):
+        return fund_id in self._fund_index
+
+    def _sums_through(self, funds, days):
+        """funds基金截至days（含）的(收益率个数, 和, 平方和)，月内按基金有收益率的日期线性插值"""
+        if len(self.month_starts) == 0:
+            return np.zeros((3,) + np.broadcast(funds, days).shape)
+        month = np.clip(np.searchsorted(self.month_starts, days, side='right') - 1, 0, len(self.month_starts) - 1)
+        low = np.maximum(self.month_starts[month], self.first_days[funds])
+        high = np.minimum(self.month_ends[month], self.last_days[funds])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(high >= low, np.clip((days - low + 1) / (high - low + 1), 0, 1), 0)
+        before = self._cumulative[:, funds, month]
+        return before + fraction * (self._cumulative[:, funds, month + 1] - before)
+
+    def _overlap_scales(self, funds_a, funds_b):
+        """把投影内积换算成重叠日期上的相关系数的系数，以及重叠日期上两个基金中较少的收益率个数
+
+        Args:
+            funds_a (np.ndarray): 基金下标，与funds_b可以广播
+            funds_b (np.ndarray): 基金下标
+
+        Returns:
+            tuple: (scales, overlap_counts)，形状为funds_a与funds_b广播后的形状
+        """
+        start_days = np.maximum(self.first_days[funds_a], self.first_days[funds_b])
+        end_days = np.minimum(self.last_days[funds_a], self.last_days[funds_b])
+        scales = np.ones(start_days.shape)
+        overlap_counts = np.full(start_days.shape, np.inf)
+        for funds in (funds_a, funds_b):
+            counts, sum1, sum2 = self._sums_through(funds, end_days) - self._sums_through(funds, start_days - 1)
+            means = self.means[funds]
+            total = self.squared_deviations[funds]
+            # 重叠日期上以全部历史的均值为中心的离差平方和，不超过全部历史上的
+            overlap = np.clip(sum2 - 2 * means * sum1 + counts * means ** 2, 1e-12, np.maximum(total, 1e-12))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scales *= np.sqrt(np.maximum(total, 1e-12) / overlap)
+            overlap_counts = np.minimum(overlap_counts, counts)
+        return scales, overlap_counts
+
+    def most_similar(self, fund_id: str, k: int = 10, min_observations: int = 60):
+        """收益率与fund_id最相关的k个基金
+
+        Args:
+            fund_id (str): 基金代码
+            k (int, optional): 返回的基金数. Defaults to 10.
+            min_observations (int, optional): 与fund_id重叠的收益率个数少于该值的基金不参与比较. Defaults to 60.
+
+        Raises:
+            KeyError: 索引中没有该基金
+
+        Returns:
+            list: [(基金代码, 重叠日期上相关系数的估计)]，按相关系数降序，不含fund_id本身
+        """
+        i = self._fund_index[fund_id]
+        others = np.arange(len(self.fund_ids))
+        scales, overlap_counts = self._overlap_scales(i, others)
+        similarities = np.clip(self.vectors @ self.vectors[i] * scales, -1, 1)
+        similarities[overlap_counts < min_observations] = -np.inf
+        similarities[i] = -np.inf
+
+        k = min(k, int(np.isfinite(similarities).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind='stable')]
+        return [(str(self.fund_ids[j]), float(similarities[j])) for j in top]
+
+    def similar_pairs(self, threshold: float = 0.98, min_observations: int = 60, block_size: int = 500):
+        """找出重叠日期上相关系数估计不低于threshold的所有基金对，如同一基金的A/C份额。分块计算矩阵乘积，限制内存占用
+
+        Args:
+            threshold (float, optional): 相关系数下限. Defaults to 0.98.
+            min_observations (int, optional): 重叠的收益率个数少于该值的基金对不参与比较. Defaults to 60.
+            block_size (int, optional): 每块的基金数. Defaults to 500.
+
+        Returns:
+            list: [(基金代码a, 基金代码b, 相关系数估计)]，a < b，按相关系数降序
+        """
+        candidates = np.flatnonzero(self.counts >= min_observations)
+        vectors = self.vectors[candidates]
+        pairs = []
+        for block_start in range(0, len(candidates), block_size):
+            # 只计算当前块与其后所有基金的内积，每对只算一次
+            block = vectors[block_start:block_start + block_size]
+            block_funds = candidates[block_start:block_start + block_size]
+            scales, overlap_counts = self._overlap_scales(block_funds[:, None], candidates[None, block_start:])
+            similarities = np.clip(block @ vectors[block_start:].T * scales, -1, 1)
+            similarities[overlap_counts < min_observations] = -np.inf
+            rows, cols = np.nonzero(np.triu(similarities >= threshold, k=1))
+            for row, col in zip(rows.tolist(), cols.tolist()):
+                pairs.append((
+                    str(self.fund_ids[candidates[block_start + row]]),
+                    str(self.fund_ids[candidates[block_start + col]]),
+                    float(similarities[row, col]),
+                ))
+        pairs.sort(key=lambda pair: -pair[2])
+        return pairs
+
+
+def exact_correlations(funds_db_file_path: str, fund_id: str, other_fund_ids, start_date: str = None,
+                       min_overlap: int = 20):
+    """从数据库读取累计净值，计算fund_id与其他基金在共同日期上日收益率的相关系数
+
+    Returns:
+        dict: {基金代码: 相关系数}，共同日期少于min_overlap的基金为NaN
+    """
+    dates, fund_ids, matrix = load_nav_matrix(funds_db_file_path, [fund_id, *other_fund_ids], start_date)
+    if len(dates) < 2 or fund_id not in fund_ids:
+        return {other_fund_id: np.nan for other_fund_id in other_fund_ids}
+
+    missing = np.isnan(matrix)
+    filled = forward_fill(matrix)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = filled[1:] / filled[:-1] - 1
+    returns[missing[1:]] = np.nan
+
+    target = returns[:, int(np.flatnonzero(fund_ids == fund_id)[0])]
+    correlations = {}
+    for j, other_fund_id in enumerate(fund_ids.tolist()):
+        if other_fund_id == fund_id:
+            continue
+        common = ~np.isnan(target) & ~np.isnan(returns[:, j])
+        if common.sum() < min_overlap:
+            correlations[other_fund_id] = np.nan
+            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlations[other_fund_id] = float(np.corrcoef(target[common], returns[common, j])[0, 1])
+    return {other_fund_id: correlations.get(other_fund_id, np.nan) for other_fund_id in other_fund_ids}
+
+
+def most_correlated_funds(funds_db_file_path: str, fund_id: str, k: int = 10, index_dir=default_similarity_index_dir,
+                          n_candidates: int = 50, min_observations: int = 60):
+    """先用索引取n_candidates个候选基金，再用数据库中的净值计算精确相关系数，返回最相关的k个
+
+    Returns:
+        list: [(基金代码, 相关系数, 索引中的估计值)]，按相关系数降序
+    """
+    index = SimilarityIndex(index_dir)
+    candidates = index.most_similar(fund_id, max(k, n_candidates), min_observations)
+    meta = json.loads((pathlib.Path(index_dir) / 'meta.json').read_text(encoding='utf-8'))
+    correlations = exact_correlations(funds_db_file_path, fund_id, [candidate for candidate, _ in candidates],
+                                      meta['start_date'])
+    ranked = [
+        (candidate, correlations[candidate], estimate)
+        for candidate, estimate in candidates if not np.isnan(correlations[candidate])
+    ]
+    ranked.sort(key=lambda item: -item[1])
+    return ranked[:k]
@@ -0,0 +1,16 @@
+import pathlib
+import sys
+import pytest
+
+# 项目模块都在project目录下，以顶层模块导入
+project_dir = pathlib.Path(__file__).parent.parent
+sys.path.insert(0, str(project_dir))
+
+
+@pytest.fixture(autouse=True)
+def metrics_dir(tmp_path, monkeypatch):
+    """指标导出到临时目录，不写入data/metrics"""
+    import metrics
+
+    monkeypatch.setattr(metrics, 'default_metrics_dir', tmp_path / 'metrics')
+    return tmp_path / 'metrics'
@@ -0,0 +1,65 @@
+import sqlite3
+import numpy as np
+import adjusted_nav
+import init_utils
+
+nav_dates = ['2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05', '2024-01-08']
+navs = [1.0, 1.1, 0.5, 0.55, 0.6]
+
+
+def test_split_and_dividend_on_same_day():
+    factors = adjusted_nav.compute_adjust_factors(
+        np.array(nav_dates, dtype='datetime64[D]'), np.array(navs),
+        np.array(['2024-01-04', '2024-01-04', '2024-01-06', '2024-01-09'], dtype='datetime64[D]'),
+        np.array(['dividend', 'split', 'dividend', 'dividend']),
+        np.array([0.1, 2.0, 0.06, 0.05]),
+        base_factor=1.5,
+    )
+    # 1月4日：分红 (0.5 + 0.1) / 0.5 = 1.2，拆分1:2再乘2，共2.4
+    # 周六1月6日的分红计入之后的第一个净值日1月8日：(0.6 + 0.06) / 0.6 = 1.1；最后净值日之后的分红不计入
+    np.testing.assert_allclose(factors, np.array([1, 1, 2.4, 2.4, 2.64]) * 1.5)
+
+
+def read_adjusted_nav(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT value_date, adjusted_nav, adjust_factor FROM fund_adjusted_nav ORDER BY value_date').fetchall()
+    conn.close()
+    return rows
+
+
+def test_new_event_mid_history_recomputes_only_suffix(tmp_path):
+    db_path = tmp_path / 'funds.db'
+    init_utils.create_if_not_exists_db_tables(str(db_path))
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO fund_nav (fund_id, value_date, nav) VALUES (?, ?, ?)',
+                     [('000001', value_date, nav) for value_date, nav in zip(nav_dates, navs)])
+    conn.commit()
+    conn.close()
+
+    adjusted_nav.save_all_fund_adjusted_nav(str(db_path))
+    assert read_adjusted_nav(db_path) == [(value_date, nav, 1.0) for value_date, nav in zip(nav_dates, navs)]
+
+    # 把1月3日的复权净值改成标记值，重新计算时如果改写了新事件之前的行就会被发现
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE fund_adjusted_nav SET adjusted_nav = -1 WHERE value_date = '2024-01-03'")
+    # 后来才获取到的1月4日分红和拆分
+    conn.execute("INSERT INTO fund_dividends (fund_id, ex_dividend_date, dividend_per_share) VALUES ('000001', '2024-01-04', 0.1)")
+    conn.execute("INSERT INTO fund_splits (fund_id, split_date, split_type, split_ratio) "
+                 "VALUES ('000001', '2024-01-04', '份额折算', '1:2.0000')")
+    conn.commit()
+    assert adjusted_nav.get_funds_to_adjust(conn.cursor()) == {'000001': '2024-01-04'}
+    conn.close()
+
+    adjusted_nav.save_all_fund_adjusted_nav(str(db_path))
+    rows = read_adjusted_nav(db_path)
+    assert rows[:2] == [('2024-01-02', 1.0, 1.0), ('2024-01-03', -1, 1.0)]
+    assert [value_date for value_date, _, _ in rows[2:]] == nav_dates[2:]
+    np.testing.assert_allclose([factor for _, _, factor in rows[2:]], [2.4, 2.4, 2.4])
+    np.testing.assert_allclose([value for _, value, _ in rows[2:]], [1.2, 1.32, 1.44])
+
+    # 事件已计入，没有新净值和新事件时不再重新计算
+    conn = sqlite3.connect(db_path)
+    assert adjusted_nav.get_funds_to_adjust(conn.cursor()) == {}
+    conn.close()
+    assert read_adjusted_nav(db_path) == rows
+
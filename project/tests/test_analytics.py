@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import analytics
+
+nan = np.nan
+dates = np.array(['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05', '2024-02-04', '2024-02-10'],
+                 dtype='datetime64[D]')
+# A有全部日期的净值；B前两天还没成立，1月5日缺净值，2月4日之后停止披露
+matrix = np.array([
+    [1.0, nan],
+    [1.2, nan],
+    [0.9, 2.0],
+    [1.0, 1.5],
+    [1.25, nan],
+    [1.1, 1.8],
+    [1.2, nan],
+])
+
+
+def test_compute_fund_metrics_by_hand():
+    metrics = analytics.compute_fund_metrics(dates, matrix)
+
+    # B的指标截至最后一个净值日期2月4日
+    assert analytics.last_valid_rows(matrix).tolist() == [6, 5]
+
+    # A：前高1.2（1月2日）跌到0.9，回撤25%；1月5日创新高1.25后到截止日2月10日未收复，持续36天
+    # B：从成立日的2.0跌到1.5，1月5日缺净值沿用1.5，2月4日1.8，未收复前高，持续32天而不是到矩阵末尾的38天
+    np.testing.assert_allclose(metrics['max_drawdown'], [-0.25, -0.25])
+    np.testing.assert_allclose(metrics['current_drawdown'], [1.2 / 1.25 - 1, 1.8 / 2.0 - 1])
+    assert metrics['max_drawdown_days'].tolist() == [36, 32]
+
+    # 成立以来收益率以各自第一个净值为起点，B不受前两行NaN影响
+    np.testing.assert_allclose(metrics['return_since_start'], [0.2, -0.1])
+    # 近1月：A从2月10日往前30天为1月11日，起点为1月5日的1.25；B从2月4日往前为1月5日，起点沿用1.5
+    np.testing.assert_allclose(metrics['return_1m'], [1.2 / 1.25 - 1, 1.8 / 1.5 - 1])
+    # 历史不足3月时没有近3月收益率
+    assert np.isnan(metrics['return_3m']).all()
+
+    # B的日收益率只有1月4日的-25%和2月4日相对1月4日的+20%，缺净值的1月5日不算0收益
+    volatility = np.std([-0.25, 0.2], ddof=1) * np.sqrt(analytics.trading_days_per_year)
+    assert metrics['annual_volatility'][1] == pytest.approx(volatility)
+    assert metrics['sharpe_ratio'][1] == pytest.approx(-0.025 * analytics.trading_days_per_year / volatility)
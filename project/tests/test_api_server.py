@@ -0,0 +1,91 @@
+import asyncio
+import json
+import sqlite3
+import numpy as np
+import api_server
+import init_utils
+
+n_days = 5000
+
+
+def create_db(db_path):
+    init_utils.create_if_not_exists_db_tables(str(db_path))
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO funds (fund_id, fund_name) VALUES ('000001', '测试基金')")
+    dates = (np.datetime64('2000-01-01') + np.arange(n_days)).astype(str).tolist()
+    conn.executemany('INSERT INTO fund_nav (fund_id, value_date, nav) VALUES (?, ?, ?)',
+                     [('000001', date, 1 + i / 10000) for i, date in enumerate(dates)])
+    conn.commit()
+    conn.close()
+
+
+async def http_get(port: int, path: str):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    header_bytes = await reader.readuntil(b'\r\n\r\n')
+    status = int(header_bytes.split(b' ', 2)[1])
+    if b'Transfer-Encoding: chunked' in header_bytes:
+        body = b''
+        while size := int((await reader.readline()).strip(), 16):
+            body += await reader.readexactly(size)
+            await reader.readline()
+    else:
+        body = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    return status, json.loads(body)
+
+
+def test_concurrent_nav_streams_and_lookups_do_not_deadlock(tmp_path):
+    db_path = tmp_path / 'funds.db'
+    create_db(db_path)
+
+    async def run():
+        server = api_server.FundsApiServer(db_path, pool_size=4, nav_chunk_rows=500)
+        asyncio_server = await server.start('127.0.0.1', 0)
+        port = asyncio_server.sockets[0].getsockname()[1]
+        try:
+            # 流式净值请求占住全部连接，同时还有等待连接的普通查询
+            requests = [http_get(port, f'/funds/000001/nav?start=2000-01-0{i + 1}') for i in range(6)]
+            requests += [http_get(port, f'/funds/000001?i={i}') for i in range(6)]
+            return await asyncio.wait_for(asyncio.gather(*requests), 10)
+        finally:
+            asyncio_server.close()
+            await asyncio_server.wait_closed()
+            server.close()
+
+    responses = asyncio.run(run())
+    for i, (status, body) in enumerate(responses[:6]):
+        assert status == 200
+        assert len(body['data']) == n_days - i
+    for status, body in responses[6:]:
+        assert status == 200
+        assert body['fund']['fund_name'] == '测试基金'
+
+
+def test_bad_content_length_returns_400(tmp_path):
+    db_path = tmp_path / 'funds.db'
+    create_db(db_path)
+
+    async def request(port, content_length):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'GET /funds/000001 HTTP/1.1\r\nContent-Length: {content_length}\r\n\r\n'.encode('latin-1'))
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        return int(response.split(b' ', 2)[1]), json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+    async def run():
+        server = api_server.FundsApiServer(db_path, pool_size=1)
+        asyncio_server = await server.start('127.0.0.1', 0)
+        port = asyncio_server.sockets[0].getsockname()[1]
+        try:
+            return await asyncio.wait_for(asyncio.gather(request(port, 'abc'), request(port, '-1')), 10)
+        finally:
+            asyncio_server.close()
+            await asyncio_server.wait_closed()
+            server.close()
+
+    assert asyncio.run(run()) == [(400, {'error': 'bad content-length'})] * 2
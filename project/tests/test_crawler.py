@@ -0,0 +1,41 @@
+import crawler
+from conftest import project_dir
+
+fixtures_dir = project_dir / 'benchmark_fixtures'
+
+# 原来用BeautifulSoup和pandas.read_html解析同样网页的结果
+golden_fund_info = {
+    '000001': {
+        '基金简称': '华夏成长混合', '类型': '混合型-偏股', '规模': '27.30', '成立日': '2001-12-18', '封闭期': 36,
+        '申购状态': '开放申购', '预估开放时间': '2024-12-18/2024-12-19', '申购费率': '1.50%',
+        '基金经理': '王泽实 万方方', '最新经理变动日期': '2021-01-26',
+        '最低赎回费率适用期限': '730', '最低赎回费率': '0.00%', '基金代码': '000001',
+    },
+    '000009': {
+        '基金简称': '易方达天天理财货币A', '类型': '货币型-普通货币', '规模': '386.45', '成立日': '2001-12-18', '封闭期': 0,
+        '申购状态': '开放申购', '预估开放时间': '2024-12-18/2024-12-19', '申购费率': '0.00%',
+        '基金经理': '王泽实 万方方', '最新经理变动日期': '2021-01-26',
+        '最低赎回费率适用期限': '', '最低赎回费率': '', '基金代码': '000009',
+    },
+}
+redemption_keys = ['最低赎回费率适用期限', '最低赎回费率']
+
+
+def read_fixture(page: str, fund_code: str):
+    return (fixtures_dir / f'{page}_{fund_code}.html').read_text(encoding='utf-8')
+
+
+def test_parse_fixtures_match_golden_output():
+    for fund_code, golden in golden_fund_info.items():
+        fund_page_html, fee_page_html = read_fixture('fund', fund_code), read_fixture('jjfl', fund_code)
+
+        basic_info = crawler.parse_fund_basic_info(fund_code, fund_page_html)
+        assert basic_info == {key: value for key, value in golden.items()
+                              if key not in redemption_keys and key != '基金代码'}, fund_code
+
+        fund_info = crawler.parse_fund_pages(fund_code, fund_page_html, fee_page_html)
+        # 费率表是后来增加的，原来的解析结果中没有
+        assert {key: value for key, value in fund_info.items() if key != '费率表'} == golden, fund_code
+
+    redemption_info = crawler.parse_least_redemption_period_rate('000001', read_fixture('jjfl', '000001'))
+    assert redemption_info == {key: golden_fund_info['000001'][key] for key in redemption_keys}
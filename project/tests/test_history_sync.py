@@ -0,0 +1,160 @@
+import pathlib
+import signal
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import time
+import pytest
+import init_utils
+from conftest import project_dir
+
+fund_count = 1000
+
+
+def fake_fetch(fund_id):
+    # 模拟获取一个基金的净值，耗时约10毫秒，4个线程全部获取约需2.5秒
+    time.sleep(0.01)
+    return [(fund_id, f'2024-01-0{day}', 1.0 + day / 100) for day in (1, 2, 3)]
+
+
+def use_fake_fetch(history_data_sources, fetch):
+    _, insert_query, _ = history_data_sources['fund_nav']
+    history_data_sources['fund_nav'] = ('value_date', insert_query, fetch)
+
+
+def create_db(db_path):
+    init_utils.create_if_not_exists_db_tables(str(db_path))
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO funds (fund_id) VALUES (?)', [(f'{i:06d}',) for i in range(fund_count)])
+    conn.commit()
+    conn.close()
+
+
+def count_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    done_jobs = conn.execute("SELECT COUNT(*) FROM crawl_jobs WHERE indicator = 'fund_nav' AND status = 'done'").fetchone()[0]
+    nav_funds = conn.execute('SELECT COUNT(DISTINCT fund_id) FROM fund_nav').fetchone()[0]
+    nav_rows = conn.execute('SELECT COUNT(*) FROM fund_nav').fetchone()[0]
+    conn.close()
+    return done_jobs, nav_funds, nav_rows
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='需要向子进程发送SIGINT')
+def test_interrupted_sync_exits_and_resumes(tmp_path, monkeypatch):
+    db_path = tmp_path / 'funds.db'
+    create_db(db_path)
+
+    script = textwrap.dedent(f'''
+        import sys
+        sys.path.insert(0, {str(pathlib.Path(__file__).parent)!r})
+        import init_utils
+        import metrics
+        from test_history_sync import fake_fetch, use_fake_fetch
+
+        metrics.default_metrics_dir = {str(tmp_path / 'metrics')!r}
+        use_fake_fetch(init_utils.history_data_sources, fake_fetch)
+        print('started', flush=True)
+        init_utils.sync_all_fund_history_data({str(db_path)!r}, ['fund_nav'], concurrency=4, queue_size=8)
+    ''')
+    process = subprocess.Popen([sys.executable, '-c', script], cwd=project_dir,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    assert process.stdout.readline().strip() == 'started'
+    time.sleep(1)
+    process.send_signal(signal.SIGINT)
+    try:
+        _, stderr = process.communicate(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        pytest.fail('sync did not exit within 10s after SIGINT')
+    assert process.returncode != 0
+    assert 'KeyboardInterrupt' in stderr
+
+    # 确实在中途中断，且已提交的进度与已写入的数据一致
+    done_jobs, nav_funds, nav_rows = count_rows(db_path)
+    assert 0 < done_jobs < fund_count
+    assert nav_funds == done_jobs
+    assert nav_rows == done_jobs * 3
+
+    fetched = []
+    monkeypatch.setattr(init_utils, 'history_data_sources', dict(init_utils.history_data_sources))
+    use_fake_fetch(init_utils.history_data_sources, lambda fund_id: fetched.append(fund_id) or fake_fetch(fund_id))
+
+    failed_funds = init_utils.sync_all_fund_history_data(str(db_path), ['fund_nav'], resume=True, concurrency=4)
+    assert failed_funds == {}
+    # 继续时只获取中断前未完成的基金
+    assert len(fetched) == fund_count - done_jobs
+    assert count_rows(db_path) == (fund_count, fund_count, fund_count * 3)
+
+
+def test_writer_setup_failure_stops_sync(tmp_path):
+    db_path = tmp_path / 'funds.db'
+    create_db(db_path)
+
+    # 写入线程查询最新日期时数据库被锁，获取线程和主线程应停止，而不是一直等待
+    script = textwrap.dedent(f'''
+        import sqlite3
+        import sys
+        sys.path.insert(0, {str(pathlib.Path(__file__).parent)!r})
+        import init_utils
+        import metrics
+        from test_history_sync import fake_fetch, use_fake_fetch
+
+        def locked(*args, **kwargs):
+            raise sqlite3.OperationalError('database is locked')
+
+        metrics.default_metrics_dir = {str(tmp_path / 'metrics')!r}
+        use_fake_fetch(init_utils.history_data_sources, fake_fetch)
+        init_utils.get_all_fund_latest_date_from_db = locked
+        init_utils.sync_all_fund_history_data({str(db_path)!r}, ['fund_nav'], incremental=True, concurrency=4, queue_size=8)
+    ''')
+    process = subprocess.Popen([sys.executable, '-c', script], cwd=project_dir,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        _, stderr = process.communicate(timeout=20)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        pytest.fail('sync did not exit within 20s after the writer failed')
+    assert process.returncode != 0
+    assert 'database is locked' in stderr
+    assert count_rows(db_path) == (0, 0, 0)
+
+
+def fhsp_page(dividend_rows, split_rows):
+    # 模拟分红送配页：基金信息表、分红表、拆分表
+    def table(header, rows):
+        # 只有一个单元格时是整行的提示，如"暂无分红信息!"
+        cells = ''.join(f"<tr>{row[0] if len(row) == 1 else ''.join(f'<td>{cell}</td>' for cell in row)}</tr>"
+                        for row in rows)
+        return f"<table><tr>{''.join(f'<th>{cell}</th>' for cell in header)}</tr>{cells}</table>"
+    return (table(['基金代码', '基金名称'], [['000001', '测试基金']])
+            + table(['年份', '权益登记日', '除息日', '每份分红', '分红发放日'], dividend_rows)
+            + table(['年份', '拆分折算日', '拆分类型', '拆分折算比例'], split_rows))
+
+
+def test_dividends_and_splits_fetch_page_once(tmp_path, monkeypatch):
+    db_path = tmp_path / 'funds.db'
+    create_db(db_path)
+    fund_ids = ['000001', '000002']
+    pages = {
+        '000001': fhsp_page([['2023年', '2023-05-10', '2023-05-10', '每份派现金0.0500元', '2023-05-12']],
+                            [['2020年', '2020-03-02', '份额折算', '1:1.0500']]),
+        '000002': fhsp_page([["<td colspan='5'>暂无分红信息!</td>"]], [["<td colspan='4'>暂无拆分信息!</td>"]]),
+    }
+    fetched = []
+
+    def fake_fetch_text(url, *args, **kwargs):
+        fetched.append(url)
+        return pages[url[-11:-5]]
+
+    monkeypatch.setattr('http_client.fetch_text', fake_fetch_text)
+    failed_funds = init_utils.sync_all_fund_history_data(str(db_path), ['fund_dividends', 'fund_splits'], fund_ids=fund_ids)
+
+    assert failed_funds == {}
+    # 每个基金只请求一次分红送配页
+    assert sorted(fetched) == [f'https://fundf10.eastmoney.com/fhsp_{fund_id}.html' for fund_id in fund_ids]
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT * FROM fund_dividends').fetchall() == [('000001', '2023-05-10', 0.05)]
+    assert conn.execute('SELECT * FROM fund_splits').fetchall() == [('000001', '2020-03-02', '份额折算', '1:1.0500')]
+    assert conn.execute("SELECT COUNT(*) FROM crawl_jobs WHERE status = 'done'").fetchone()[0] == 4
+    conn.close()
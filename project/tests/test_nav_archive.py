@@ -0,0 +1,49 @@
+import sqlite3
+import subprocess
+import sys
+import init_utils
+import nav_archive
+from conftest import project_dir
+
+
+def create_db(db_path):
+    init_utils.create_if_not_exists_db_tables(str(db_path))
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO fund_nav (fund_id, value_date, nav) VALUES (?, ?, ?)', [
+        (fund_id, f'{year}-0{month}-01', round(1 + year % 10 / 10 + month / 100, 4))
+        for fund_id in ('000001', '000002') for year in range(2020, 2025) for month in range(1, 4)
+    ])
+    conn.commit()
+    conn.close()
+
+
+def read_state(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = list(nav_archive.iter_nav_rows(conn, 'fund_nav', 'nav'))
+    latest_dates = init_utils.get_all_fund_latest_date_from_db(conn.cursor(), 'fund_nav', 'value_date')
+    has_archive = nav_archive.has_archive_table(conn.cursor(), 'fund_nav')
+    conn.close()
+    return rows, latest_dates, has_archive
+
+
+def test_archive_table_created_only_when_compacting(tmp_path):
+    db_path = tmp_path / 'funds.db'
+    create_db(db_path)
+    rows, latest_dates, has_archive = read_state(db_path)
+    # 建表时不创建归档表，读取走只查净值表的路径
+    assert not has_archive
+    assert latest_dates == {'000001': '2024-03-01', '000002': '2024-03-01'}
+
+    # 没有需要归档的净值时也不创建
+    nav_archive.compact_nav_tables(str(db_path), ['fund_nav'], before_year=2000, vacuum=False)
+    assert read_state(db_path) == (rows, latest_dates, False)
+
+    result = nav_archive.compact_nav_tables(str(db_path), ['fund_nav'], before_year=2023, vacuum=False)
+    assert result['fund_nav']['archived_rows'] == 2 * 3 * 3
+    assert read_state(db_path) == (rows, latest_dates, True)
+
+
+def test_import_init_utils_does_not_import_numpy():
+    output = subprocess.check_output(
+        [sys.executable, '-c', "import sys, init_utils; print('numpy' in sys.modules)"], cwd=project_dir, text=True)
+    assert output.strip() == 'False'
@@ -0,0 +1,67 @@
+import sqlite3
+import numpy as np
+import init_utils
+import nav_store
+
+
+def create_db(db_path):
+    init_utils.create_if_not_exists_db_tables(str(db_path))
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO fund_nav (fund_id, value_date, nav) VALUES (?, ?, ?)', [
+        ('000001', '2024-01-02', 1.0),
+        ('000001', '2024-01-03', 1.1),
+        ('000002', '2024-01-02', 2.0),
+        ('000002', '2024-01-04', None),
+        ('000002', '2024-01-05', 2.2),
+    ])
+    conn.commit()
+    conn.close()
+
+
+def execute(db_path, query):
+    conn = sqlite3.connect(db_path)
+    conn.execute(query)
+    conn.commit()
+    conn.close()
+
+
+def test_export_and_load_round_trip(tmp_path):
+    db_path = tmp_path / 'funds.db'
+    store_dir = tmp_path / 'nav_store'
+    create_db(db_path)
+
+    assert nav_store.export_nav_store(str(db_path), 'nav', store_dir)
+    store = nav_store.NavStore('nav', store_dir)
+    assert store.fund_ids.tolist() == ['000001', '000002']
+    dates, values = store.get('000002')
+    assert dates.astype(str).tolist() == ['2024-01-02', '2024-01-04', '2024-01-05']
+    np.testing.assert_array_equal(values, [2.0, np.nan, 2.2])
+    assert store.get('000001', start_date='2024-01-03')[1].tolist() == [1.1]
+
+    # 数据表没有变化时不重新导出
+    assert not nav_store.export_nav_store(str(db_path), 'nav', store_dir)
+
+    # 修正已有日期的净值，行数和最新日期不变，也要重新导出
+    execute(db_path, "UPDATE fund_nav SET nav = 9.9 WHERE fund_id = '000001' AND value_date = '2024-01-03'")
+    assert nav_store.export_nav_store(str(db_path), 'nav', store_dir)
+    assert nav_store.NavStore('nav', store_dir).get('000001')[1].tolist() == [1.0, 9.9]
+
+
+def test_get_nav_as_of_falls_back_to_database_when_store_is_stale(tmp_path):
+    db_path = tmp_path / 'funds.db'
+    store_dir = tmp_path / 'nav_store'
+    create_db(db_path)
+    nav_store.export_nav_store(str(db_path), 'nav', store_dir)
+    query_dates = ['2024-01-03', '2024-01-04']
+
+    values, _ = nav_store.get_nav_as_of(str(db_path), ['000001'], query_dates, store_dir=store_dir)
+    assert values.tolist() == [[1.1, 1.1]]
+
+    # 导出后修正净值并插入更新的净值，不能再返回导出时的数据
+    execute(db_path, "UPDATE fund_nav SET nav = 1.15 WHERE fund_id = '000001' AND value_date = '2024-01-03'")
+    execute(db_path, "INSERT INTO fund_nav (fund_id, value_date, nav) VALUES ('000001', '2024-01-04', 1.2)")
+    values, value_dates = nav_store.get_nav_as_of(str(db_path), ['000001'], query_dates, store_dir=store_dir)
+    expected_values, expected_dates = nav_store.query_nav_as_of(str(db_path), ['000001'], query_dates)
+    assert values.tolist() == [[1.15, 1.2]]
+    np.testing.assert_array_equal(values, expected_values)
+    np.testing.assert_array_equal(value_dates, expected_dates)
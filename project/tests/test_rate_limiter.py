@@ -0,0 +1,168 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+import http_client
+import rate_limiter
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """按server.mode返回：'limited'时同时处理的请求超过server.max_concurrent返回429，'down'时返回500，'up'时返回200"""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            over_limit = server.in_flight > server.max_concurrent
+        try:
+            time.sleep(0.02)
+            if server.mode == 'down' or (server.mode == 'limited' and over_limit):
+                status = 500 if server.mode == 'down' else 429
+            else:
+                status = 200
+            body = b'ok'
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+                server.status_counts[status] = server.status_counts.get(status, 0) + 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    # 每个测试使用新的限制器
+    monkeypatch.setattr(rate_limiter, '_limiters', {})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_concurrent = 5
+    server.mode = 'up'
+    server.status_counts = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def stub_url(server, path='/fund.html'):
+    return f'http://127.0.0.1:{server.server_address[1]}{path}'
+
+
+def fetch_status(url):
+    try:
+        http_client.fetch_text(url, use_cache=False, timeout=5)
+        return 200
+    except requests.HTTPError as e:
+        return e.response.status_code
+
+
+def test_concurrency_backs_off_to_server_limit(stub_server):
+    stub_server.mode = 'limited'
+    limiter = rate_limiter.get_limiter('127.0.0.1', initial_concurrency=16, failure_threshold=1000)
+    url = stub_url(stub_server)
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        statuses = list(executor.map(lambda _: fetch_status(url), range(400)))
+
+    # 并发上限收敛到服务器能承受的5附近，绝大部分请求成功
+    assert limiter.stats()['limit'] <= 8
+    assert statuses.count(200) > 0.8 * len(statuses)
+    assert limiter.stats()['throttles'] == statuses.count(429)
+
+
+def test_breaker_waits_instead_of_failing(stub_server):
+    stub_server.mode = 'down'
+    limiter = rate_limiter.get_limiter('127.0.0.1', failure_threshold=3, open_seconds=0.5)
+    url = stub_url(stub_server)
+
+    for _ in range(3):
+        assert fetch_status(url) == 500
+    assert limiter.stats()['circuit_open']
+
+    # 熔断期间的请求等待熔断到期后再发出；短暂故障恢复后排队的请求全部成功，不抛出CircuitOpenError
+    threading.Timer(0.2, lambda: setattr(stub_server, 'mode', 'up')).start()
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = list(executor.map(lambda _: fetch_status(url), range(16)))
+    assert time.monotonic() - start >= 0.4
+    assert statuses == [200] * 16
+    assert not limiter.stats()['circuit_open']
+    # 熔断期间没有请求发到服务器
+    assert stub_server.status_counts == {500: 3, 200: 16}
+
+
+def test_failed_probe_doubles_open_time(stub_server):
+    stub_server.mode = 'down'
+    limiter = rate_limiter.get_limiter('127.0.0.1', failure_threshold=1, open_seconds=0.2)
+    url = stub_url(stub_server)
+
+    assert fetch_status(url) == 500
+    # 探测请求失败后熔断时间加倍，等待超时时抛出CircuitOpenError
+    assert fetch_status(url) == 500
+    assert limiter.open_seconds == pytest.approx(0.4)
+    with pytest.raises(rate_limiter.CircuitOpenError):
+        limiter.acquire(timeout=0.1)
+
+
+def test_non_transport_errors_do_not_count_as_failures(stub_server):
+    limiter = rate_limiter.get_limiter('127.0.0.1', initial_concurrency=4, failure_threshold=2)
+
+    def parse_empty_data():
+        raise KeyError('净值日期')
+
+    for _ in range(5):
+        with pytest.raises(KeyError):
+            rate_limiter.call_limited('127.0.0.1', parse_empty_data)
+    stats = limiter.stats()
+    assert stats['failures'] == 0
+    assert not stats['circuit_open']
+    assert stats['limit'] >= 4
+
+    # 连接失败计为失败
+    closed_url = stub_url(stub_server)
+    stub_server.shutdown()
+    stub_server.server_close()
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            http_client.fetch_text(closed_url, use_cache=False, timeout=1)
+    assert limiter.stats()['failures'] == 2
+    assert limiter.stats()['circuit_open']
+
+
+def simulate(limiter, latencies, latency_congestion=True):
+    for latency in latencies:
+        limiter.acquire(timeout=1)
+        limiter.release(latency, latency_congestion=latency_congestion)
+
+
+def test_fast_outlier_does_not_pin_limit():
+    # 一次特别快的响应之后延迟稳定，最近最低延迟随窗口更新，并发上限恢复增长
+    limiter = rate_limiter.HostLimiter('example.com', initial_concurrency=4, latency_window=50)
+    simulate(limiter, [0.05] + [0.3] * 300)
+    assert limiter.limit > 4
+
+    # akshare接口的耗时随数据量变化，不限流时并发上限持续增长
+    limiter = rate_limiter.HostLimiter('example.com', initial_concurrency=4)
+    latencies = [0.05] + [0.3 + 0.9 * (i * 7919 % 100) / 100 for i in range(300)]
+    simulate(limiter, latencies, latency_congestion=False)
+    assert limiter.limit > 8
+    assert limiter.stats()['throttles'] == 0
+
+
+def test_forbidden_counts_as_throttle():
+    # eastmoney的反爬拦截返回403
+    limiter = rate_limiter.HostLimiter('example.com', initial_concurrency=8)
+    limiter.acquire()
+    limiter.release(0.1, status_code=403)
+    assert limiter.stats()['throttles'] == 1
+    assert limiter.limit == 4
@@ -0,0 +1,93 @@
+import datetime
+import sqlite3
+import pandas as pd
+import init_utils
+import refresh_scheduler
+from refresh_scheduler import PRIORITY_CHANGED, PRIORITY_NEW, PRIORITY_STALE
+
+
+def days_ago(days):
+    return (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat(sep=' ', timespec='seconds')
+
+
+def create_db(db_path):
+    init_utils.create_if_not_exists_db_tables(str(db_path))
+    refresh_scheduler.create_if_not_exists_crawl_state_table(str(db_path))
+    conn = sqlite3.connect(db_path)
+    # 000003只有列表信息，没有详情页信息
+    conn.executemany('INSERT INTO funds (fund_id, fund_type) VALUES (?, ?)', [
+        ('000001', '债券型'), ('000003', None), ('000004', '债券型'), ('000005', '债券型'), ('000006', '债券型'),
+    ])
+    conn.executemany('INSERT INTO fund_crawl_state (fund_id, list_hash, last_crawled_at) VALUES (?, ?, ?)', [
+        ('000001', 'same', days_ago(1)),
+        ('000004', 'old', days_ago(1)),
+        ('000005', 'same', days_ago(40)),
+        ('000006', 'same', days_ago(60)),
+    ])
+    conn.commit()
+    conn.close()
+
+
+def test_plan_deep_crawl_priorities_and_budget(tmp_path):
+    db_path = tmp_path / 'funds.db'
+    create_db(db_path)
+    # 000002不在funds表中
+    list_hashes = {fund_id: 'same' for fund_id in ('000001', '000002', '000003', '000004', '000005', '000006')}
+
+    # 000001最近爬取过且列表没有变化，不需要爬取；过期的基金上次爬取越早越优先
+    assert refresh_scheduler.plan_deep_crawl(str(db_path), list_hashes, daily_request_budget=100) == [
+        ('000002', PRIORITY_NEW), ('000003', PRIORITY_NEW), ('000004', PRIORITY_CHANGED),
+        ('000006', PRIORITY_STALE), ('000005', PRIORITY_STALE),
+    ]
+    # 每个基金按2个请求计，预算不足时丢弃优先级最低的
+    assert refresh_scheduler.plan_deep_crawl(str(db_path), list_hashes, daily_request_budget=9) == [
+        ('000002', PRIORITY_NEW), ('000003', PRIORITY_NEW), ('000004', PRIORITY_CHANGED), ('000006', PRIORITY_STALE),
+    ]
+    assert refresh_scheduler.plan_deep_crawl(str(db_path), list_hashes, daily_request_budget=1) == []
+    # 过期天数更长时000005、000006都不算过期
+    assert refresh_scheduler.plan_deep_crawl(str(db_path), list_hashes, daily_request_budget=100, stale_days=90) == [
+        ('000002', PRIORITY_NEW), ('000003', PRIORITY_NEW), ('000004', PRIORITY_CHANGED),
+    ]
+
+
+def fund_info(fund_id):
+    return {
+        '基金代码': fund_id, '基金简称': f'基金{fund_id}', '成立日': '2020-01-01', '规模': 1.0, '类型': '债券型',
+        '申购状态': '开放申购', '封闭期': None, '预估开放时间': None, '申购费率': 0.08, '最低赎回费率适用期限': 7,
+        '最低赎回费率': 0.0, '基金经理': '张三', '最新经理变动日期': '2020-01-01',
+    }
+
+
+def test_scheduled_refresh_does_not_touch_crawl_jobs(tmp_path, monkeypatch):
+    db_path = tmp_path / 'funds.db'
+    create_db(db_path)
+    fund_ids = ['000001', '000002', '000003']
+    fund_list = pd.DataFrame({
+        '基金代码': fund_ids, '基金简称': [f'基金{fund_id}' for fund_id in fund_ids],
+        '申购状态': '开放申购', '赎回状态': '开放赎回', '手续费': '0.08%',
+    })
+    list_hashes = refresh_scheduler.get_fund_list_hashes(fund_list)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE fund_crawl_state SET list_hash = ? WHERE fund_id = '000001'", (list_hashes['000001'],))
+    conn.execute("INSERT INTO crawl_jobs (fund_id, indicator, status, error) VALUES ('000002', 'funds', 'failed', 'timeout')")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(refresh_scheduler, 'call_limited', lambda host, func: fund_list)
+    crawled = []
+
+    def fake_crawl_basic_info(fund_ids, concurrency, fund_types=None):
+        for fund_id in fund_ids:
+            crawled.append(fund_id)
+            yield fund_id, fund_info(fund_id), None
+
+    monkeypatch.setattr(refresh_scheduler, 'crawl_basic_info', fake_crawl_basic_info)
+    assert refresh_scheduler.run_scheduled_refresh(str(db_path), daily_request_budget=100) == {}
+
+    # 只深度爬取新基金，进度记在fund_crawl_state表，crawl-info任务的状态不变
+    assert crawled == ['000002', '000003']
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT fund_id, indicator, status FROM crawl_jobs').fetchall() == [('000002', 'funds', 'failed')]
+    crawl_states = dict(conn.execute('SELECT fund_id, list_hash FROM fund_crawl_state').fetchall())
+    assert crawl_states['000002'] == list_hashes['000002']
+    assert conn.execute("SELECT fund_type FROM funds WHERE fund_id = '000003'").fetchone() == ('债券型',)
+    conn.close()
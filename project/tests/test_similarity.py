@@ -0,0 +1,89 @@
+import sqlite3
+import numpy as np
+import init_utils
+import similarity
+
+n_days = 800
+dates = (np.datetime64('2020-01-01') + np.arange(n_days)).astype(str).tolist()
+
+
+def fund_returns(seed=0):
+    # A全部历史；B晚成立，只有最后200天，与A高度相关；C与A无关；D中途成立又停更，与A负相关
+    rng = np.random.default_rng(seed)
+    market = rng.normal(0, 0.01, n_days)
+    return {
+        '00000A': (0, n_days, market + rng.normal(0, 0.003, n_days)),
+        '00000B': (600, n_days, market + rng.normal(0, 0.005, n_days)),
+        '00000C': (0, n_days, rng.normal(0, 0.01, n_days)),
+        '00000D': (300, 650, -market + rng.normal(0, 0.008, n_days)),
+    }
+
+
+def insert_navs(db_path, funds, end_day=n_days):
+    conn = sqlite3.connect(db_path)
+    rows = []
+    for fund_id, (start, end, returns) in funds.items():
+        navs = np.cumprod(1 + returns[start:end])
+        rows.extend((fund_id, dates[day], float(nav)) for day, nav in zip(range(start, end), navs) if day < end_day)
+    conn.executemany('INSERT OR IGNORE INTO fund_cumulative_nav (fund_id, value_date, cumulative_nav) VALUES (?, ?, ?)',
+                     rows)
+    conn.commit()
+    conn.close()
+
+
+def create_db(db_path, funds, end_day=n_days):
+    init_utils.create_if_not_exists_db_tables(str(db_path))
+    insert_navs(db_path, funds, end_day)
+
+
+def test_estimates_match_exact_correlations_for_unequal_histories(tmp_path):
+    db_path = tmp_path / 'funds.db'
+    create_db(db_path, fund_returns())
+    similarity.update_similarity_index(str(db_path), tmp_path / 'index', dim=2048)
+
+    index = similarity.SimilarityIndex(tmp_path / 'index')
+    estimates = dict(index.most_similar('00000A', k=3, min_observations=60))
+    exact = similarity.exact_correlations(str(db_path), '00000A', ['00000B', '00000C', '00000D'])
+
+    # 较新的B、停更的D按重叠日期归一化，不因历史较短而被低估
+    assert exact['00000B'] > 0.8
+    assert exact['00000D'] < -0.6
+    for fund_id in ('00000B', '00000C', '00000D'):
+        assert abs(estimates[fund_id] - exact[fund_id]) < 0.1, fund_id
+    assert next(iter(estimates)) == '00000B'
+
+    pairs = index.similar_pairs(threshold=0.8, block_size=2)
+    assert [pair[:2] for pair in pairs] == [('00000A', '00000B')]
+
+
+def test_stale_fund_does_not_force_full_reread(tmp_path, monkeypatch):
+    funds = fund_returns()
+    db_path = tmp_path / 'funds.db'
+    create_db(db_path, funds, end_day=700)
+    similarity.update_similarity_index(str(db_path), tmp_path / 'index', dim=16)
+
+    rows_read = []
+    iter_nav_rows = similarity.iter_nav_rows
+
+    def counting_iter_nav_rows(*args, **kwargs):
+        for row in iter_nav_rows(*args, **kwargs):
+            rows_read.append(row)
+            yield row
+
+    monkeypatch.setattr(similarity, 'iter_nav_rows', counting_iter_nav_rows)
+    insert_navs(db_path, funds)
+    added_returns = similarity.update_similarity_index(str(db_path), tmp_path / 'index')
+
+    # D在第650天停更，只读取A、B、C第700天之后的新净值
+    assert len(rows_read) == added_returns == 3 * (n_days - 700)
+    assert {fund_id for fund_id, _, _ in rows_read} == {'00000A', '00000B', '00000C'}
+
+    # 增量更新的结果与重新建立的一致
+    similarity.update_similarity_index(str(db_path), tmp_path / 'rebuilt', dim=16)
+    _, incremental = similarity._load_index_state(tmp_path / 'index')
+    _, rebuilt = similarity._load_index_state(tmp_path / 'rebuilt')
+    for name in similarity.index_arrays:
+        if name == 'fund_ids':
+            assert incremental[name].tolist() == rebuilt[name].tolist()
+        else:
+            np.testing.assert_allclose(incremental[name], rebuilt[name], rtol=1e-5, atol=1e-9, err_msg=name)
@@ -0,0 +1,176 @@
+import json
+import pathlib
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import init_utils
+import work_queue
+from conftest import project_dir
+
+fund_ids = [f'{i:06d}' for i in range(120)]
+
+
+def fake_fetch(fund_id):
+    # 模拟获取一个基金的净值，耗时约20毫秒
+    time.sleep(0.02)
+    return [(fund_id, '2024-01-02', 1.0)]
+
+
+def slow_fetch(fund_id):
+    # 每批的最后一个基金获取很慢，模拟限制器熔断时等待；此时写入线程已经写入了同批的其他基金
+    if fund_id.endswith('9'):
+        time.sleep(1.5)
+    return fake_fetch(fund_id)
+
+
+def use_fake_fetch(monkeypatch, fetch):
+    monkeypatch.setattr(init_utils, 'history_data_sources', dict(init_utils.history_data_sources))
+    _, insert_query, _ = init_utils.history_data_sources['fund_nav']
+    init_utils.history_data_sources['fund_nav'] = ('value_date', insert_query, fetch)
+
+
+def create_queue(db_path, batch_size=10):
+    init_utils.create_if_not_exists_db_tables(str(db_path))
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO funds (fund_id) VALUES (?)', [(fund_id,) for fund_id in fund_ids])
+    conn.commit()
+    conn.close()
+    return work_queue.enqueue_fund_batches(str(db_path), 'fund_nav', batch_size=batch_size)
+
+
+def queue_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT batch_id, status, attempts, lease_owner, error FROM work_queue ORDER BY batch_id').fetchall()
+    conn.close()
+    return rows
+
+
+def run_worker_processes(db_path, metrics_dir, worker_ids, fetch='fake_fetch', lease_seconds=30, concurrency=2):
+    """在子进程中运行多个worker，返回各自的{'finished': 完成批数, 'fetched': 获取的基金}"""
+    def start_worker(worker_id):
+        script = textwrap.dedent(f'''
+            import json
+            import sys
+            sys.path.insert(0, {str(pathlib.Path(__file__).parent)!r})
+            import init_utils
+            import metrics
+            import work_queue
+            from test_work_queue import {fetch} as fetch
+
+            metrics.default_metrics_dir = {str(metrics_dir)!r}
+            fetched = []
+            _, insert_query, _ = init_utils.history_data_sources['fund_nav']
+            init_utils.history_data_sources['fund_nav'] = (
+                'value_date', insert_query, lambda fund_id: fetched.append(fund_id) or fetch(fund_id))
+            finished = work_queue.run_worker({str(db_path)!r}, 'fund_nav', worker_id={worker_id!r},
+                                             lease_seconds={lease_seconds}, concurrency={concurrency}, poll_seconds=0.1)
+            print(json.dumps({{'finished': finished, 'fetched': fetched}}))
+        ''')
+        return subprocess.Popen([sys.executable, '-c', script], cwd=project_dir,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    workers = [start_worker(worker_id) for worker_id in worker_ids]
+    results = []
+    for worker in workers:
+        stdout, stderr = worker.communicate(timeout=120)
+        assert worker.returncode == 0, stderr
+        results.append(json.loads(stdout.strip().splitlines()[-1]))
+    return results
+
+
+def test_two_worker_processes_share_queue(tmp_path, metrics_dir):
+    db_path = tmp_path / 'funds.db'
+    n_batches = create_queue(db_path)
+    results = run_worker_processes(db_path, metrics_dir, ['worker:1', 'worker:2'])
+
+    # 两个worker都领到了批次，每个基金只被获取一次，每批只被领取一次
+    assert all(result['finished'] > 0 for result in results)
+    assert sum(result['finished'] for result in results) == n_batches
+    fetched = results[0]['fetched'] + results[1]['fetched']
+    assert sorted(fetched) == fund_ids
+    assert all(status == 'done' and attempts == 1 for _, status, attempts, _, _ in queue_rows(db_path))
+
+    # 每个worker导出到自己的指标文件
+    assert (metrics_dir / 'metrics_worker_1.json').exists()
+    assert (metrics_dir / 'metrics_worker_2.json').exists()
+
+
+def test_slow_fetch_does_not_hold_write_lock(tmp_path, metrics_dir):
+    db_path = tmp_path / 'funds.db'
+    n_batches = create_queue(db_path)
+    # 一个worker等待慢速获取时不持有写锁，另一个worker的写入和续约不被阻塞，租约不会因此过期被接手
+    start = time.time()
+    results = run_worker_processes(db_path, metrics_dir, ['worker:1', 'worker:2'], fetch='slow_fetch',
+                                   lease_seconds=1, concurrency=1)
+
+    fetched = results[0]['fetched'] + results[1]['fetched']
+    assert sorted(fetched) == fund_ids
+    assert all(status == 'done' and attempts == 1 for _, status, attempts, _, _ in queue_rows(db_path))
+    # 两个worker同时处理，慢速获取的等待时间重叠
+    assert time.time() - start < n_batches * 1.5
+
+
+def test_worker_takes_over_expired_lease(tmp_path, monkeypatch):
+    db_path = tmp_path / 'funds.db'
+    n_batches = create_queue(db_path)
+    use_fake_fetch(monkeypatch, fake_fetch)
+
+    # 模拟领取第一批后崩溃的worker
+    conn = work_queue._connect_queue_db(str(db_path))
+    crashed_batch_id, _ = work_queue.claim_batch(conn, 'fund_nav', 'crashed', lease_seconds=1.5)
+    lease_expires_at = time.time() + 1.5
+    # 其他批次处理完后等待租约到期，等待期间不持有写锁，其他连接可以写入
+    write_results = []
+
+    def write_during_wait():
+        writer = sqlite3.connect(db_path, timeout=0.5)
+        try:
+            writer.execute("UPDATE funds SET fund_name = 'x' WHERE fund_id = '000000'")
+            writer.commit()
+            write_results.append(None)
+        except sqlite3.OperationalError as e:
+            write_results.append(e)
+        finally:
+            writer.close()
+
+    timer = threading.Timer(1.0, write_during_wait)
+    timer.start()
+    finished = work_queue.run_worker(str(db_path), 'fund_nav', worker_id='survivor', lease_seconds=30,
+                                     concurrency=4, poll_seconds=0.2)
+    timer.join()
+    conn.close()
+
+    assert finished == n_batches
+    assert time.time() >= lease_expires_at
+    assert write_results == [None]
+    rows = {batch_id: (status, attempts, error) for batch_id, status, attempts, _, error in queue_rows(db_path)}
+    assert rows[crashed_batch_id] == ('done', 2, None)
+    assert all(status == 'done' for status, _, _ in rows.values())
+
+
+def test_failed_funds_are_requeued_then_marked_failed(tmp_path, monkeypatch):
+    db_path = tmp_path / 'funds.db'
+    n_batches = create_queue(db_path)
+    fetch_counts = {}
+
+    def flaky_fetch(fund_id):
+        fetch_counts[fund_id] = fetch_counts.get(fund_id, 0) + 1
+        if fund_id == '000005':
+            raise ValueError('empty data')
+        return [(fund_id, '2024-01-02', 1.0)]
+
+    use_fake_fetch(monkeypatch, flaky_fetch)
+    finished = work_queue.run_worker(str(db_path), 'fund_nav', worker_id='worker', max_attempts=2, concurrency=4,
+                                     poll_seconds=0.1)
+
+    assert finished == n_batches - 1
+    status, attempts, error = next((status, attempts, error) for _, status, attempts, _, error in queue_rows(db_path)
+                                   if status != 'done')
+    assert (status, attempts) == ('failed', 2)
+    assert '000005' in error
+    # 重新领取时只重试失败的基金
+    assert fetch_counts['000005'] == 2
+    assert all(count == 1 for fund_id, count in fetch_counts.items() if fund_id != '000005')
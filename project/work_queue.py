@@ -0,0 +1,315 @@
+import multiprocessing
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+import metrics
+from init_utils import (
+    get_all_fund_id_asc_from_db, history_data_sources, save_all_fund_basic_info, start_crawl_jobs,
+    sync_all_fund_history_data
+)
+
+# 任务名 -> 写入crawl_jobs的数据项，'history'为全部历史数据表
+work_queue_jobs = {
+    'funds': ['funds'],
+    'history': list(history_data_sources),
+    **{table_name: [table_name] for table_name in history_data_sources},
+}
+
+
+def _connect_queue_db(funds_db_file_path: str, timeout: float = 60):
+    # 自动提交模式，事务由BEGIN IMMEDIATE显式开始，领取任务时立即获得写锁，避免多个worker领到同一批
+    conn = sqlite3.connect(funds_db_file_path, timeout=timeout, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    return conn
+
+
+def create_if_not_exists_work_queue_table(funds_db_file_path: str):
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+
+    # 创建任务队列表，每行为一个任务的一批基金
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS work_queue (
+            batch_id INTEGER PRIMARY KEY,       -- 批次编号
+            job TEXT,                           -- 任务名，见work_queue_jobs
+            fund_ids TEXT,                      -- 逗号分隔的基金代码
+            status TEXT,                        -- pending: 待领取, leased: 处理中, done: 完成, failed: 多次失败后放弃
+            lease_owner TEXT,                   -- 领取该批的worker
+            lease_expires_at REAL,              -- 租约到期时间（unix时间戳），到期未续约则可被其他worker重新领取
+            attempts INTEGER,                   -- 已领取次数
+            updated_at TIMESTAMP,               -- 状态更新时间
+            error TEXT                          -- 最近一次失败原因
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_work_queue_job_status ON work_queue (job, status, lease_expires_at)')
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def enqueue_fund_batches(funds_db_file_path: str, job: str, fund_ids=None, batch_size: int = 50):
+    """把任务按基金分批放入队列，清除该任务之前的队列和crawl_jobs中的进度
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        job (str): 任务名，见work_queue_jobs
+        fund_ids (list, optional): 基金代码，为None时为funds表里所有基金. Defaults to None.
+        batch_size (int, optional): 每批的基金数. Defaults to 50.
+
+    Raises:
+        Exception: 任务名不存在
+
+    Returns:
+        int: 批数
+    """
+    if job not in work_queue_jobs:
+        raise Exception(f"Unknown job {job}, expected one of {list(work_queue_jobs)}")
+    create_if_not_exists_work_queue_table(funds_db_file_path)
+    if fund_ids is None:
+        fund_ids = get_all_fund_id_asc_from_db(funds_db_file_path)
+    fund_ids = list(fund_ids)
+    batches = [fund_ids[start:start + batch_size] for start in range(0, len(fund_ids), batch_size)]
+
+    conn = _connect_queue_db(funds_db_file_path)
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('DELETE FROM work_queue WHERE job = ?', (job,))
+        # worker以继续任务的方式处理每批，跳过已完成的基金，所以先清空进度
+        for indicator in work_queue_jobs[job]:
+            start_crawl_jobs(cursor, indicator, resume=False)
+        cursor.executemany('''
+            INSERT INTO work_queue (job, fund_ids, status, attempts, updated_at)
+            VALUES (?, ?, 'pending', 0, datetime('now', 'localtime'))
+        ''', [(job, ','.join(batch)) for batch in batches])
+        cursor.execute('COMMIT')
+    except Exception:
+        cursor.execute('ROLLBACK')
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    return len(batches)
+
+
+def claim_batch(conn, job: str, worker_id: str, lease_seconds: float, max_attempts: int = 3):
+    """领取一批待处理或租约已过期的基金
+
+    Args:
+        conn (sqlite3.Connection): _connect_queue_db返回的连接
+        job (str): 任务名
+        worker_id (str): worker标识
+        lease_seconds (float): 租约时长（秒）
+        max_attempts (int, optional): 一批最多被领取的次数，超过后标记为failed. Defaults to 3.
+
+    Returns:
+        tuple: (batch_id, 基金代码列表)，没有可领取的批次时为None
+    """
+    now = time.time()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        # 多次领取仍未完成（如每次都让worker崩溃）的批次不再重试
+        cursor.execute('''
+            UPDATE work_queue
+            SET status = 'failed', lease_owner = NULL, updated_at = datetime('now', 'localtime'),
+                error = COALESCE(error, 'lease expired')
+            WHERE job = ? AND status = 'leased' AND lease_expires_at < ? AND attempts >= ?
+        ''', (job, now, max_attempts))
+        cursor.execute('''
+            SELECT batch_id, fund_ids
+            FROM work_queue
+            WHERE job = ? AND (status = 'pending' OR (status = 'leased' AND lease_expires_at < ?))
+            ORDER BY batch_id
+            LIMIT 1
+        ''', (job, now))
+        row = cursor.fetchone()
+        if row is not None:
+            cursor.execute('''
+                UPDATE work_queue
+                SET status = 'leased', lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1,
+                    updated_at = datetime('now', 'localtime')
+                WHERE batch_id = ?
+            ''', (worker_id, now + lease_seconds, row[0]))
+        cursor.execute('COMMIT')
+    except Exception:
+        cursor.execute('ROLLBACK')
+        raise
+    finally:
+        cursor.close()
+
+    if row is None:
+        return None
+    return row[0], row[1].split(',') if row[1] else []
+
+
+def get_next_lease_expiry(conn, job: str):
+    """处理中的批次最早的租约到期时间
+
+    Returns:
+        float: unix时间戳，没有处理中的批次时为None
+    """
+    cursor = conn.execute('''
+        SELECT MIN(lease_expires_at) FROM work_queue WHERE job = ? AND status = 'leased'
+    ''', (job,))
+    return cursor.fetchone()[0]
+
+
+def renew_lease(conn, batch_id: int, worker_id: str, lease_seconds: float):
+    """续约，租约已被其他worker领走时返回False"""
+    cursor = conn.execute('''
+        UPDATE work_queue
+        SET lease_expires_at = ?
+        WHERE batch_id = ? AND lease_owner = ? AND status = 'leased'
+    ''', (time.time() + lease_seconds, batch_id, worker_id))
+    return cursor.rowcount == 1
+
+
+def finish_batch(conn, batch_id: int, worker_id: str, error: str = None, max_attempts: int = 3):
+    """结束一批：成功时标记为done；出错时放回队列，达到最多领取次数后标记为failed
+
+    Returns:
+        bool: 是否仍持有租约，为False时结果被忽略
+    """
+    if error is None:
+        cursor = conn.execute('''
+            UPDATE work_queue
+            SET status = 'done', lease_owner = NULL, updated_at = datetime('now', 'localtime'), error = NULL
+            WHERE batch_id = ? AND lease_owner = ? AND status = 'leased'
+        ''', (batch_id, worker_id))
+    else:
+        cursor = conn.execute('''
+            UPDATE work_queue
+            SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                lease_owner = NULL, updated_at = datetime('now', 'localtime'), error = ?
+            WHERE batch_id = ? AND lease_owner = ? AND status = 'leased'
+        ''', (max_attempts, error, batch_id, worker_id))
+    return cursor.rowcount == 1
+
+
+def process_batch(funds_db_file_path: str, job: str, fund_ids, concurrency: int = 8, incremental: bool = False):
+    """用现有的获取和写入流程处理一批基金。以继续任务的方式运行，批次被重新领取时跳过已完成的基金
+
+    Returns:
+        dict: 获取失败的基金及对应异常
+    """
+    if job == 'funds':
+        return save_all_fund_basic_info(funds_db_file_path, concurrency=concurrency, resume=True, fund_ids=fund_ids)
+    return sync_all_fund_history_data(funds_db_file_path, work_queue_jobs[job], incremental=incremental, resume=True,
+                                      concurrency=concurrency, commit_batch_size=20, fund_ids=fund_ids)
+
+
+def run_worker(funds_db_file_path: str, job: str, worker_id: str = None, lease_seconds: float = 300,
+               max_attempts: int = 3, concurrency: int = 8, incremental: bool = False, poll_seconds: float = 5):
+    """循环领取并处理批次，直到队列中没有待处理和处理中的批次。处理期间后台线程定期续约
+
+    没有可领取的批次但其他worker仍在处理时等待，其他worker崩溃、租约到期后接手其批次。
+    批次中有基金失败时放回队列，重新领取时只重试失败的基金，达到max_attempts后标记为failed。
+
+    Args:
+        funds_db_file_path (str): 数据库文件路径
+        job (str): 任务名
+        worker_id (str, optional): worker标识，为None时使用主机名和进程号. Defaults to None.
+        lease_seconds (float, optional): 租约时长（秒），worker崩溃后其批次在该时间后可被重新领取. Defaults to 300.
+        max_attempts (int, optional): 一批最多被领取的次数. Defaults to 3.
+        concurrency (int, optional): 每个worker同时获取的基金数. Defaults to 8.
+        incremental (bool, optional): 历史数据只写入比库中最新日期更新的数据. Defaults to False.
+        poll_seconds (float, optional): 等待其他worker时检查队列的间隔（秒）. Defaults to 5.
+
+    Returns:
+        int: 处理完成的批数
+    """
+    if worker_id is None:
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    # 多个worker导出到同一目录，按worker_id区分文件
+    metrics.default_registry.export_name = 'metrics_' + re.sub(r'[^\w.-]', '_', worker_id)
+    conn = _connect_queue_db(funds_db_file_path)
+    finished_batches = 0
+
+    try:
+        while True:
+            claimed = claim_batch(conn, job, worker_id, lease_seconds, max_attempts)
+            if claimed is None:
+                # 领取的事务已经提交，等待期间不持有写锁
+                next_expiry = get_next_lease_expiry(conn, job)
+                if next_expiry is None:
+                    break
+                time.sleep(min(max(next_expiry - time.time(), 0) + 0.01, poll_seconds))
+                continue
+            batch_id, fund_ids = claimed
+            print(f"{worker_id} 领取批次 {batch_id}，{len(fund_ids)} 个基金")
+
+            stop_heartbeat = threading.Event()
+
+            def heartbeat():
+                heartbeat_conn = _connect_queue_db(funds_db_file_path)
+                try:
+                    while not stop_heartbeat.wait(lease_seconds / 3):
+                        if not renew_lease(heartbeat_conn, batch_id, worker_id, lease_seconds):
+                            print(f"{worker_id} 批次 {batch_id} 的租约已失效")
+                            return
+                finally:
+                    heartbeat_conn.close()
+
+            heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+            heartbeat_thread.start()
+            error = None
+            try:
+                failed_funds = process_batch(funds_db_file_path, job, fund_ids, concurrency, incremental)
+                if failed_funds:
+                    first_fund, first_error = next(iter(failed_funds.items()))
+                    error = f'{len(failed_funds)} 个基金失败，如 {first_fund}: {first_error}'
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+            finally:
+                stop_heartbeat.set()
+                heartbeat_thread.join()
+            if error is not None:
+                print(f"{worker_id} 批次 {batch_id} 失败: {error}")
+
+            if finish_batch(conn, batch_id, worker_id, error, max_attempts) and error is None:
+                finished_batches += 1
+    finally:
+        conn.close()
+    return finished_batches
+
+
+def get_work_queue_status(funds_db_file_path: str, job: str):
+    """统计任务各状态的批数
+
+    Returns:
+        dict: {状态: 批数}，租约过期的leased计入expired
+    """
+    conn = sqlite3.connect(funds_db_file_path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT CASE WHEN status = 'leased' AND lease_expires_at < ? THEN 'expired' ELSE status END, COUNT(*)
+        FROM work_queue
+        WHERE job = ?
+        GROUP BY 1
+    ''', (time.time(), job))
+    status_counts = dict(cursor.fetchall())
+    cursor.close()
+    conn.close()
+    return status_counts
+
+
+def run_local_workers(funds_db_file_path: str, job: str, n_workers: int = 4, **worker_kwargs):
+    """在本机启动多个worker进程共同处理队列，全部结束后返回。Windows下调用方需放在 if __name__ == '__main__': 之下
+
+    Returns:
+        list: 各worker进程的退出码
+    """
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(funds_db_file_path, job), kwargs=worker_kwargs)
+        for _ in range(n_workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]